@@ -0,0 +1,105 @@
+"""
+受信フレームのアドミッション制御
+フレームサイズ上限はJSONのパースより前に、接続ごと・メッセージ種別ごとのトークンバケットは
+パースしたtypeで判定し、DB記録や配信より前に過剰なフレームを破棄する
+（typeはパース結果から取るため、本文に別のtypeを埋め込んでも他の分類のバケットは使えない）
+"""
+import json
+import os
+import time
+from typing import Dict, Tuple
+
+from app import metrics
+
+# フレームサイズの上限（バイト）。通常のリアクションフレームは数百バイト
+MAX_FRAME_BYTES = int(os.getenv("MAX_FRAME_BYTES", "8192"))
+
+# メッセージ分類ごとの (1秒あたりの補充量, バケット容量)
+# 環境変数 ADMISSION_LIMITS にJSONで指定すると上書きできる（例: {"reaction": [5, 10]}）
+DEFAULT_ADMISSION_LIMITS: Dict[str, Tuple[float, float]] = {
+    "reaction": (5, 10),   # リアクションデータ（通常は1秒に1回）
+    "video": (20, 40),     # video_play / video_pause / video_seek（シーク操作で連続する）
+    "sync": (5, 10),       # time_sync_request / time_sync_response / pong
+    "session": (2, 5),     # session_create / session_completed
+    "control": (5, 10),    # manual_effect / video_url_selected など
+}
+ADMISSION_LIMITS = dict(DEFAULT_ADMISSION_LIMITS)
+ADMISSION_LIMITS.update({k: tuple(v) for k, v in json.loads(os.getenv("ADMISSION_LIMITS", "{}")).items()})
+
+_MESSAGE_CLASSES = {
+    "reaction_delta": "reaction",
+    "video_play": "video",
+    "video_pause": "video",
+    "video_seek": "video",
+    "video_position": "video",
+    "time_sync_request": "sync",
+    "time_sync_response": "sync",
+    "pong": "sync",
+    "session_create": "session",
+    "session_completed": "session",
+}
+
+
+def classify_message(message_type) -> str:
+    """パースしたtypeのメッセージ分類を返す（typeのないフレームはリアクションデータ、未知のtypeは control）"""
+    if message_type is None:
+        return "reaction"
+    if not isinstance(message_type, str):
+        return "control"
+    return _MESSAGE_CLASSES.get(message_type, "control")
+
+
+def is_oversize(text: str, max_frame_bytes: int = MAX_FRAME_BYTES) -> bool:
+    """フレームがサイズ上限（UTF-8のバイト数）を超えているか"""
+    # 文字数はバイト数以下なので、文字数が上限以下かつASCIIのみなら確実に上限以下
+    return len(text) > max_frame_bytes or (not text.isascii() and len(text.encode("utf-8")) > max_frame_bytes)
+
+
+class TokenBucket:
+    """トークンバケット（時刻は time.monotonic() の秒）"""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def allow(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class AdmissionController:
+    """接続ごとのアドミッション制御"""
+    def __init__(self, limits: Dict[str, Tuple[float, float]] = ADMISSION_LIMITS,
+                 max_frame_bytes: int = MAX_FRAME_BYTES):
+        self.limits = limits
+        self.max_frame_bytes = max_frame_bytes
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def admit_frame(self, text: str) -> bool:
+        """フレームサイズ上限を判定する（JSONのパースより前に呼ぶ。False なら破棄）"""
+        if is_oversize(text, self.max_frame_bytes):
+            metrics.increment("ws.frames.rejected.oversize")
+            return False
+        return True
+
+    def admit(self, message_type) -> bool:
+        """パースしたtypeの分類のトークンバケットを消費する（False なら破棄）"""
+        message_class = classify_message(message_type)
+        bucket = self.buckets.get(message_class)
+        now = time.monotonic()
+        if bucket is None:
+            rate, capacity = self.limits.get(message_class, self.limits["control"])
+            bucket = self.buckets[message_class] = TokenBucket(rate, capacity, now)
+        if not bucket.allow(now):
+            metrics.increment(f"ws.frames.throttled.{message_class}")
+            return False
+
+        metrics.increment(f"ws.frames.accepted.{message_class}")
+        return True
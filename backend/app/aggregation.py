@@ -0,0 +1,537 @@
+"""
+集約エンジン
+全ユーザーのリアクションを時間窓で集約し、エフェクトを決定する
+
+FastAPIに依存しないため、オフラインのリプレイツールからも利用できる
+
+過負荷時（3秒窓のアクティブユーザー数が AGGREGATION_SAMPLING_USERS を超える、または1ティックの処理時間が
+AGGREGATION_TICK_BUDGET_MS を超える）は、アクティブユーザーからリザーバサンプリングで一様に選んだ
+AGGREGATION_SAMPLE_SIZE 人から ratio_state / density_event を推定するサンプリングモードに切り替え、
+負荷が下がると自動で厳密モードに戻る
+
+最新のサンプルが AGGREGATION_STALE_USER_MS より古いユーザーはティックごとに user_data から削除する
+（メモリと走査の量が過去の全視聴者ではなく現在の視聴者数で決まるようにする）
+
+ルールで windowMs を指定した指標は、観客全体の多段解像度の時間バケット（app/time_buckets.py）から
+ルールごとの窓の長さで読み出す（ユーザー数に依存しない）
+
+early_triggering が有効な場合は、受信ごとに増分カウンタ（app/early_trigger.py）を更新し、
+優先度の高いルールだけをティックを待たずに判定できる（early_effect()）
+"""
+import math
+import os
+import random
+import time
+from collections import deque, defaultdict
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional
+
+from app import metrics as service_metrics
+from app.early_trigger import EarlyTrigger
+from app.effect_rules import CompiledRuleSet, DEFAULT_RULE_SET
+from app.partial_aggregate import AUDIO_EVENTS, PartialAggregate, merge_partials
+from app.time_buckets import MAX_WINDOW_MS, TimeBuckets
+
+# 時計関数の型（UNIX秒を返す）
+Clock = Callable[[], float]
+
+# サンプリングモードの設定
+SAMPLING_USER_THRESHOLD = int(os.getenv("AGGREGATION_SAMPLING_USERS", "500"))  # これを超えるユーザー数でサンプリング
+AGGREGATION_TICK_BUDGET_MS = float(os.getenv("AGGREGATION_TICK_BUDGET_MS", "200"))  # 1ティックの処理時間の予算
+SAMPLE_SIZE = int(os.getenv("AGGREGATION_SAMPLE_SIZE", "200"))  # サンプリングするユーザー数
+STALE_USER_MS = int(os.getenv("AGGREGATION_STALE_USER_MS", "30000"))  # 最新のサンプルがこれより古いユーザーを削除
+# 厳密モードに戻す条件（切り替えがばたつかないよう、入る条件より低くする）
+SAMPLING_EXIT_USER_RATIO = 0.8  # アクティブユーザー数がしきい値のこの割合以下
+SAMPLING_EXIT_BUDGET_RATIO = 0.5  # 推定した厳密集約の処理時間が予算のこの割合未満
+CONFIDENCE_Z = 1.96  # 95%信頼区間
+
+WINDOW_MS = 3000  # windowMs を指定しないルールの時間窓（ユーザーごとのサンプルは最新3件＝3秒分）
+
+# 受信したサンプルの検証（スナップショットの固定長の形式に収まらない値を集約に入れない）
+MAX_REACTION_NAME_LENGTH = 64  # state名・event名の最大文字数
+MAX_REACTION_NAMES = 32  # 1サンプルあたりのstate・eventそれぞれの最大数
+EVENT_COUNT_MAX = 2 ** 31 - 1  # イベント回数の上限（int32）
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def sanitize_sample(data: dict, now_ms: float) -> dict:
+    """
+    クライアントから受信したサンプルを検証して正規化する
+
+    - timestamp: 数値でない（bool・NaN・無限大を含む）場合は受信時刻
+    - states / events: 文字列の名前（MAX_REACTION_NAME_LENGTH 文字以下）だけを最大 MAX_REACTION_NAMES 件
+    - イベント回数: 数値でないものは捨て、0〜EVENT_COUNT_MAX の整数に丸める
+    """
+    timestamp = data.get('timestamp')
+    if not _is_number(timestamp):
+        timestamp = now_ms
+        service_metrics.increment("aggregation.samples.invalid_timestamp")
+
+    states = data.get('states')
+    events = data.get('events')
+    clean_states = {}
+    if isinstance(states, dict):
+        for name, is_active in states.items():
+            if isinstance(name, str) and len(name) <= MAX_REACTION_NAME_LENGTH and len(clean_states) < MAX_REACTION_NAMES:
+                clean_states[name] = bool(is_active)
+    clean_events = {}
+    if isinstance(events, dict):
+        for name, count in events.items():
+            if isinstance(name, str) and len(name) <= MAX_REACTION_NAME_LENGTH and len(clean_events) < MAX_REACTION_NAMES \
+                    and _is_number(count):
+                clean_events[name] = min(max(int(count), 0), EVENT_COUNT_MAX)
+    return {'timestamp': timestamp, 'states': clean_states, 'events': clean_events}
+
+
+def reservoir_sample(items: Iterable, k: int, rng: random.Random) -> list:
+    """リザーバサンプリング（Algorithm R）で items から一様に k 件を選ぶ"""
+    reservoir = []
+    for i, item in enumerate(items):
+        if i < k:
+            reservoir.append(item)
+        else:
+            j = rng.randrange(i + 1)
+            if j < k:
+                reservoir[j] = item
+    return reservoir
+
+
+def _finite_population_correction(population: int, sample: int) -> float:
+    if population <= 1 or sample >= population:
+        return 0.0
+    return math.sqrt((population - sample) / (population - 1))
+
+class UserReactionData:
+    """ユーザーごとのリアクションデータを管理"""
+    def __init__(self, user_id: str, max_samples: int = 3, clock: Clock = time.time):
+        self.user_id = user_id
+        self.samples = deque(maxlen=max_samples)  # 最新3秒分のデータ
+        self.clock = clock
+
+    def add_sample(self, data: dict) -> dict:
+        """新しいサンプルを検証して追加（返り値: 追加したサンプル）"""
+        sample = sanitize_sample(data, self.clock() * 1000)
+        self.samples.append(sample)
+        return sample
+
+    def latest_timestamp(self) -> float:
+        """最も新しいサンプルの時刻（サンプルがなければ -inf）"""
+        return max((s['timestamp'] for s in self.samples), default=float('-inf'))
+
+    def get_recent_samples(self, window_ms: int = 3000, now_ms: Optional[float] = None) -> List[dict]:
+        """指定時間窓内のサンプルを取得"""
+        if now_ms is None:
+            now_ms = self.clock() * 1000
+        cutoff = now_ms - window_ms
+        return [s for s in self.samples if s['timestamp'] > cutoff]
+
+
+class AggregationEngine:
+    """集約エンジン：全ユーザーのデータを集約してエフェクトを決定
+
+    Args:
+        clock: 現在時刻（UNIX秒）を返す関数。リプレイ時は仮想時計を注入する
+        verbose: Falseの場合は集約ごとのログ出力を抑制する
+        rules: コンパイル済みのエフェクト判定ルール（省略時は組み込みのルール表）
+        load_shedding: Falseの場合は過負荷でもサンプリングモードに切り替えない（リプレイ用）
+        early_triggering: Falseの場合は受信時の即時判定用のカウンタを更新しない（リプレイ用）
+        rng: サンプリングに使う乱数生成器
+    """
+    def __init__(self, clock: Clock = time.time, verbose: bool = True, rules: Optional[CompiledRuleSet] = None,
+                 load_shedding: bool = True, sample_size: int = SAMPLE_SIZE,
+                 sampling_user_threshold: int = SAMPLING_USER_THRESHOLD,
+                 tick_budget_ms: float = AGGREGATION_TICK_BUDGET_MS, rng: Optional[random.Random] = None,
+                 early_triggering: bool = True, stale_user_ms: int = STALE_USER_MS):
+        self.clock = clock
+        self.verbose = verbose
+        self.rules = rules if rules is not None else DEFAULT_RULE_SET
+        self.load_shedding = load_shedding
+        self.sample_size = sample_size
+        self.sampling_user_threshold = sampling_user_threshold
+        self.tick_budget_ms = tick_budget_ms
+        self.stale_user_ms = stale_user_ms
+        self.rng = rng if rng is not None else random.Random()
+        self.sampling = False  # サンプリングモード中か
+        self.last_tick_ms = 0.0  # 直近のティックの処理時間
+        self.early_trigger = EarlyTrigger() if early_triggering else None
+        self.time_buckets = TimeBuckets()  # windowMs を指定したルール用（観客全体）
+        self.user_data: Dict[str, UserReactionData] = {}
+        self.user_has_microphone: Dict[str, bool] = {}  # ユーザーごとのマイク許可状態
+        self.last_effect_type = None
+        self.last_aggregation_time = clock()
+
+    def _log(self, message: str):
+        if self.verbose:
+            print(message)
+
+    def set_rules(self, rules: CompiledRuleSet):
+        """ルールセットを差し替える（参照の代入のみなので集約中のティックとは競合しない）"""
+        self.rules = rules
+        self._log(f"🔁 エフェクト判定ルールを更新: {rules.origin} ({len(rules.rules)}件)")
+
+    def update_user_data(self, user_id: str, data: dict):
+        """ユーザーデータを更新"""
+        if user_id not in self.user_data:
+            self.user_data[user_id] = UserReactionData(user_id, clock=self.clock)
+        sample = self.user_data[user_id].add_sample(data)
+
+        # マイク許可状態を記録
+        if 'hasMicrophone' in data:
+            self.user_has_microphone[user_id] = bool(data['hasMicrophone'])
+
+        now_ms = self.clock() * 1000
+        # サンプルの時刻（受信時刻より未来の時刻は受信時刻に丸める）
+        sample_ms = min(sample['timestamp'], now_ms)
+        states = sample['states']
+        events = sample['events']
+        has_microphone = self.user_has_microphone.get(user_id, False)
+        # 窓より古いサンプル（スナップショットからの復元など）は時間バケット・即時判定のカウンタに入れない
+        if sample_ms > now_ms - MAX_WINDOW_MS:
+            self.time_buckets.add(sample_ms, states, events, has_microphone)
+        if self.early_trigger is not None and sample_ms > now_ms - self.early_trigger.window_ms:
+            self.early_trigger.observe(user_id, states, events, has_microphone, sample_ms)
+
+    def remove_user(self, user_id: str):
+        """切断したユーザーのデータを破棄する（窓から外れるのを待たずに集約・即時判定の対象から外す）"""
+        self.user_data.pop(user_id, None)
+        self.user_has_microphone.pop(user_id, None)
+        if self.early_trigger is not None:
+            self.early_trigger.forget(user_id)
+
+    def evict_stale_users(self, now_ms: float) -> int:
+        """
+        最新のサンプルが stale_user_ms より古いユーザーを削除する
+        返り値: 削除したユーザー数
+        """
+        cutoff = now_ms - self.stale_user_ms
+        stale = [uid for uid, user_reaction in self.user_data.items() if user_reaction.latest_timestamp() <= cutoff]
+        for user_id in stale:
+            self.user_data.pop(user_id, None)
+            self.user_has_microphone.pop(user_id, None)
+        if stale:
+            service_metrics.increment("aggregation.users.evicted", len(stale))
+        return len(stale)
+
+    def windowed_metrics(self, now_ms: float, rules: Optional[CompiledRuleSet] = None) -> dict:
+        """
+        windowMs を指定したルールの指標を時間バケットから読み出す
+        返り値: {"ratioState": {...}, "densityEvent": {...}}（窓内にサンプルがない指標は含めない）
+        """
+        if rules is None:
+            rules = self.rules
+        values = {"ratioState": {}, "densityEvent": {}}
+        for rule in rules.rules:
+            window_ms = rules.windows.get(rule['metric'])
+            if window_ms is None:
+                continue
+            value = self.time_buckets.metric_value(rule['source'], rule['metric'], window_ms, now_ms)
+            if value is not None:
+                values[rule['source']][rule['metric']] = value
+        return values
+
+    def compute_rule_metrics(self, now_ms: Optional[float] = None, rules: Optional[CompiledRuleSet] = None,
+                             sampling: bool = False) -> Optional[dict]:
+        """
+        ルールセットが参照する指標を計算する
+        3秒窓の指標はユーザーごとの集約（sampling=True ならサンプリング推定）、
+        windowMs を指定した指標は時間バケットから読み出して同じ辞書にまとめる
+        返り値: 集約指標 or None（3秒窓のアクティブユーザーなし）
+        """
+        if now_ms is None:
+            now_ms = self.clock() * 1000
+        if rules is None:
+            rules = self.rules
+        if sampling:
+            metrics = self.estimate_window_metrics(now_ms, WINDOW_MS, rules.state_metrics, rules.event_metrics)
+        else:
+            metrics = self.compute_window_metrics(now_ms, WINDOW_MS, rules.state_metrics, rules.event_metrics)
+        if metrics is not None and rules.windows:
+            windowed = self.windowed_metrics(now_ms, rules)
+            metrics['ratioState'].update(windowed['ratioState'])
+            metrics['densityEvent'].update(windowed['densityEvent'])
+        return metrics
+
+    def early_values(self, now_ms: Optional[float] = None,
+                     rules: Optional[CompiledRuleSet] = None) -> Optional[Dict[str, float]]:
+        """即時判定ルールの現在の指標値（閾値スイープの事前計算にも使う。アクティブユーザーなしはNone）"""
+        if now_ms is None:
+            now_ms = self.clock() * 1000
+        if rules is None:
+            rules = self.rules
+        windowed = self.windowed_metrics(now_ms, rules) if rules.windows else None
+        return self.early_trigger.metric_values(rules.early_rules, now_ms, windowed)
+
+    def early_effect(self) -> Optional[dict]:
+        """
+        受信直後に即時判定ルールだけを判定する（update_user_data の後に呼ぶ）
+        返り値: エフェクト指示データ or None
+        """
+        rules = self.rules
+        if self.early_trigger is None or not rules.early_rules:
+            return None
+        now_ms = self.clock() * 1000
+        decision = self.early_trigger.decide(rules.early_rules, self.early_values(now_ms, rules), now_ms)
+        if decision is None:
+            return None
+        rule, intensity, values = decision
+        source = rule['source']
+        service_metrics.increment("effects.early.triggered")
+        self._log(f"⚡ {rule['label']}効果を即時発動! (intensity: {intensity:.2f})")
+        return {
+            "type": "effect",
+            "effectType": rule['effectType'],
+            "intensity": intensity,
+            "durationMs": 2000,
+            "timestamp": int(now_ms),
+            "debug": {
+                "activeUsers": len(self.early_trigger.user_states),
+                "ratioState": values if source == 'ratioState' else {},
+                "densityEvent": values if source == 'densityEvent' else {},
+                "mode": "early"
+            }
+        }
+
+    def compute_partial(self, now_ms: Optional[float] = None, window_ms: int = 3000,
+                        state_metrics: Optional[FrozenSet[str]] = None,
+                        event_metrics: Optional[FrozenSet[str]] = None,
+                        user_ids: Optional[Iterable[str]] = None) -> PartialAggregate:
+        """
+        時間窓内のサンプルを部分集約にまとめる
+
+        user_ids を指定した場合はそのユーザーだけを数える（シャード・ルームごとのサブ集約用）
+        """
+        if now_ms is None:
+            now_ms = self.clock() * 1000
+        if user_ids is None:
+            users = self.user_data.items()
+        else:
+            users = ((uid, self.user_data[uid]) for uid in user_ids if uid in self.user_data)
+
+        partial = PartialAggregate()
+        for user_id, user_reaction in users:
+            # 有効ユーザー（3秒以内にデータ送信があったユーザー）のみ
+            recent_samples = user_reaction.get_recent_samples(window_ms, now_ms)
+            if recent_samples:
+                partial.add_user(recent_samples, self.user_has_microphone.get(user_id, False),
+                                 state_metrics, event_metrics)
+        return partial
+
+    def compute_window_metrics(self, now_ms: Optional[float] = None, window_ms: int = 3000,
+                               state_metrics: Optional[FrozenSet[str]] = None,
+                               event_metrics: Optional[FrozenSet[str]] = None) -> Optional[dict]:
+        """
+        時間窓内のサンプルから集約指標（ratio_state, density_event）を計算する
+
+        state_metrics / event_metrics を指定した場合はその指標だけを計算する
+        返り値: 集約指標 or None（アクティブユーザーなし）
+        """
+        return self.compute_partial(now_ms, window_ms, state_metrics, event_metrics).to_metrics(window_ms)
+
+    def estimate_window_metrics(self, now_ms: Optional[float] = None, window_ms: int = 3000,
+                                state_metrics: Optional[FrozenSet[str]] = None,
+                                event_metrics: Optional[FrozenSet[str]] = None) -> Optional[dict]:
+        """
+        時間窓内にサンプルがあるユーザーから一様にサンプリングして集約指標を推定する（サンプリングモード）
+
+        返り値は compute_window_metrics と同じ形式（activeUsers はアクティブユーザー数、microphoneUsers は推定値）に、
+        推定の信頼区間を含む "sampling" を加えたもの
+        """
+        if now_ms is None:
+            now_ms = self.clock() * 1000
+
+        # 母集団は窓内にサンプルがあるユーザー（最新の時刻だけを見るのでユーザーあたりO(1)）
+        cutoff = now_ms - window_ms
+        active = [item for item in self.user_data.items() if item[1].latest_timestamp() > cutoff]
+        population = len(active)
+        sampled = reservoir_sample(active, self.sample_size, self.rng)
+        active_users = {}
+        for user_id, user_reaction in sampled:
+            recent_samples = user_reaction.get_recent_samples(window_ms, now_ms)
+            if recent_samples:
+                active_users[user_id] = recent_samples
+
+        if not active_users:
+            return None
+
+        num_sampled_active = len(active_users)
+        est_active_users = population
+        active_fpc = _finite_population_correction(est_active_users, num_sampled_active)
+
+        # ratio_state: サンプル内の比率とその信頼区間（有限母集団修正つき）
+        state_counts = defaultdict(int)
+        for samples in active_users.values():
+            states = samples[-1].get('states', {})
+            names = state_metrics if state_metrics is not None else states.keys()
+            for state_name in names:
+                if states.get(state_name):
+                    state_counts[state_name] += 1
+
+        ratio_state = {}
+        ratio_interval = {}
+        for state_name, count in state_counts.items():
+            p = count / num_sampled_active
+            half_width = CONFIDENCE_Z * math.sqrt(p * (1 - p) / num_sampled_active) * active_fpc
+            ratio_state[state_name] = p
+            ratio_interval[state_name] = [max(0.0, p - half_width), min(1.0, p + half_width)]
+
+        # density_event: ユーザーごとの合計の平均とその信頼区間
+        user_totals = {}
+        event_names = set()
+        for user_id, samples in active_users.items():
+            totals = defaultdict(int)
+            for sample in samples:
+                events = sample.get('events', {})
+                names = [name for name in event_metrics if name in events] if event_metrics is not None else events.keys()
+                for event_name in names:
+                    totals[event_name] += events[event_name]
+            user_totals[user_id] = totals
+            event_names.update(totals.keys())
+
+        microphone_users = [uid for uid in active_users if self.user_has_microphone.get(uid, False)]
+        est_microphone_users = round(est_active_users * len(microphone_users) / num_sampled_active)
+
+        # 分母（音声イベントはマイクありユーザー数、それ以外は全アクティブユーザー数）も
+        # サンプルからの推定なので、比推定量 R = Σy / Σx とその信頼区間を使う
+        density_event = {}
+        density_interval = {}
+        window_seconds = window_ms / 1000
+        users = list(active_users)
+        for event_name in event_names:
+            if event_name in AUDIO_EVENTS:
+                weights = [1 if self.user_has_microphone.get(uid, False) else 0 for uid in users]
+            else:
+                weights = [1] * len(users)
+            weight_total = sum(weights)
+            if weight_total == 0:
+                density_event[event_name] = 0.0
+                density_interval[event_name] = None
+                continue
+            values = [user_totals[uid].get(event_name, 0) for uid in users]
+            ratio = sum(values) / weight_total
+            density = ratio / window_seconds
+            density_event[event_name] = density
+            if len(values) < 2:
+                density_interval[event_name] = None
+                continue
+            residual_variance = sum((v - ratio * w) ** 2 for v, w in zip(values, weights)) / (len(values) - 1)
+            mean_weight = weight_total / len(values)
+            half_width = (CONFIDENCE_Z * math.sqrt(residual_variance / len(values)) / mean_weight
+                          * active_fpc / window_seconds)
+            density_interval[event_name] = [max(0.0, density - half_width), density + half_width]
+
+        return {
+            "activeUsers": est_active_users,
+            "microphoneUsers": est_microphone_users,
+            "ratioState": ratio_state,
+            "densityEvent": density_event,
+            "sampling": {
+                "sampleSize": len(sampled),
+                "sampledActiveUsers": num_sampled_active,
+                "populationUsers": population,
+                "confidenceLevel": 0.95,
+                "ratioStateInterval": ratio_interval,
+                "densityEventInterval": density_interval
+            }
+        }
+
+    def _update_load_mode(self, elapsed_ms: float, population: int):
+        """
+        ティックの処理時間とアクティブユーザー数からサンプリングモードの切り替えを判定する
+        population: 3秒窓内にサンプルがあるユーザー数（過去に接続しただけのユーザーは数えない）
+        """
+        self.last_tick_ms = elapsed_ms
+        if not self.load_shedding:
+            return
+        if not self.sampling:
+            if population > self.sampling_user_threshold or elapsed_ms > self.tick_budget_ms:
+                self.sampling = True
+                service_metrics.increment("aggregation.mode.sampling_entered")
+                print(f"⚡ 集約をサンプリングモードに切り替え (ユーザー: {population}, 処理時間: {elapsed_ms:.1f}ms)")
+            return
+
+        # サンプリング時の処理時間から厳密集約の処理時間を推定する
+        estimated_exact_ms = elapsed_ms * population / max(1, min(population, self.sample_size))
+        if (population <= self.sampling_user_threshold * SAMPLING_EXIT_USER_RATIO
+                and estimated_exact_ms < self.tick_budget_ms * SAMPLING_EXIT_BUDGET_RATIO):
+            self.sampling = False
+            service_metrics.increment("aggregation.mode.sampling_exited")
+            print(f"✅ 集約を厳密モードに戻しました (ユーザー: {population})")
+
+    def aggregate(self) -> Optional[dict]:
+        """
+        3秒窓（windowMs を指定したルールはその窓）でデータを集約し、エフェクト判定を行う
+        返り値: エフェクト指示データ or None
+        """
+        now_ms = self.clock() * 1000
+        # 集約の途中でルールが差し替えられても一貫した判定になるよう参照を固定する
+        rules = self.rules
+        sampling = self.sampling
+        started = time.perf_counter()
+        metrics = self.compute_rule_metrics(now_ms, rules, sampling)
+        self._update_load_mode((time.perf_counter() - started) * 1000, metrics['activeUsers'] if metrics else 0)
+        self.evict_stale_users(now_ms)
+        return self.decide(metrics, now_ms, rules, sampling)
+
+    def aggregate_partials(self, partials: Iterable[PartialAggregate], now_ms: Optional[float] = None,
+                           window_ms: int = 3000) -> Optional[dict]:
+        """
+        サブ集約で計算した部分集約をマージしてエフェクト判定を行う（コーディネータ用）
+        部分集約は self.rules の state_metrics / event_metrics で計算しておくこと
+        （windowMs を指定したルールの指標は部分集約に含まれないため判定されない）
+        """
+        if now_ms is None:
+            now_ms = self.clock() * 1000
+        metrics = merge_partials(partials).to_metrics(window_ms)
+        return self.decide(metrics, now_ms, self.rules)
+
+    def decide(self, metrics: Optional[dict], now_ms: float, rules: Optional[CompiledRuleSet] = None,
+               sampling: bool = False) -> Optional[dict]:
+        """
+        集約指標からエフェクト判定を行う
+        返り値: エフェクト指示データ or None
+        """
+        if rules is None:
+            rules = self.rules
+        if metrics is None:
+            self._log("⚠️ アクティブユーザーなし")
+            return None
+
+        num_active_users = metrics['activeUsers']
+        ratio_state = metrics['ratioState']
+        density_event = metrics['densityEvent']
+        mode_label = " [サンプリング推定]" if sampling else ""
+        self._log(f"\n📊 集約処理開始 (アクティブユーザー: {num_active_users}){mode_label}")
+        self._log(f"  📈 ratio_state: {ratio_state}")
+        self._log(f"  📈 density_event: {density_event} (マイクあり: {metrics['microphoneUsers']}/{num_active_users})")
+
+        # ========================
+        # エフェクト判定（優先順位付き）
+        # ========================
+        decision = rules.evaluate(ratio_state, density_event)
+
+        if decision:
+            rule, intensity = decision
+            debug = {
+                "activeUsers": num_active_users,
+                "ratioState": ratio_state,
+                "densityEvent": density_event,
+                "mode": "sampled" if sampling else "exact"
+            }
+            if rules.windows:
+                debug["windowMs"] = dict(rules.windows)
+            if sampling:
+                debug["sampling"] = metrics['sampling']
+            self._log(f"  ✨ {rule['label']}効果発動! (intensity: {intensity:.2f})")
+            return {
+                "type": "effect",
+                "effectType": rule['effectType'],
+                "intensity": intensity,
+                "durationMs": 2000,
+                "timestamp": int(now_ms),
+                "debug": debug
+            }
+
+        self._log("  ⏸️ エフェクト発動条件を満たさず")
+        return None
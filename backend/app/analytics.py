@@ -0,0 +1,121 @@
+"""
+セッション横断の分析API（キャッシュ付き）
+実験群ごとのリアクション率・エフェクトタイプ別の回数・セッションの所要時間と完了率を、
+分析レポート（app/report.py）と同じSQLの集計で計算し、クエリのパラメータをキーにした
+上限付きのキャッシュに保持する
+
+- 数秒ごとに更新するダッシュボードはキャッシュ（メモリ）から返し、本番DBの全件集計を繰り返さない
+- セッションの完了時・生ログのアーカイブ時にキャッシュ全体を無効化する（進行中のセッションの分は ANALYTICS_CACHE_TTL で更新）
+- 同じキーの計算中に届いたリクエストは、その計算の結果を待つ（同時に同じ集計を走らせない）
+- 集計はスレッドで実行し、イベントループを止めない
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+
+from app import metrics
+from app.report import SECTIONS, ReportFilter, existing_tables, json_value, missing_requirements, run_section
+
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "64"))  # 保持するクエリ結果の数
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "300"))  # 無効化がなくても再計算するまでの時間（秒）
+
+# APIのセクション名 → レポートのセクション
+ANALYTICS_SECTIONS = {
+    "reactions": "reactions_by_group",  # 実験群ごとのstate率・イベント合計
+    "effects": "effects_by_group",      # 実験群・エフェクトタイプ別の回数
+    "sessions": "sessions_by_group",    # 実験群ごとのセッション数・完了率・所要時間
+}
+
+
+def compute_analytics(conn, db_type: str, sections: Sequence[str], filters: ReportFilter,
+                      group: Optional[str] = None) -> dict:
+    """分析結果を計算する（集計はSQL、結果の行数は実験群 × エフェクトタイプ程度）"""
+    cursor = conn.cursor()
+    options = {"tables": set(existing_tables(cursor, db_type))}
+    result: Dict[str, object] = {}
+    for section in sections:
+        name = ANALYTICS_SECTIONS[section]
+        missing = missing_requirements(cursor, db_type, SECTIONS[name][2])
+        if missing:
+            result[section] = {"skipped": missing}
+            continue
+        columns, rows = run_section(conn, db_type, name, filters, options)
+        records = [{column: json_value(value) for column, value in zip(columns, row)} for row in rows]
+        if group:
+            records = [record for record in records if record.get("experiment_group") == group]
+        result[section] = records
+    return {"sections": result, "computedAt": datetime.now().isoformat()}
+
+
+class AnalyticsCache:
+    """クエリのパラメータ → 分析結果（LRUで件数の上限、TTLで期限切れ、無効化で全削除）"""
+
+    def __init__(self, max_entries: int = ANALYTICS_CACHE_SIZE, ttl: float = ANALYTICS_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (期限, 結果)
+        self.inflight: Dict[Hashable, asyncio.Future] = {}
+        self.generation = 0  # 無効化の回数（無効化前に始まった計算の結果は保存しない）
+
+    async def get(self, key: Hashable, compute: Callable[[], dict]) -> tuple:
+        """
+        キャッシュから結果を返す（なければスレッドで compute を実行）
+        返り値: (結果, キャッシュから返したか)
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                metrics.increment("analytics.cache.hit")
+                return entry[1], True
+            del self.entries[key]
+
+        inflight = self.inflight.get(key)
+        if inflight is not None:
+            metrics.increment("analytics.cache.joined")
+            return await asyncio.shield(inflight), True
+
+        metrics.increment("analytics.cache.miss")
+        generation = self.generation
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            value = await asyncio.to_thread(compute)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 待っているリクエストがなくても警告を出さない
+            raise
+        finally:
+            self.inflight.pop(key, None)
+        future.set_result(value)
+
+        if generation == self.generation:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                metrics.increment("analytics.cache.evicted")
+        return value, False
+
+    def invalidate(self):
+        """全結果を破棄する（セッション完了・アーカイブ時）"""
+        self.entries.clear()
+        self.generation += 1
+        metrics.increment("analytics.cache.invalidated")
+
+    def describe(self) -> dict:
+        return {"entries": len(self.entries), "maxEntries": self.max_entries, "ttlSeconds": self.ttl,
+                "inflight": len(self.inflight)}
+
+
+def parse_sections(value: Optional[str]) -> List[str]:
+    """カンマ区切りのセクション名（省略時は全セクション）"""
+    if not value:
+        return list(ANALYTICS_SECTIONS)
+    sections = [section.strip() for section in value.split(",") if section.strip()]
+    unknown = [section for section in sections if section not in ANALYTICS_SECTIONS]
+    if unknown:
+        raise ValueError(f"不明なセクション: {', '.join(unknown)}（{', '.join(ANALYTICS_SECTIONS)}）")
+    return sections
@@ -0,0 +1,71 @@
+"""
+配信チャンネルの購読
+クライアントは接続時の初回メッセージ（"subscribe"）で受け取るチャンネルを指定し、
+サーバーは購読しているチャンネルのメッセージだけを作成・送信する
+
+- effects: エフェクト指示（type: effect）
+- debug: エフェクト指示に付く判定の内訳（debug オブジェクト、デバッグオーバーレイ用）
+- acks: リアクションデータの受信確認（type: data_received）
+- sync: 動画操作・時刻同期（video_* / time_sync_*）
+- host_counts: ホスト向けの接続人数（type: connection_count）
+
+"subscribe" を送らないクライアントは従来どおり全チャンネルを受け取る
+接続確認・ping・セッション応答など、チャンネルに属さないメッセージは常に送信する
+"""
+import json
+from typing import Dict, FrozenSet, Optional
+
+CHANNELS = ('effects', 'debug', 'acks', 'sync', 'host_counts')
+DEFAULT_SUBSCRIPTIONS: FrozenSet[str] = frozenset(CHANNELS)
+
+MESSAGE_CHANNELS: Dict[str, str] = {
+    'effect': 'effects',
+    'data_received': 'acks',
+    'video_play': 'sync',
+    'video_pause': 'sync',
+    'video_seek': 'sync',
+    'video_url_selected': 'sync',
+    'time_sync_request': 'sync',
+    'time_sync_response': 'sync',
+    'connection_count': 'host_counts',
+}
+
+
+def parse_subscriptions(value) -> FrozenSet[str]:
+    """初回メッセージの "subscribe" を購読チャンネルの集合にする（未指定なら全チャンネル、不明な名前は無視）"""
+    if not isinstance(value, list):
+        return DEFAULT_SUBSCRIPTIONS
+    return frozenset(name for name in value if name in CHANNELS)
+
+
+def message_channel(message: dict) -> Optional[str]:
+    """メッセージが属するチャンネル（None は常に送信）"""
+    return MESSAGE_CHANNELS.get(message.get('type'))
+
+
+class EncodedMessage:
+    """
+    1つのメッセージのJSONを、debug を含む版・含まない版ごとに1回だけ作る
+    ブロードキャストで接続ごとに send_json（毎回 json.dumps）しないために使う
+    """
+    __slots__ = ('message', 'channel', '_texts')
+
+    def __init__(self, message: dict):
+        self.message = message
+        self.channel = message_channel(message)
+        self._texts: Dict[bool, str] = {}
+
+    def accepts(self, subscriptions: FrozenSet[str]) -> bool:
+        return self.channel is None or self.channel in subscriptions
+
+    def text(self, subscriptions: FrozenSet[str]) -> str:
+        include_debug = 'debug' in self.message and 'debug' in subscriptions
+        text = self._texts.get(include_debug)
+        if text is None:
+            payload = self.message
+            if 'debug' in payload and not include_debug:
+                payload = {key: value for key, value in payload.items() if key != 'debug'}
+            # starlette の send_json と同じ形式
+            text = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+            self._texts[include_debug] = text
+        return text
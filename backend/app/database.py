@@ -3,6 +3,7 @@
 SQLiteとPostgreSQLの両方に対応
 """
 import os
+import sys
 from pathlib import Path
 from contextlib import contextmanager
 from typing import Optional
@@ -28,11 +29,12 @@ else:
     DB_PATH = DB_DIR / "live_reaction.db"
     DB_DIR.mkdir(exist_ok=True)
 
-print(f"🔧 データベースタイプ: {DB_TYPE}")
+# 標準出力はレポートなどのツールの出力に使うため、標準エラーに出す
+print(f"🔧 データベースタイプ: {DB_TYPE}", file=sys.stderr)
 if DB_TYPE == "sqlite":
-    print(f"   パス: {DB_PATH}")
+    print(f"   パス: {DB_PATH}", file=sys.stderr)
 else:
-    print(f"   URL: {DATABASE_URL[:30]}...")
+    print(f"   URL: {DATABASE_URL[:30]}...", file=sys.stderr)
 
 
 @contextmanager
@@ -52,6 +54,36 @@ def get_db_connection():
             conn.close()
 
 
+@contextmanager
+def open_db(sqlite_path: Optional[str] = None):
+    """
+    オフラインツール用の接続コンテキストマネージャー
+
+    Args:
+        sqlite_path: 指定された場合はそのSQLiteファイルに接続（DATABASE_URLより優先）
+
+    Yields:
+        (conn, db_type) のタプル
+    """
+    if sqlite_path:
+        import sqlite3 as _sqlite3
+        conn = _sqlite3.connect(str(sqlite_path))
+        try:
+            yield conn, "sqlite"
+        finally:
+            conn.close()
+    else:
+        with get_db_connection() as conn:
+            yield conn, DB_TYPE
+
+
+def adapt_query(query: str, db_type: Optional[str] = None) -> str:
+    """プレースホルダー（%s）を接続先のDBに合わせて変換"""
+    if (db_type or DB_TYPE) == "sqlite":
+        return query.replace("%s", "?")
+    return query
+
+
 def execute_query(query: str, params: tuple = (), fetch: str = None):
     """
     クエリを実行するヘルパー関数
@@ -62,8 +94,7 @@ def execute_query(query: str, params: tuple = (), fetch: str = None):
         fetch: 'one', 'all', None
     """
     # SQLiteの場合は%sを?に変換
-    if DB_TYPE == "sqlite":
-        query = query.replace("%s", "?")
+    query = adapt_query(query)
 
     with get_db_connection() as conn:
         cursor = conn.cursor()
@@ -95,7 +126,8 @@ def init_database():
                 CREATE TABLE IF NOT EXISTS users (
                     id TEXT PRIMARY KEY,
                     experiment_group TEXT NOT NULL,
-                    created_at BIGINT NOT NULL
+                    created_at BIGINT NOT NULL,
+                    is_host BOOLEAN DEFAULT FALSE
                 )
             """)
         else:
@@ -103,7 +135,8 @@ def init_database():
                 CREATE TABLE IF NOT EXISTS users (
                     id TEXT PRIMARY KEY,
                     experiment_group TEXT NOT NULL,
-                    created_at INTEGER NOT NULL
+                    created_at INTEGER NOT NULL,
+                    is_host BOOLEAN DEFAULT 0
                 )
             """)
         print("✅ usersテーブルを作成しました")
@@ -137,48 +170,21 @@ def init_database():
             """)
         print("✅ sessionsテーブルを作成しました")
 
-        # reactions_logテーブル
-        if DB_TYPE == "postgresql":
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS reactions_log (
-                    id SERIAL PRIMARY KEY,
-                    session_id TEXT,
-                    user_id TEXT NOT NULL,
-                    timestamp BIGINT NOT NULL,
-                    video_time REAL,
-                    is_smiling BOOLEAN,
-                    is_surprised BOOLEAN,
-                    is_concentrating BOOLEAN,
-                    is_hand_up BOOLEAN,
-                    nod_count INTEGER DEFAULT 0,
-                    sway_vertical_count INTEGER DEFAULT 0,
-                    cheer_count INTEGER DEFAULT 0,
-                    clap_count INTEGER DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users(id),
-                    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
-                )
-            """)
+        # リアクションログ（reaction_samples + 代理キー + 登録簿 + デコード用ビュー reactions_log）
+        # 従来形式の reactions_log テーブルは変換しない（python -m app.reaction_store で明示的に変換する）
+        from app.reaction_store import ensure_packed_schema, legacy_table_exists
+        ensure_packed_schema(conn, DB_TYPE)
+        if legacy_table_exists(conn.cursor(), DB_TYPE):
+            print("✅ reaction_samplesテーブルを作成しました")
+            print("⚠️ 従来形式のreactions_logテーブルがあります。"
+                  "python -m app.reaction_store で変換するまで、リアクションは従来のテーブルに記録されます")
         else:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS reactions_log (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT,
-                    user_id TEXT NOT NULL,
-                    timestamp INTEGER NOT NULL,
-                    video_time REAL,
-                    is_smiling BOOLEAN,
-                    is_surprised BOOLEAN,
-                    is_concentrating BOOLEAN,
-                    is_hand_up BOOLEAN,
-                    nod_count INTEGER DEFAULT 0,
-                    sway_vertical_count INTEGER DEFAULT 0,
-                    cheer_count INTEGER DEFAULT 0,
-                    clap_count INTEGER DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users(id),
-                    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
-                )
-            """)
-        print("✅ reactions_logテーブルを作成しました")
+            print("✅ reaction_samplesテーブルとreactions_logビューを作成しました")
+
+        # 動画ごとのリアクションヒートマップの索引
+        from app.heatmap import ensure_heatmap_schema
+        ensure_heatmap_schema(conn, DB_TYPE)
+        print("✅ video_heatmapテーブルを作成しました")
 
         # effects_logテーブル
         if DB_TYPE == "postgresql":
@@ -210,29 +216,7 @@ def init_database():
         print("✅ effects_logテーブルを作成しました")
 
         # 既存テーブルにvideo_timeカラムを追加（マイグレーション）
-        try:
-            # reactions_logテーブルにvideo_timeカラムがあるか確認
-            if DB_TYPE == "postgresql":
-                cursor.execute("""
-                    SELECT column_name FROM information_schema.columns
-                    WHERE table_name='reactions_log' AND column_name='video_time'
-                """)
-            else:
-                cursor.execute("PRAGMA table_info(reactions_log)")
-
-            columns = cursor.fetchall()
-            has_video_time = False
-            if DB_TYPE == "postgresql":
-                has_video_time = len(columns) > 0
-            else:
-                has_video_time = any(col[1] == 'video_time' for col in columns)
-
-            if not has_video_time:
-                cursor.execute("ALTER TABLE reactions_log ADD COLUMN video_time REAL")
-                print("✅ reactions_logテーブルにvideo_timeカラムを追加しました")
-        except Exception as e:
-            print(f"ℹ️ reactions_logマイグレーション: {e}")
-
+        # reactions_log は変換時に不足カラムをNULLで補うため不要
         try:
             # effects_logテーブルにvideo_timeカラムがあるか確認
             if DB_TYPE == "postgresql":
@@ -256,15 +240,15 @@ def init_database():
         except Exception as e:
             print(f"ℹ️ effects_logマイグレーション: {e}")
 
-        # reactions_logテーブルにsession_idカラムを追加（マイグレーション）
+        # effects_logテーブルにsession_idカラムを追加（マイグレーション）
         try:
             if DB_TYPE == "postgresql":
                 cursor.execute("""
                     SELECT column_name FROM information_schema.columns
-                    WHERE table_name='reactions_log' AND column_name='session_id'
+                    WHERE table_name='effects_log' AND column_name='session_id'
                 """)
             else:
-                cursor.execute("PRAGMA table_info(reactions_log)")
+                cursor.execute("PRAGMA table_info(effects_log)")
 
             columns = cursor.fetchall()
             has_session_id = False
@@ -274,33 +258,34 @@ def init_database():
                 has_session_id = any(col[1] == 'session_id' for col in columns)
 
             if not has_session_id:
-                cursor.execute("ALTER TABLE reactions_log ADD COLUMN session_id TEXT")
-                print("✅ reactions_logテーブルにsession_idカラムを追加しました")
+                cursor.execute("ALTER TABLE effects_log ADD COLUMN session_id TEXT")
+                print("✅ effects_logテーブルにsession_idカラムを追加しました")
         except Exception as e:
-            print(f"ℹ️ reactions_log session_idマイグレーション: {e}")
+            print(f"ℹ️ effects_log session_idマイグレーション: {e}")
 
-        # effects_logテーブルにsession_idカラムを追加（マイグレーション）
+        # usersテーブルにis_hostカラムを追加（マイグレーション。リプレイでホストのリアクションを除外するため）
         try:
             if DB_TYPE == "postgresql":
                 cursor.execute("""
                     SELECT column_name FROM information_schema.columns
-                    WHERE table_name='effects_log' AND column_name='session_id'
+                    WHERE table_name='users' AND column_name='is_host'
                 """)
             else:
-                cursor.execute("PRAGMA table_info(effects_log)")
+                cursor.execute("PRAGMA table_info(users)")
 
             columns = cursor.fetchall()
-            has_session_id = False
+            has_is_host = False
             if DB_TYPE == "postgresql":
-                has_session_id = len(columns) > 0
+                has_is_host = len(columns) > 0
             else:
-                has_session_id = any(col[1] == 'session_id' for col in columns)
+                has_is_host = any(col[1] == 'is_host' for col in columns)
 
-            if not has_session_id:
-                cursor.execute("ALTER TABLE effects_log ADD COLUMN session_id TEXT")
-                print("✅ effects_logテーブルにsession_idカラムを追加しました")
+            if not has_is_host:
+                default = "FALSE" if DB_TYPE == "postgresql" else "0"
+                cursor.execute(f"ALTER TABLE users ADD COLUMN is_host BOOLEAN DEFAULT {default}")
+                print("✅ usersテーブルにis_hostカラムを追加しました")
         except Exception as e:
-            print(f"ℹ️ effects_log session_idマイグレーション: {e}")
+            print(f"ℹ️ users is_hostマイグレーション: {e}")
 
         # sessionsテーブルにcompletion_codeカラムを追加（マイグレーション）
         try:
@@ -0,0 +1,121 @@
+"""
+データベース統計のキャッシュ
+/debug/database をポーリングしてもテーブルの全件スキャン（COUNT(*)）や
+ORDER BY timestamp を実行しないよう、行数と最新の記録をプロセス内で保持する
+
+- 行数は起動後の初回（と DB_STATS_REFRESH_SECONDS ごと）にだけDBから取得し、
+  以降は記録時（log_reaction / log_effect / ensure_user_exists）に加算する
+  - PostgreSQL: プランナの統計（pg_class.reltuples）による概算
+  - SQLite: 最大のrowidによる概算（削除した行は差し引かれない）
+- 最新の記録も記録時にリングバッファに追加し、初回は主キーの降順で取得する
+- 別プロセスでの書き込み（アーカイブなど）は次の再取得まで反映されない
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+DB_STATS_REFRESH_SECONDS = float(os.getenv("DB_STATS_REFRESH_SECONDS", "300"))  # DBから再取得する間隔
+RECENT_ROWS = 5
+
+COUNTED_TABLES = ('users', 'reactions_log', 'effects_log')
+# ビューの行数は格納先のテーブルで数える
+STORAGE_TABLES = {'reactions_log': 'reaction_samples'}
+RECENT_TABLES = {
+    'reactions_log': ('id', 'session_id', 'user_id', 'timestamp', 'video_time',
+                      'is_smiling', 'is_surprised', 'is_concentrating', 'is_hand_up',
+                      'nod_count', 'sway_vertical_count', 'cheer_count', 'clap_count',
+                      'shake_head_count', 'sway_horizontal_count'),
+    'effects_log': ('id', 'session_id', 'timestamp', 'video_time', 'effect_type', 'intensity', 'duration_ms'),
+}
+
+
+def approximate_count(cursor, db_type: str, table: str) -> int:
+    """全件スキャンせずに行数を概算する"""
+    if db_type == "postgresql":
+        cursor.execute("SELECT reltuples::BIGINT FROM pg_class WHERE relname = %s", (table,))
+        row = cursor.fetchone()
+        # 一度もANALYZEされていないテーブルは -1
+        if row and row[0] >= 0:
+            return row[0]
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+    cursor.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}")
+    return cursor.fetchone()[0]
+
+
+class DatabaseStats:
+    """行数と最新の記録のキャッシュ（記録はスレッドから行われることもあるためロックで保護）"""
+    def __init__(self, refresh_seconds: float = DB_STATS_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+        self.recent: Dict[str, Deque[dict]] = {table: deque(maxlen=RECENT_ROWS) for table in RECENT_TABLES}
+        self.loaded_at: Optional[float] = None  # DBから取得した時刻（time.monotonic()）
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh_seconds
+
+    def invalidate(self):
+        """次の参照時にDBから取得し直す（大量削除の後など）"""
+        with self.lock:
+            self.loaded_at = None
+
+    def load(self, conn, db_type: str):
+        """DBから行数と最新の記録を取得する"""
+        cursor = conn.cursor()
+        counts = {table: approximate_count(cursor, db_type, STORAGE_TABLES.get(table, table))
+                  for table in COUNTED_TABLES}
+        recent = {}
+        for table, columns in RECENT_TABLES.items():
+            try:
+                cursor.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id DESC LIMIT {RECENT_ROWS}")
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            except Exception:
+                # 古いスキーマ（session_id / video_time がない）
+                conn.rollback()
+                cursor.execute(f"SELECT * FROM {table} ORDER BY id DESC LIMIT {RECENT_ROWS}")
+                names = [description[0] for description in cursor.description]
+                rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+            recent[table] = deque(reversed(rows), maxlen=RECENT_ROWS)
+        with self.lock:
+            self.counts = counts
+            self.recent = recent
+            self.loaded_at = time.monotonic()
+
+    def record_insert(self, table: str, row: Optional[dict] = None):
+        """記録時に行数（と最新の記録）を更新する"""
+        with self.lock:
+            if self.loaded_at is None:
+                # 未取得の間は数えない（取得時の行数に含まれる）
+                return
+            self.counts[table] = self.counts.get(table, 0) + 1
+            if row is not None and table in self.recent:
+                self.recent[table].append(row)
+
+    def snapshot(self) -> dict:
+        """API返却用（最新の記録は新しい順）"""
+        with self.lock:
+            return {
+                "stats": dict(self.counts),
+                "recent_reactions": list(reversed(self.recent.get('reactions_log', ()))),
+                "recent_effects": list(reversed(self.recent.get('effects_log', ()))),
+                "approximate": True,
+                "stats_age_seconds": time.monotonic() - self.loaded_at if self.loaded_at is not None else None
+            }
+
+
+class TTLCache:
+    """計算結果を一定時間だけ使い回す"""
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.value = None
+        self.expires_at = 0.0
+
+    def get(self, compute):
+        now = time.monotonic()
+        if self.value is None or now >= self.expires_at:
+            self.value = compute()
+            self.expires_at = now + self.ttl
+        return self.value
@@ -0,0 +1,157 @@
+"""
+受信時の即時エフェクト判定（低遅延モード）
+集約ループのティック（1秒）を待たずに、受信のたびに増分カウンタを更新して
+優先度の高いルール（"early": true）だけを判定する
+
+- 窓内のアクティブユーザー・最新state・イベント合計を時刻順のヒープで増分管理する
+  （1回の受信あたりO(log n)。ティックの集約と同じ指標を同じ式で計算する）
+- しきい値を下から上に越えた瞬間だけ発動し、同じエフェクトは EARLY_TRIGGER_DEBOUNCE_MS の間は再発動しない
+- 減衰や優先度の低いエフェクトは従来どおり1秒ごとのティックで判定する
+- 時刻はティックの集約と同じくサンプルのタイムスタンプを使う（呼び出し側で受信時刻より未来の時刻は丸め、
+  窓より古いサンプルは渡さない。スナップショットから復元した古いサンプルを「いま受信した」とみなさないため）
+"""
+import heapq
+import itertools
+import os
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from app import metrics as service_metrics
+from app.partial_aggregate import AUDIO_EVENTS
+
+EARLY_TRIGGER_DEBOUNCE_MS = int(os.getenv("EARLY_TRIGGER_DEBOUNCE_MS", "3000"))
+
+
+class EarlyTrigger:
+    """時間窓内の数え上げを受信ごとに増分更新する"""
+    def __init__(self, window_ms: int = 3000, debounce_ms: int = EARLY_TRIGGER_DEBOUNCE_MS):
+        self.window_ms = window_ms
+        self.debounce_ms = debounce_ms
+        self.arrivals: List[Tuple[float, str]] = []  # (サンプル時刻, user_id) のヒープ
+        self.last_seen: Dict[str, float] = {}
+        self.user_states: Dict[str, FrozenSet[str]] = {}  # アクティブユーザーの最新のtrueのstate
+        self.user_microphone: Dict[str, bool] = {}
+        self.state_counts: Dict[str, int] = {}
+        self.microphone_users = 0
+        self.events: List[Tuple[float, int, str, Dict[str, int]]] = []  # (サンプル時刻, 通し番号, user_id, 0以外のイベント) のヒープ
+        self._event_seq = itertools.count()
+        self.event_totals: Dict[str, int] = {}
+        self.last_fired: Dict[str, float] = {}  # effectType -> 最後に発動した時刻
+        self.above: Set[str] = set()  # 前回の判定でしきい値以上だった指標
+
+    def _remove_user(self, user_id: str):
+        for state_name in self.user_states.pop(user_id, ()):
+            self.state_counts[state_name] -= 1
+        if self.user_microphone.pop(user_id, False):
+            self.microphone_users -= 1
+
+    def _expire(self, now_ms: float):
+        cutoff = now_ms - self.window_ms
+        while self.arrivals and self.arrivals[0][0] <= cutoff:
+            timestamp, user_id = heapq.heappop(self.arrivals)
+            # それより新しいサンプルを受信していなければ窓から外れた
+            if self.last_seen.get(user_id) == timestamp:
+                del self.last_seen[user_id]
+                self._remove_user(user_id)
+        while self.events and self.events[0][0] <= cutoff:
+            _, _, _, events = heapq.heappop(self.events)
+            for event_name, count in events.items():
+                self.event_totals[event_name] -= count
+
+    def observe(self, user_id: str, states: dict, events: dict, has_microphone: bool, sample_ms: float):
+        """受信したサンプルでカウンタを更新する（sample_ms: サンプルの時刻）"""
+        self._expire(sample_ms)
+        self._remove_user(user_id)
+        true_states = frozenset(name for name, is_active in states.items() if is_active)
+        self.user_states[user_id] = true_states
+        for state_name in true_states:
+            self.state_counts[state_name] = self.state_counts.get(state_name, 0) + 1
+        self.user_microphone[user_id] = has_microphone
+        if has_microphone:
+            self.microphone_users += 1
+        # 到着順が前後しても、ユーザーが窓に残るのは最も新しいサンプルの時刻まで
+        seen_ms = max(sample_ms, self.last_seen.get(user_id, sample_ms))
+        self.last_seen[user_id] = seen_ms
+        heapq.heappush(self.arrivals, (seen_ms, user_id))
+
+        nonzero = {name: count for name, count in events.items() if count}
+        if nonzero:
+            heapq.heappush(self.events, (sample_ms, next(self._event_seq), user_id, nonzero))
+            for event_name, count in nonzero.items():
+                self.event_totals[event_name] = self.event_totals.get(event_name, 0) + count
+
+    def forget(self, user_id: str):
+        """切断したユーザーを窓から取り除く（到着のヒープの古い要素は last_seen と一致しないため無視される）"""
+        self.last_seen.pop(user_id, None)
+        self._remove_user(user_id)
+        kept = []
+        for entry in self.events:
+            if entry[2] == user_id:
+                for event_name, count in entry[3].items():
+                    self.event_totals[event_name] -= count
+            else:
+                kept.append(entry)
+        if len(kept) != len(self.events):
+            heapq.heapify(kept)
+            self.events = kept
+
+    def metric_value(self, source: str, metric: str) -> float:
+        """ティックの集約と同じ式で指標を計算する"""
+        active_users = len(self.user_states)
+        if source == 'ratioState':
+            return self.state_counts.get(metric, 0) / active_users
+        total = self.event_totals.get(metric, 0)
+        window_seconds = self.window_ms / 1000
+        if metric in AUDIO_EVENTS:
+            return total / (self.microphone_users * window_seconds) if self.microphone_users else 0.0
+        return total / (active_users * window_seconds)
+
+    def metric_values(self, early_rules, now_ms: float,
+                      windowed: Optional[dict] = None) -> Optional[Dict[str, float]]:
+        """
+        即時判定ルールの指標値を計算する
+        windowed: windowMs を指定したルールの指標（AggregationEngine.windowed_metrics の結果）
+        返り値: 指標名 -> 値 or None（窓内にアクティブユーザーなし）
+        """
+        self._expire(now_ms)
+        if not self.user_states:
+            return None
+        values = {}
+        for rule in early_rules:
+            if windowed is not None and rule['metric'] in windowed[rule['source']]:
+                values[rule['metric']] = windowed[rule['source']][rule['metric']]
+            else:
+                values[rule['metric']] = self.metric_value(rule['source'], rule['metric'])
+        return values
+
+    def decide(self, early_rules, values: Optional[Dict[str, float]],
+               now_ms: float) -> Optional[Tuple[dict, float, Dict[str, float]]]:
+        """
+        即時判定ルールを優先順位順に判定し、しきい値を下から上に越えた瞬間だけ発動する
+        （越えたままの間の継続はティックの集約に任せる）
+        values: metric_values の結果（閾値スイープでは事前計算した値を渡す）
+        返り値: (ルール, intensity, 判定に使った指標) or None
+        """
+        if values is None:
+            self.above.clear()
+            return None
+        for rule in early_rules:
+            value = values[rule['metric']]
+            was_above = rule['metric'] in self.above
+            if value < rule['threshold']:
+                self.above.discard(rule['metric'])
+                continue
+            self.above.add(rule['metric'])
+            # 優先度の高いルールがしきい値を越えている間は、それより低いものは発動しない
+            if was_above:
+                break
+            if now_ms - self.last_fired.get(rule['effectType'], float('-inf')) < self.debounce_ms:
+                service_metrics.increment("effects.early.debounced")
+                break
+            self.last_fired[rule['effectType']] = now_ms
+            return rule, min(value / rule['scale'], 1.0), {rule['metric']: value}
+        return None
+
+    def evaluate(self, early_rules, now_ms: float,
+                 windowed: Optional[dict] = None) -> Optional[Tuple[dict, float, Dict[str, float]]]:
+        """現在の指標で即時判定ルールを判定する（metric_values + decide）"""
+        return self.decide(early_rules, self.metric_values(early_rules, now_ms, windowed), now_ms)
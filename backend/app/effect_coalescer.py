@@ -0,0 +1,73 @@
+"""
+エフェクトの合流（変化時のみ送信）
+グループ（ルーム）ごとに再生中のエフェクトを追跡し、集約ループが毎ティック判定するエフェクトのうち
+クライアントの表示に変化があるものだけを送信する
+
+phase:
+    start  : 再生中のエフェクトがない（または終了済み）
+    switch : エフェクトの種類が変わった
+    update : 同じ種類で強度が INTENSITY_EPSILON 以上変化した
+    extend : 同じ種類のエフェクトが次のティックまでに終了してしまうため延長する
+それ以外（同じ種類・強度がほぼ同じ・まだ再生中）は送信しない
+
+extend / update を受け取ったクライアントは、同じエフェクトを再生中であれば
+アニメーションを最初からやり直さずに終了時刻と強度だけを更新する
+"""
+import os
+from typing import Dict, Optional
+
+EFFECT_INTENSITY_EPSILON = float(os.getenv("EFFECT_INTENSITY_EPSILON", "0.15"))  # updateとみなす強度の変化量
+EFFECT_EXTEND_MS = int(os.getenv("EFFECT_EXTEND_MS", "3000"))  # extend / update で延長する長さ（ms）
+
+# effects_logに記録するphase（extendは記録しない）
+LOGGED_PHASES = ('start', 'switch', 'update')
+
+
+class EffectCoalescer:
+    """ルームごとの再生中エフェクトを追跡して送信すべきエフェクトだけを返す"""
+    def __init__(self, tick_ms: int = 1000, intensity_epsilon: float = EFFECT_INTENSITY_EPSILON,
+                 extend_ms: int = EFFECT_EXTEND_MS):
+        self.tick_ms = tick_ms
+        self.intensity_epsilon = intensity_epsilon
+        self.extend_ms = extend_ms
+        self.running: Dict[str, dict] = {}  # room -> {"effectType", "intensity", "endsAt"}
+        self.stats = {"start": 0, "switch": 0, "update": 0, "extend": 0, "suppressed": 0}
+
+    def coalesce(self, room: str, effect: dict) -> Optional[dict]:
+        """
+        判定されたエフェクトを合流させる
+        返り値: 送信するエフェクト指示（phase付き） or None（送信不要）
+        """
+        now_ms = effect['timestamp']
+        running = self.running.get(room)
+
+        if running is None or now_ms >= running['endsAt']:
+            phase = 'start'
+        elif running['effectType'] != effect['effectType']:
+            phase = 'switch'
+        elif abs(effect['intensity'] - running['intensity']) >= self.intensity_epsilon:
+            phase = 'update'
+        elif running['endsAt'] - now_ms <= self.tick_ms:
+            # 次のティックを待つと途切れるので延長する
+            phase = 'extend'
+        else:
+            self.stats['suppressed'] += 1
+            return None
+
+        duration_ms = effect['durationMs'] if phase in ('start', 'switch') else self.extend_ms
+        message = dict(effect, phase=phase, durationMs=duration_ms)
+        self.observe(room, message)
+        self.stats[phase] += 1
+        return message
+
+    def observe(self, room: str, effect: dict):
+        """合流を経ずに送信したエフェクト（手動エフェクトなど）を再生中として記録する"""
+        self.running[room] = {
+            "effectType": effect['effectType'],
+            "intensity": effect['intensity'],
+            "endsAt": effect['timestamp'] + effect['durationMs']
+        }
+
+    def reset(self, room: str):
+        """ルームの再生中エフェクトを破棄する"""
+        self.running.pop(room, None)
@@ -0,0 +1,159 @@
+"""
+エフェクト判定ルールテーブル
+宣言的なルール表をコンパイルして高速な判定器を作る
+
+ルール表はJSONファイル（環境変数 EFFECT_RULES_PATH）で差し替えでき、
+実行中でも再読み込みできる（コンパイル済みルールセットの参照を1回の代入で差し替える）
+"""
+import json
+import os
+import time
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from app.time_buckets import MAX_WINDOW_MS
+
+# ルール表ファイルのパス（未設定の場合は組み込みの DEFAULT_EFFECT_RULES を使用）
+EFFECT_RULES_PATH = os.getenv("EFFECT_RULES_PATH")
+
+# ========================
+# 組み込みのルール表
+# ========================
+# metric    : 判定に使う指標名（ルールの識別子を兼ねる）
+# source    : 'ratioState'（ステート型の割合） or 'densityEvent'（イベント型の密度）
+# threshold : この値以上で発動
+# priority  : 小さいほど優先
+# scale     : intensity = min(指標値 / scale, 1.0)
+# effectType: 発動するエフェクト
+# early     : trueの場合、ティックを待たずに受信時にも判定する（app/early_trigger.py）
+# windowMs  : 指標を計算する時間窓（省略時は3秒窓のユーザーごとの集約。指定した場合は時間バケットから読む）
+#             時間バケットの指標はユーザーではなくサンプル数で平均した値になるため、組み込みのルールでは指定しない
+DEFAULT_EFFECT_RULES: List[dict] = [
+    # cheer（手を上げている）
+    {"metric": "isHandUp", "source": "ratioState", "threshold": 0.3, "priority": 1, "scale": 1.0, "effectType": "cheer", "label": "Cheer", "early": True},
+    # excitement（驚き）
+    {"metric": "isSurprised", "source": "ratioState", "threshold": 0.3, "priority": 2, "scale": 1.0, "effectType": "excitement", "label": "Excitement", "early": True},
+    # clap（拍手・音声）
+    {"metric": "clap", "source": "densityEvent", "threshold": 0.15, "priority": 3, "scale": 0.3, "effectType": "clapping_icons", "label": "Clapping Icons", "early": True},
+    # bounce（縦揺れ）
+    {"metric": "swayVertical", "source": "densityEvent", "threshold": 0.2, "priority": 4, "scale": 1.0, "effectType": "bounce", "label": "Bounce"},
+    # shimmer（首を横に振る）
+    {"metric": "shakeHead", "source": "densityEvent", "threshold": 0.2, "priority": 5, "scale": 1.0, "effectType": "shimmer", "label": "Shimmer"},
+    # groove（横揺れ）
+    {"metric": "swayHorizontal", "source": "densityEvent", "threshold": 0.2, "priority": 6, "scale": 1.0, "effectType": "groove", "label": "Groove"},
+    # cheer（歓声・音声）: 歓声は波のエフェクトを使用
+    {"metric": "cheer", "source": "densityEvent", "threshold": 0.15, "priority": 7, "scale": 0.3, "effectType": "wave", "label": "Wave（歓声）"},
+    # wave（頷き）
+    {"metric": "nod", "source": "densityEvent", "threshold": 0.3, "priority": 8, "scale": 0.5, "effectType": "wave", "label": "Wave"},
+    # sparkle（笑顔）
+    {"metric": "isSmiling", "source": "ratioState", "threshold": 0.35, "priority": 9, "scale": 1.0, "effectType": "sparkle", "label": "Sparkle"},
+    # focus（集中）
+    {"metric": "isConcentrating", "source": "ratioState", "threshold": 0.4, "priority": 10, "scale": 1.0, "effectType": "focus", "label": "Focus"},
+]
+
+SOURCES = ('ratioState', 'densityEvent')
+
+
+class CompiledRuleSet:
+    """
+    コンパイル済みのルールセット（不変）
+
+    - ルールは優先順位順に並べ替えたタプルとして保持する
+    - 判定に必要な指標名を state_metrics / event_metrics として公開し、
+      集約エンジンはこれらの指標だけを計算する
+    - windowMs を指定したルールの指標は windows（指標名 -> 窓の長さ）として分け、
+      集約エンジンは時間バケットから読み出す
+    """
+    def __init__(self, rules: List[dict], origin: str = "default"):
+        self.rules: Tuple[dict, ...] = tuple(sorted(rules, key=lambda rule: rule['priority']))
+        self.origin = origin
+        self.loaded_at = int(time.time() * 1000)
+        self.windows: Dict[str, int] = {r['metric']: r['windowMs'] for r in self.rules if r['windowMs'] is not None}
+        self.state_metrics: FrozenSet[str] = frozenset(
+            r['metric'] for r in self.rules if r['source'] == 'ratioState' and r['metric'] not in self.windows)
+        self.event_metrics: FrozenSet[str] = frozenset(
+            r['metric'] for r in self.rules if r['source'] == 'densityEvent' and r['metric'] not in self.windows)
+        # 受信時に即時判定するルール（優先順位順）
+        self.early_rules: Tuple[dict, ...] = tuple(r for r in self.rules if r['early'])
+        # 判定ループで辞書アクセスを繰り返さないよう必要な値だけを事前に展開する
+        self._checks = tuple(
+            (rule['source'] == 'ratioState', rule['metric'], rule['threshold'], rule['scale'], rule)
+            for rule in self.rules
+        )
+
+    def evaluate(self, ratio_state: Dict[str, float], density_event: Dict[str, float]) -> Optional[Tuple[dict, float]]:
+        """
+        優先順位の高いルールから判定する
+        返り値: (発動したルール, intensity) or None
+        """
+        for is_state, metric, threshold, scale, rule in self._checks:
+            value = (ratio_state if is_state else density_event).get(metric, 0)
+            if value >= threshold:
+                return rule, min(value / scale, 1.0)
+        return None
+
+    def describe(self) -> dict:
+        """API返却用の概要"""
+        return {
+            "origin": self.origin,
+            "loadedAt": self.loaded_at,
+            "rules": list(self.rules)
+        }
+
+
+def normalize_rule(rule: dict, index: int) -> dict:
+    """ルール1件を検証し、省略された項目を補う"""
+    for key in ('metric', 'source', 'threshold', 'effectType'):
+        if key not in rule:
+            raise ValueError(f"ルール{index + 1}に '{key}' がありません: {rule}")
+    if rule['source'] not in SOURCES:
+        raise ValueError(f"ルール{index + 1}の source が不正です: {rule['source']}（指定可能: {SOURCES}）")
+    scale = float(rule.get('scale', 1.0))
+    if scale <= 0:
+        raise ValueError(f"ルール{index + 1}の scale は正の値である必要があります: {scale}")
+    window_ms = rule.get('windowMs')
+    if window_ms is not None:
+        window_ms = int(window_ms)
+        if not 0 < window_ms <= MAX_WINDOW_MS:
+            raise ValueError(f"ルール{index + 1}の windowMs は 1〜{MAX_WINDOW_MS} の範囲で指定してください: {window_ms}")
+    return {
+        "metric": str(rule['metric']),
+        "source": rule['source'],
+        "threshold": float(rule['threshold']),
+        "priority": float(rule.get('priority', index + 1)),
+        "scale": scale,
+        "effectType": str(rule['effectType']),
+        "label": str(rule.get('label', rule['effectType'])),
+        "early": bool(rule.get('early', False)),
+        "windowMs": window_ms
+    }
+
+
+def compile_rules(rules: List[dict], origin: str = "default") -> CompiledRuleSet:
+    """ルール表を検証してコンパイルする（不正な場合はValueError）"""
+    if not isinstance(rules, list) or not rules:
+        raise ValueError("ルール表は1件以上のルールを含むリストである必要があります")
+    normalized = [normalize_rule(rule, i) for i, rule in enumerate(rules)]
+    metrics = [rule['metric'] for rule in normalized]
+    duplicates = {m for m in metrics if metrics.count(m) > 1}
+    if duplicates:
+        raise ValueError(f"同じ指標のルールが重複しています: {sorted(duplicates)}")
+    return CompiledRuleSet(normalized, origin)
+
+
+def load_rules_file(path: str) -> CompiledRuleSet:
+    """JSONファイル（ルールのリスト、または {"rules": [...]}）からルールセットを読み込む"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('rules')
+    return compile_rules(data, origin=path)
+
+
+def load_configured_rules() -> CompiledRuleSet:
+    """EFFECT_RULES_PATHが設定されていればそのファイル、なければ組み込みのルール表を使う"""
+    if EFFECT_RULES_PATH:
+        return load_rules_file(EFFECT_RULES_PATH)
+    return compile_rules(DEFAULT_EFFECT_RULES)
+
+
+DEFAULT_RULE_SET = compile_rules(DEFAULT_EFFECT_RULES)
@@ -0,0 +1,251 @@
+"""
+動画ごとのリアクションヒートマップ（索引）
+動画の再生位置（video_time）のどこで観客が笑った・拍手した・手を挙げたかを、全セッション横断で
+reactions_log を走査せずに返すため、(video_id, video_time のバケット, 実験グループ, リアクション) ごとの
+数え上げを video_heatmap テーブルに保持する
+
+- 記録時: HeatmapIndex.observe がセッション単位の差分をメモリ上で数え上げるだけ（DBアクセスなし）
+- HEATMAP_FLUSH_INTERVAL 秒ごとに、セッション → (video_id, グループ) を解決して差分をUPSERTで加算する
+- 読み出し: 動画1本分の行（バケット数 × グループ × リアクション）だけを主キーの範囲で読む
+- 再構築: reaction_samples と sessions を結合した1回のGROUP BYで作り直す（python -m app.heatmap --rebuild）
+
+value はstateならtrueだったサンプル数、イベントなら回数の合計。SAMPLES_KEY の行はバケット内のサンプル数
+保持期間を過ぎて生ログをアーカイブしたセッションの数え上げは索引に残るが、再構築するとホットテーブルにある分だけになる
+
+使い方:
+    python -m app.heatmap --rebuild
+    python -m app.heatmap --sqlite backup.db --rebuild
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.database import adapt_query, open_db
+from app.reaction_store import EVENT_BITS, EVENT_MAX, EVENT_TYPES, STATE_TYPES
+
+HEATMAP_BUCKET_SECONDS = float(os.getenv("HEATMAP_BUCKET_SECONDS", "1"))  # 索引のバケット幅（変更したら再構築）
+HEATMAP_FLUSH_INTERVAL = float(os.getenv("HEATMAP_FLUSH_INTERVAL", "5"))  # 差分をDBに書き込む間隔（秒）
+
+SAMPLES_KEY = "_samples"  # バケット内のサンプル数を表す reaction_type
+
+# (session_id, バケット, reaction_type) -> 加算する値
+SessionDeltas = Dict[Tuple[str, int, str], int]
+
+
+def ensure_heatmap_schema(conn, db_type: str):
+    """video_heatmapテーブルを作成（なければ）"""
+    bigint = "BIGINT" if db_type == "postgresql" else "INTEGER"
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS video_heatmap (
+            video_id TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            experiment_group TEXT NOT NULL,
+            reaction_type TEXT NOT NULL,
+            value {bigint} NOT NULL,
+            PRIMARY KEY (video_id, bucket, experiment_group, reaction_type)
+        )
+    """)
+    conn.commit()
+
+
+def bucket_for(video_time: float, bucket_seconds: float = HEATMAP_BUCKET_SECONDS) -> int:
+    return int(video_time // bucket_seconds)
+
+
+def upsert_rows(cursor, db_type: str, rows: List[tuple]):
+    """(video_id, bucket, group, reaction_type, value) を加算する"""
+    cursor.executemany(adapt_query("""
+        INSERT INTO video_heatmap (video_id, bucket, experiment_group, reaction_type, value)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (video_id, bucket, experiment_group, reaction_type)
+        DO UPDATE SET value = video_heatmap.value + excluded.value
+    """, db_type), rows)
+
+
+class HeatmapIndex:
+    """記録したリアクションをヒートマップの差分として数え上げ、まとめてDBに加算する"""
+
+    def __init__(self, bucket_seconds: float = HEATMAP_BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.pending: SessionDeltas = {}
+        # session_id -> (video_id, グループ)。動画のないセッションは None
+        self.sessions: Dict[str, Optional[Tuple[str, str]]] = {}
+        self.schema_ready = False  # 初回の書き込み時にテーブルを作成する（init_db前のDBでも動くように）
+
+    def register_session(self, session_id: str, video_id: str, experiment_group: str):
+        """セッション作成時に動画とグループを覚えておく（書き込み時のDB参照を省く）"""
+        self.sessions[session_id] = (video_id, experiment_group) if video_id else None
+
+    def observe(self, session_id: Optional[str], video_time: Optional[float], states: dict, events: dict):
+        """記録したリアクション1件を差分に加える（reaction_samples に格納される値と同じく上限で飽和させる）"""
+        if session_id is None or video_time is None or video_time < 0:
+            return
+        bucket = bucket_for(video_time, self.bucket_seconds)
+        pending = self.pending
+        key = (session_id, bucket, SAMPLES_KEY)
+        pending[key] = pending.get(key, 0) + 1
+        for reaction_type in STATE_TYPES:
+            if states.get(reaction_type["name"]):
+                key = (session_id, bucket, reaction_type["name"])
+                pending[key] = pending.get(key, 0) + 1
+        for reaction_type in EVENT_TYPES:
+            count = min(int(events.get(reaction_type["name"]) or 0), EVENT_MAX)
+            if count > 0:
+                key = (session_id, bucket, reaction_type["name"])
+                pending[key] = pending.get(key, 0) + count
+
+    def take_pending(self) -> SessionDeltas:
+        """書き込む差分を取り出す（イベントループ上で呼び、書き込みは別スレッドで行う）"""
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def restore_pending(self, deltas: SessionDeltas):
+        """書き込みに失敗した差分を戻す"""
+        for key, value in deltas.items():
+            self.pending[key] = self.pending.get(key, 0) + value
+
+    def _resolve_sessions(self, cursor, db_type: str, session_ids: List[str]):
+        missing = [session_id for session_id in session_ids if session_id not in self.sessions]
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            placeholders = ", ".join("%s" for _ in chunk)
+            cursor.execute(adapt_query(f"""
+                SELECT session_id, video_id, experiment_group FROM sessions
+                WHERE session_id IN ({placeholders})
+            """, db_type), tuple(chunk))
+            found = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+            for session_id in chunk:
+                video_id, group = found.get(session_id, (None, None))
+                self.sessions[session_id] = (video_id, group) if video_id and group else None
+
+    def flush(self, conn, db_type: str, deltas: SessionDeltas) -> int:
+        """
+        差分をセッション → 動画・グループに解決してDBに加算する（別スレッドで呼ぶ）
+        返り値: 加算した行数
+        """
+        if not deltas:
+            return 0
+        if not self.schema_ready:
+            ensure_heatmap_schema(conn, db_type)
+            self.schema_ready = True
+        cursor = conn.cursor()
+        self._resolve_sessions(cursor, db_type, list({session_id for session_id, _, _ in deltas}))
+        merged: Dict[Tuple[str, int, str, str], int] = {}
+        for (session_id, bucket, reaction_type), value in deltas.items():
+            resolved = self.sessions.get(session_id)
+            if resolved is None:
+                # sessions にない・動画のないセッション（再構築でも数えない）
+                continue
+            video_id, group = resolved
+            key = (video_id, bucket, group, reaction_type)
+            merged[key] = merged.get(key, 0) + value
+        if merged:
+            upsert_rows(cursor, db_type, [key + (value,) for key, value in merged.items()])
+        conn.commit()
+        return len(merged)
+
+
+def load_heatmap(cursor, db_type: str, video_id: str, group: Optional[str] = None,
+                 bucket_seconds: Optional[float] = None,
+                 index_bucket_seconds: float = HEATMAP_BUCKET_SECONDS) -> dict:
+    """
+    動画1本分のヒートマップ（グループごとに再生位置の昇順）
+    bucket_seconds: 返すバケット幅（索引のバケット幅の整数倍に切り上げ）
+    """
+    factor = max(1, int(-(-(bucket_seconds or index_bucket_seconds) // index_bucket_seconds)))
+    query = "SELECT bucket, experiment_group, reaction_type, value FROM video_heatmap WHERE video_id = %s"
+    params: tuple = (video_id,)
+    if group:
+        query += " AND experiment_group = %s"
+        params += (group,)
+    cursor.execute(adapt_query(query, db_type), params)
+
+    state_names = {t["name"] for t in STATE_TYPES}
+    buckets: Dict[str, Dict[int, dict]] = {}
+    for bucket, row_group, reaction_type, value in cursor.fetchall():
+        bucket //= factor
+        entry = buckets.setdefault(row_group, {}).get(bucket)
+        if entry is None:
+            entry = buckets[row_group][bucket] = {
+                "videoTime": round(bucket * factor * index_bucket_seconds, 3),
+                "samples": 0, "states": {}, "events": {}
+            }
+        if reaction_type == SAMPLES_KEY:
+            entry["samples"] += value
+        else:
+            counts = entry["states"] if reaction_type in state_names else entry["events"]
+            counts[reaction_type] = counts.get(reaction_type, 0) + value
+
+    return {
+        "videoId": video_id,
+        "bucketSeconds": factor * index_bucket_seconds,
+        "groups": {
+            row_group: [group_buckets[bucket] for bucket in sorted(group_buckets)]
+            for row_group, group_buckets in sorted(buckets.items())
+        }
+    }
+
+
+def rebuild_heatmap(conn, db_type: str, bucket_seconds: float = HEATMAP_BUCKET_SECONDS) -> int:
+    """
+    生ログから索引を作り直す（reaction_samples を1回走査するGROUP BY）
+    返り値: 作成した行数
+    """
+    ensure_heatmap_schema(conn, db_type)
+    sums = [f"SUM((s.states >> {t['slot']}) & 1)" for t in STATE_TYPES]
+    sums += [f"SUM((s.events >> {t['slot'] * EVENT_BITS}) & {EVENT_MAX})" for t in EVENT_TYPES]
+    names = [t["name"] for t in STATE_TYPES] + [t["name"] for t in EVENT_TYPES]
+    # PostgreSQLの整数へのキャストは四捨五入なので切り捨ててから（video_time >= 0 なのでSQLiteはキャストで切り捨て）
+    bucket = "FLOOR(s.video_time / %s)" if db_type == "postgresql" else "s.video_time / %s"
+    cursor = conn.cursor()
+    cursor.execute(adapt_query(f"""
+        SELECT se.video_id, CAST({bucket} AS INTEGER) AS bucket, se.experiment_group,
+               COUNT(*), {', '.join(sums)}
+        FROM reaction_samples s
+        JOIN session_keys sk ON sk.id = s.session_key
+        JOIN sessions se ON se.session_id = sk.session_id
+        WHERE s.video_time >= 0 AND se.video_id IS NOT NULL AND se.video_id <> ''
+          AND se.experiment_group IS NOT NULL
+        GROUP BY 1, 2, 3
+    """, db_type), (bucket_seconds,))
+    rows = []
+    for video_id, bucket, group, samples, *values in cursor.fetchall():
+        rows.append((video_id, bucket, group, SAMPLES_KEY, samples))
+        rows.extend((video_id, bucket, group, name, value) for name, value in zip(names, values) if value)
+
+    try:
+        cursor.execute("DELETE FROM video_heatmap")
+        cursor.executemany(adapt_query("""
+            INSERT INTO video_heatmap (video_id, bucket, experiment_group, reaction_type, value)
+            VALUES (%s, %s, %s, %s, %s)
+        """, db_type), rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="動画ごとのリアクションヒートマップの索引を管理する")
+    parser.add_argument("--sqlite", help="対象のSQLiteファイル（省略時はDATABASE_URL/既定のDB）")
+    parser.add_argument("--rebuild", action="store_true", help="生ログから索引を作り直す")
+    args = parser.parse_args(argv)
+
+    with open_db(args.sqlite) as (conn, db_type):
+        if not args.rebuild:
+            ensure_heatmap_schema(conn, db_type)
+            print("✅ video_heatmapテーブルを作成しました（--rebuild で生ログから作り直します）")
+            return 0
+        started = time.perf_counter()
+        count = rebuild_heatmap(conn, db_type)
+        print(f"✅ ヒートマップの索引を再構築しました: {count:,}行 "
+              f"(バケット幅 {HEATMAP_BUCKET_SECONDS:g}秒, {time.perf_counter() - started:.2f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
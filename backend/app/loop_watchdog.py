@@ -0,0 +1,203 @@
+"""
+イベントループの遅延ウォッチドッグ
+async def の中の同期処理（DB記録、print、エクスポートなど）がイベントループを止めると、
+その間はすべてのWebSocketの送受信が止まる。ループの遅延を常時計測し、
+しきい値を超えて止まっている間に、止めているコードのスタックと処理中のハンドラを記録する
+
+- ハートビート: ループ上のタスクが一定間隔でsleepし、予定時刻からの遅れを遅延として記録する（パーセンタイル用）
+- 監視スレッド: ハートビートが予定時刻からしきい値以上遅れていれば、ループのスレッドのスタック
+  （sys._current_frames()）と、そのとき実行中のタスクに付けた処理名（"ws:session_create" など）を取得する
+  ループが止まっている最中に取得するため、遅延の原因になっている呼び出しそのものが記録される
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from datetime import datetime
+from typing import Deque, List, Optional, Tuple
+
+from app import metrics
+
+LOOP_WATCHDOG_ENABLED = os.getenv("LOOP_WATCHDOG_ENABLED", "true").lower() == "true"
+LOOP_WATCHDOG_INTERVAL_MS = float(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", "50"))  # ハートビートの間隔
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))  # これ以上止まったらスタックを記録
+LOOP_LAG_HISTORY = int(os.getenv("LOOP_LAG_HISTORY", "1200"))  # パーセンタイルに使う直近の遅延の件数
+LOOP_STALL_HISTORY = int(os.getenv("LOOP_STALL_HISTORY", "20"))  # 保持する停止記録の件数
+STACK_LIMIT = 40  # 記録するスタックの段数（末端側から）
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def format_stack(frame) -> List[str]:
+    """スタックを外側から順に "ファイル:行 関数" の一覧にする（app内はパッケージ相対のパス）"""
+    summary = traceback.StackSummary.extract(traceback.walk_stack(frame), limit=STACK_LIMIT, lookup_lines=False)
+    lines = []
+    for entry in reversed(summary):
+        filename = entry.filename
+        if filename.startswith(_BACKEND_DIR):
+            filename = os.path.relpath(filename, _BACKEND_DIR)
+        else:
+            filename = os.path.basename(filename)
+        lines.append(f"{filename}:{entry.lineno} {entry.name}")
+    return lines
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """昇順に並んだ値のパーセンタイル（最近傍法）"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class LoopWatchdog:
+    """イベントループの遅延を計測し、長い停止の原因を記録する"""
+
+    def __init__(self, interval_ms: float = LOOP_WATCHDOG_INTERVAL_MS,
+                 threshold_ms: float = LOOP_LAG_THRESHOLD_MS,
+                 history: int = LOOP_LAG_HISTORY, stall_history: int = LOOP_STALL_HISTORY):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.lags: Deque[float] = deque(maxlen=history)  # 直近の遅延（ms）
+        self.stalls: Deque[dict] = deque(maxlen=stall_history)
+        self.stall_count = 0
+        self.max_lag_ms = 0.0
+        # タスク → 処理名（タスクの終了とともに消える）
+        self.activities: "weakref.WeakKeyDictionary[asyncio.Task, str]" = weakref.WeakKeyDictionary()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # (ハートビートの通し番号, 予定時刻)（監視スレッドが読むので1つのタプルで差し替える）
+        self._beat: Optional[Tuple[int, float]] = None
+        self._captured_seq = -1
+        self._current_stall: Optional[dict] = None
+
+    def set_activity(self, label: str):
+        """実行中のタスクが何を処理しているかを記録する（停止時の原因表示に使う）"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            return
+        if task is not None:
+            self.activities[task] = label
+
+    def start(self):
+        """ループ上で呼び出し、ハートビートと監視スレッドを開始する"""
+        if self.task is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self.task = asyncio.create_task(self.run_heartbeat())
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+        print(f"🐶 イベントループ監視を開始 (しきい値: {self.threshold * 1000:.0f}ms)")
+
+    def stop(self):
+        self._stop.set()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.thread = None
+
+    async def run_heartbeat(self):
+        """一定間隔でsleepし、予定より遅れて再開した時間を遅延として記録する"""
+        self.set_activity("loop_watchdog")
+        seq = 0
+        while True:
+            due = time.perf_counter() + self.interval
+            self._beat = (seq, due)
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - due) * 1000)
+            self.lags.append(lag_ms)
+            if lag_ms > self.max_lag_ms:
+                self.max_lag_ms = lag_ms
+            stall = self._current_stall
+            if stall is not None and self._captured_seq == seq:
+                # 監視スレッドが記録した停止の最終的な長さ
+                stall["lagMs"] = round(lag_ms, 1)
+                stall["ongoing"] = False
+                self._current_stall = None
+                print(f"⚠️ イベントループが {lag_ms:.0f}ms 停止しました ({stall['activity']}) "
+                      f"{stall['stack'][-1] if stall['stack'] else ''}")
+            seq += 1
+
+    def _watch(self):
+        """監視スレッド: ハートビートの遅れがしきい値を超えたら、止まっているループのスタックを取得"""
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            if beat is None or beat[0] == self._captured_seq:
+                continue
+            seq, due = beat
+            overdue = time.perf_counter() - due
+            if overdue >= self.threshold:
+                self._capture(seq, overdue)
+
+    def _capture(self, seq: int, overdue: float):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = format_stack(frame) if frame is not None else []
+        del frame
+        activity = "不明"
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            task = None
+        if task is not None:
+            activity = self.activities.get(task) or task.get_name()
+        stall = {
+            "lagMs": round(overdue * 1000, 1),  # 停止が終わると最終的な長さに更新される
+            "ongoing": True,
+            "activity": activity,
+            "stack": stack,
+            "timestamp": datetime.now().isoformat()
+        }
+        self._captured_seq = seq
+        self._current_stall = stall
+        self.stalls.append(stall)
+        self.stall_count += 1
+        metrics.increment("loop.stalls")
+
+    def summary(self, include_stacks: bool = True) -> dict:
+        """遅延のパーセンタイルと直近の停止記録"""
+        lags = sorted(self.lags)
+        result = {
+            "running": self.task is not None,
+            "intervalMs": self.interval * 1000,
+            "thresholdMs": self.threshold * 1000,
+            "samples": len(lags),
+            "lagMs": {
+                "p50": round(percentile(lags, 50), 2),
+                "p90": round(percentile(lags, 90), 2),
+                "p99": round(percentile(lags, 99), 2),
+                "max": round(lags[-1], 2) if lags else 0.0,
+                "maxSinceStart": round(self.max_lag_ms, 2)
+            },
+            "stallCount": self.stall_count,
+            "timestamp": datetime.now().isoformat()
+        }
+        stalls = list(reversed(self.stalls))
+        if not include_stacks:
+            stalls = [{key: value for key, value in stall.items() if key != "stack"} for stall in stalls]
+        result["recentStalls"] = stalls
+        return result
+
+
+class LoopActivityMiddleware:
+    """HTTPリクエストを処理するタスクに "http:メソッド パス" の処理名を付けるASGIミドルウェア"""
+
+    def __init__(self, app, watchdog: LoopWatchdog):
+        self.app = app
+        self.watchdog = watchdog
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.watchdog.set_activity(f"http:{scope['method']} {scope['path']}")
+        elif scope["type"] == "websocket":
+            self.watchdog.set_activity(f"ws:{scope['path']}")
+        await self.app(scope, receive, send)
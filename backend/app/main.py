@@ -1,8 +1,10 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, Depends, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from typing import Dict, List, Optional
-from collections import deque, defaultdict
+import hmac
 import json
+import math
 import asyncio
 from datetime import datetime, timedelta
 import time
@@ -10,7 +12,27 @@ import random
 import os
 
 # データベース接続をインポート
-from app.database import get_db_connection, init_database, DB_TYPE, DATABASE_URL
+from app.database import adapt_query, get_db_connection, init_database, DB_TYPE, DATABASE_URL
+from app.aggregation import UserReactionData, AggregationEngine
+from app.effect_rules import compile_rules, load_configured_rules
+from app import metrics
+from app.admission import AdmissionController, is_oversize
+from app.channels import DEFAULT_SUBSCRIPTIONS, EncodedMessage, parse_subscriptions
+from app.effect_coalescer import EffectCoalescer, LOGGED_PHASES
+from app.playback_clock import PlaybackClock, parse_playback_time
+from app.room_state import RoomState
+from app.reaction_frames import ReactionFrameDecoder
+from app.video_fanout import VideoControlFanout
+from app import profiler, retention
+from app.profiler import SamplingProfiler
+from app.loop_watchdog import LOOP_WATCHDOG_ENABLED, LoopActivityMiddleware, LoopWatchdog
+from app.db_stats import DatabaseStats, TTLCache
+from app.analytics import AnalyticsCache, compute_analytics, parse_sections
+from app.replay import parse_time_arg
+from app.report import ReportFilter
+from app.heatmap import HEATMAP_FLUSH_INTERVAL, HeatmapIndex, ensure_heatmap_schema, load_heatmap
+from app.reaction_store import KeyCache, REACTION_TYPES, insert_reaction
+from app.snapshot import SNAPSHOT_INTERVAL, encode_state, restore_snapshot, write_snapshot
 try:
     from app.database import DB_PATH
 except ImportError:
@@ -23,27 +45,37 @@ app = FastAPI(title="Live Reaction System API - Step 7")
 # ========================
 # database.pyで管理
 
-def ensure_user_exists(user_id: str, experiment_group: str = 'control2'):
-    """ユーザーが存在しない場合はusersテーブルに追加、存在する場合はグループを更新"""
+# session_id / user_id → 代理キー（reaction_samples 用）
+reaction_keys = KeyCache()
+
+# 動画ごとのリアクションヒートマップ（記録時に差分を数え、HEATMAP_FLUSH_INTERVAL ごとにDBに加算）
+heatmap_index = HeatmapIndex()
+
+# セッション横断の分析結果（セッション完了・アーカイブ時に無効化）
+analytics_cache = AnalyticsCache()
+
+def ensure_user_exists(user_id: str, experiment_group: str = 'control2', is_host: bool = False):
+    """ユーザーが存在しない場合はusersテーブルに追加、存在する場合はグループ・ホストかどうかを更新"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
         # ユーザーが存在するかチェック
-        cursor.execute("SELECT id FROM users WHERE id = %s", (user_id,))
+        cursor.execute(adapt_query("SELECT id FROM users WHERE id = %s"), (user_id,))
         if cursor.fetchone() is None:
             # 新規ユーザーを追加
             created_at = int(time.time() * 1000)
             cursor.execute(
-                "INSERT INTO users (id, experiment_group, created_at) VALUES (%s, %s, %s)",
-                (user_id, experiment_group, created_at)
+                adapt_query("INSERT INTO users (id, experiment_group, created_at, is_host) VALUES (%s, %s, %s, %s)"),
+                (user_id, experiment_group, created_at, bool(is_host))
             )
             conn.commit()
+            db_stats.record_insert('users')
             print(f"✅ 新規ユーザーをDBに登録: {user_id} (group: {experiment_group})")
         else:
             # 既存ユーザーのグループを更新
             cursor.execute(
-                "UPDATE users SET experiment_group = %s WHERE id = %s",
-                (experiment_group, user_id)
+                adapt_query("UPDATE users SET experiment_group = %s, is_host = %s WHERE id = %s"),
+                (experiment_group, bool(is_host), user_id)
             )
             conn.commit()
             print(f"✅ ユーザーのグループを更新: {user_id} (group: {experiment_group})")
@@ -80,38 +112,38 @@ def complete_session(session_id: str):
         conn.commit()
         print(f"✅ セッション完了: {session_id}")
 
-def log_reaction(user_id: str, data: dict):
-    """リアクションデータをreactions_logに記録"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
+def is_finite_number(value) -> bool:
+    """クライアントが送った値が有限の数値か（boolは除く）"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
 
-        timestamp = int(time.time() * 1000)
-        states = data.get('states', {})
-        events = data.get('events', {})
-        video_time = data.get('videoTime')  # 動画の現在時刻を取得
-        session_id = data.get('sessionId')  # セッションIDを取得
+def log_reaction(user_id: str, data: dict):
+    """
+    リアクションデータをreaction_samplesに記録（分析用には reactions_log ビューでデコードして参照）
+    従来形式の reactions_log テーブルが残っているDBでは、変換するまでそのテーブルに記録する
+    """
+    timestamp = int(time.time() * 1000)
+    states = data.get('states', {})
+    events = data.get('events', {})
+    video_time = data.get('videoTime')  # 動画の現在時刻を取得
+    session_id = data.get('sessionId')  # セッションIDを取得
 
-        cursor.execute("""
-            INSERT INTO reactions_log (
-                session_id, user_id, timestamp, video_time,
-                is_smiling, is_surprised, is_concentrating, is_hand_up,
-                nod_count, sway_vertical_count, cheer_count, clap_count
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            session_id,
-            user_id,
-            timestamp,
-            video_time,
-            states.get('isSmiling', False),
-            states.get('isSurprised', False),
-            states.get('isConcentrating', False),
-            states.get('isHandUp', False),
-            events.get('nod', 0),
-            events.get('swayVertical', 0),
-            events.get('cheer', 0),
-            events.get('clap', 0)
-        ))
+    with get_db_connection() as conn:
+        insert_reaction(conn, DB_TYPE, reaction_keys, session_id, user_id, timestamp, video_time, states, events)
         conn.commit()
+    heatmap_index.observe(session_id, video_time, states, events)
+
+    row = {
+        "session_id": session_id,
+        "user_id": user_id,
+        "timestamp": timestamp,
+        "video_time": video_time
+    }
+    for reaction_type in REACTION_TYPES:
+        if reaction_type['kind'] == 'state':
+            row[reaction_type['column']] = bool(states.get(reaction_type['name'], False))
+        else:
+            row[reaction_type['column']] = events.get(reaction_type['name'], 0)
+    db_stats.record_insert('reactions_log', row)
 
 def log_effect(effect_data: dict):
     """エフェクト指示をeffects_logに記録"""
@@ -136,6 +168,15 @@ def log_effect(effect_data: dict):
         ))
         conn.commit()
 
+    db_stats.record_insert('effects_log', {
+        "session_id": session_id,
+        "timestamp": timestamp,
+        "video_time": video_time,
+        "effect_type": effect_data.get('effectType', ''),
+        "intensity": effect_data.get('intensity', 0.0),
+        "duration_ms": effect_data.get('durationMs', 0)
+    })
+
 # CORS設定
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 
@@ -161,208 +202,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# イベントループの遅延監視（処理中のHTTPリクエスト・WebSocketメッセージを停止の原因として記録）
+loop_watchdog = LoopWatchdog()
+app.add_middleware(LoopActivityMiddleware, watchdog=loop_watchdog)
+
 # ========================
 # データ構造定義
 # ========================
 
-class UserReactionData:
-    """ユーザーごとのリアクションデータを管理"""
-    def __init__(self, user_id: str, max_samples: int = 3):
-        self.user_id = user_id
-        self.samples = deque(maxlen=max_samples)  # 最新3秒分のデータ
-        
-    def add_sample(self, data: dict):
-        """新しいサンプルを追加"""
-        self.samples.append({
-            'timestamp': data.get('timestamp', time.time() * 1000),
-            'states': data.get('states', {}),
-            'events': data.get('events', {})
-        })
-    
-    def get_recent_samples(self, window_ms: int = 3000) -> List[dict]:
-        """指定時間窓内のサンプルを取得"""
-        now = time.time() * 1000
-        cutoff = now - window_ms
-        return [s for s in self.samples if s['timestamp'] > cutoff]
-
-class AggregationEngine:
-    """集約エンジン：全ユーザーのデータを集約してエフェクトを決定"""
-    def __init__(self):
-        self.user_data: Dict[str, UserReactionData] = {}
-        self.user_has_microphone: Dict[str, bool] = {}  # ユーザーごとのマイク許可状態
-        self.last_effect_type = None
-        self.last_aggregation_time = time.time()
-
-    def update_user_data(self, user_id: str, data: dict):
-        """ユーザーデータを更新"""
-        if user_id not in self.user_data:
-            self.user_data[user_id] = UserReactionData(user_id)
-        self.user_data[user_id].add_sample(data)
-
-        # マイク許可状態を記録
-        if 'hasMicrophone' in data:
-            self.user_has_microphone[user_id] = data['hasMicrophone']
-        
-    def aggregate(self) -> Optional[dict]:
-        """
-        3秒窓でデータを集約し、エフェクト判定を行う
-        返り値: エフェクト指示データ or None
-        """
-        now_ms = time.time() * 1000
-        window_ms = 3000  # 3秒窓
-        
-        # 有効ユーザー（3秒以内にデータ送信があったユーザー）を特定
-        active_users = {}
-        for user_id, user_reaction in self.user_data.items():
-            recent_samples = user_reaction.get_recent_samples(window_ms)
-            if recent_samples:
-                active_users[user_id] = recent_samples
-        
-        if not active_users:
-            print("⚠️ アクティブユーザーなし")
-            return None
-            
-        num_active_users = len(active_users)
-        print(f"\n📊 集約処理開始 (アクティブユーザー: {num_active_users})")
-        
-        # ========================
-        # State型の集計（ratio_state）
-        # ========================
-        state_counts = defaultdict(int)
-        
-        for user_id, samples in active_users.items():
-            # 各ユーザーの最新サンプルのstateを使用
-            if samples:
-                latest_sample = samples[-1]
-                states = latest_sample.get('states', {})
-                for state_name, is_active in states.items():
-                    if is_active:
-                        state_counts[state_name] += 1
-        
-        # ratio_state計算
-        ratio_state = {}
-        for state_name, count in state_counts.items():
-            ratio_state[state_name] = count / num_active_users
-            
-        print(f"  📈 ratio_state: {ratio_state}")
-        
-        # ========================
-        # Event型の集計（density_event）
-        # ========================
-        event_totals = defaultdict(int)
-
-        for user_id, samples in active_users.items():
-            for sample in samples:
-                events = sample.get('events', {})
-                for event_name, count in events.items():
-                    event_totals[event_name] += count
-
-        # マイクありユーザー数をカウント（音声エフェクト用）
-        microphone_users = [uid for uid in active_users.keys() if self.user_has_microphone.get(uid, False)]
-        num_microphone_users = len(microphone_users)
-
-        # density_event計算
-        # 音声イベント（cheer, clap）: マイクありユーザー数を分母に
-        # その他のイベント: 全アクティブユーザー数を分母に
-        density_event = {}
-        window_seconds = window_ms / 1000
-        for event_name, total in event_totals.items():
-            if event_name in ['cheer', 'clap']:
-                # 音声エフェクト: マイクありユーザー数を分母に
-                if num_microphone_users > 0:
-                    density_event[event_name] = total / (num_microphone_users * window_seconds)
-                else:
-                    density_event[event_name] = 0.0
-            else:
-                # その他のエフェクト: 全ユーザー数を分母に
-                density_event[event_name] = total / (num_active_users * window_seconds)
-
-        print(f"  📈 density_event: {density_event} (マイクあり: {num_microphone_users}/{num_active_users})")
-        
-        # ========================
-        # エフェクト判定（優先順位付き）
-        # ========================
-        effect_type = None
-        intensity = 0.0
-
-        # 優先順位: cheer (isHandUp) > excitement > clap > bounce > shimmer > groove > cheer (audio) > wave > sparkle > focus
-
-        # 1. cheer（手を上げている）判定
-        if ratio_state.get('isHandUp', 0) >= 0.3:
-            effect_type = 'cheer'
-            intensity = min(ratio_state['isHandUp'], 1.0)
-            print(f"  ✨ Cheer効果発動! (intensity: {intensity:.2f})")
-
-        # 2. excitement（驚き）判定
-        elif ratio_state.get('isSurprised', 0) >= 0.3:
-            effect_type = 'excitement'
-            intensity = min(ratio_state['isSurprised'], 1.0)
-            print(f"  ✨ Excitement効果発動! (intensity: {intensity:.2f})")
-
-        # 3. clap（拍手・音声）判定
-        elif density_event.get('clap', 0) >= 0.15:
-            effect_type = 'clapping_icons'
-            intensity = min(density_event['clap'] / 0.3, 1.0)
-            print(f"  ✨ Clapping Icons効果発動! (intensity: {intensity:.2f})")
-
-        # 4. bounce（縦揺れ）判定
-        elif density_event.get('swayVertical', 0) >= 0.2:
-            effect_type = 'bounce'
-            intensity = min(density_event['swayVertical'], 1.0)
-            print(f"  ✨ Bounce効果発動! (intensity: {intensity:.2f})")
-
-        # 5. shimmer（首を横に振る）判定
-        elif density_event.get('shakeHead', 0) >= 0.2:
-            effect_type = 'shimmer'
-            intensity = min(density_event['shakeHead'], 1.0)
-            print(f"  ✨ Shimmer効果発動! (intensity: {intensity:.2f})")
-
-        # 6. groove（横揺れ）判定
-        elif density_event.get('swayHorizontal', 0) >= 0.2:
-            effect_type = 'groove'
-            intensity = min(density_event['swayHorizontal'], 1.0)
-            print(f"  ✨ Groove効果発動! (intensity: {intensity:.2f})")
-
-        # 7. cheer（歓声・音声）判定
-        elif density_event.get('cheer', 0) >= 0.15:
-            effect_type = 'wave'  # 歓声は波のエフェクトを使用
-            intensity = min(density_event['cheer'] / 0.3, 1.0)
-            print(f"  ✨ Wave効果発動（歓声）! (intensity: {intensity:.2f})")
-
-        # 8. wave（頷き）判定
-        elif density_event.get('nod', 0) >= 0.3:
-            effect_type = 'wave'
-            intensity = min(density_event['nod'] / 0.5, 1.0)
-            print(f"  ✨ Wave効果発動! (intensity: {intensity:.2f})")
-
-        # 9. sparkle（笑顔）判定
-        elif ratio_state.get('isSmiling', 0) >= 0.35:
-            effect_type = 'sparkle'
-            intensity = min(ratio_state['isSmiling'], 1.0)
-            print(f"  ✨ Sparkle効果発動! (intensity: {intensity:.2f})")
-
-        # 10. focus（集中）判定
-        elif ratio_state.get('isConcentrating', 0) >= 0.4:
-            effect_type = 'focus'
-            intensity = min(ratio_state['isConcentrating'], 1.0)
-            print(f"  ✨ Focus効果発動! (intensity: {intensity:.2f})")
-        
-        if effect_type:
-            return {
-                "type": "effect",
-                "effectType": effect_type,
-                "intensity": intensity,
-                "durationMs": 2000,
-                "timestamp": int(now_ms),
-                "debug": {
-                    "activeUsers": num_active_users,
-                    "ratioState": ratio_state,
-                    "densityEvent": density_event
-                }
-            }
-        
-        print("  ⏸️ エフェクト発動条件を満たさず")
-        return None
+# 集約エンジン（UserReactionData, AggregationEngine）は app/aggregation.py で定義
 
 # ========================
 # 接続管理
@@ -372,20 +220,55 @@ class AggregationEngine:
 EFFECT_TYPES = ['sparkle', 'wave', 'excitement', 'bounce', 'cheer', 'shimmer', 'focus', 'groove', 'clapping_icons']
 RANDOM_EFFECT_INTERVAL = 5  # ランダムエフェクトの発動間隔（秒）
 
+# ハートビート（無応答接続の回収）用の定数
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "10"))  # pingの送信・回収判定の間隔（秒）
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "30"))  # この時間受信がない接続を回収（秒）
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "50"))  # 1回に回収する接続数（間でイベントループに制御を返す）
+MAX_USER_ID_LENGTH = int(os.getenv("MAX_USER_ID_LENGTH", "128"))  # user_idの最大文字数（これを超える接続は閉じる）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # /admin/profile・/admin/effect-rules/reload に必要なトークン（未設定なら常に拒否）
+SERVICE_RESTART_CLOSE_CODE = 1012  # サーバー終了時にuvicornが接続を閉じるコード（この切断では集約の窓を残す）
+
+# /status のスナップショットを使い回す時間（秒）と、ユーザー一覧の1ページの既定件数
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "1"))
+STATUS_PAGE_SIZE = int(os.getenv("STATUS_PAGE_SIZE", "100"))
+
+# 受信時に優先度の高いエフェクト（"early": true のルール）をティックを待たずに判定するか
+EARLY_TRIGGER_ENABLED = os.getenv("EARLY_TRIGGER_ENABLED", "true").lower() == "true"
+
+# /debug/database 用の行数・最新の記録（記録時に更新し、ポーリングではDBを走査しない）
+db_stats = DatabaseStats()
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
         self.user_groups: Dict[str, str] = {}  # ユーザーごとの実験グループ
         self.user_is_host: Dict[str, bool] = {}  # ユーザーがホストかどうか
-        self.aggregation_engine = AggregationEngine()
+        self.subscriptions: Dict[str, frozenset] = {}  # ユーザーごとの購読チャンネル
+        self.aggregation_engine = AggregationEngine(rules=load_configured_rules())
+        self.effect_coalescer = EffectCoalescer()  # グループごとの再生中エフェクト（変化時のみ送信）
+        self.frame_decoders: Dict[str, ReactionFrameDecoder] = {}  # 接続ごとの差分フレーム復元用の状態
+        self.known_users: Dict[str, tuple] = {}  # DB登録済みユーザー（user_id -> (グループ, ホストか)）
+        self.playback_clocks: Dict[str, PlaybackClock] = {}  # グループごとのホストの再生位置モデル
+        self.rooms: Dict[str, RoomState] = {}  # グループごとの選択中の動画（途中参加者向け）
+        self.video_fanout = VideoControlFanout(self.broadcast_to_group)  # 動画操作イベントの合流配信
+        self.last_seen: Dict[str, float] = {}  # 最後にフレームを受信した時刻（time.monotonic()）
         self.aggregation_task = None
+        self.heartbeat_task = None
         self.random_effect_task = None
+        self.snapshot_task = None
+        self.retention_task = None
+        self.heatmap_task = None
         self.last_random_effect_time = time.time()
 
-    async def connect(self, websocket: WebSocket, user_id: str, experiment_group: str = 'control2', is_host: bool = False):
+    async def connect(self, websocket: WebSocket, user_id: str, experiment_group: str = 'control2', is_host: bool = False,
+                      subscriptions: frozenset = DEFAULT_SUBSCRIPTIONS):
         self.active_connections[user_id] = websocket
         self.user_groups[user_id] = experiment_group
         self.user_is_host[user_id] = is_host
+        self.subscriptions[user_id] = subscriptions
+        # 再接続時は最終既知stateを引き継がない（クライアントはフルフレームから送り直す）
+        self.frame_decoders[user_id] = ReactionFrameDecoder()
+        self.last_seen[user_id] = time.monotonic()
         host_label = " (HOST)" if is_host else ""
         print(f"✅ クライアント接続: {user_id}{host_label} (group: {experiment_group}, 合計: {len(self.active_connections)})")
         
@@ -393,21 +276,51 @@ class ConnectionManager:
         if self.aggregation_task is None:
             self.aggregation_task = asyncio.create_task(self.run_aggregation_loop())
             print("🔄 集約ループを開始しました")
+
+        # ハートビートタスクを開始（まだ開始していない場合）
+        if self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.create_task(self.run_heartbeat_loop())
     
-    def disconnect(self, user_id: str):
+    def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None, keep_state: bool = False):
+        """
+        接続を削除（websocketを指定した場合は、それが現在の接続であるときのみ削除）
+        keep_state: Trueの場合は集約の窓と登録キャッシュを残す（サーバー再起動による切断。終了時のスナップショットに含めるため）
+        """
+        if websocket is not None and self.active_connections.get(user_id) is not websocket:
+            # 同じユーザーが既に再接続している（古い接続の後始末）
+            return
         if user_id in self.active_connections:
             del self.active_connections[user_id]
         if user_id in self.user_groups:
             del self.user_groups[user_id]
         if user_id in self.user_is_host:
             del self.user_is_host[user_id]
+        if user_id in self.subscriptions:
+            del self.subscriptions[user_id]
+        if user_id in self.frame_decoders:
+            del self.frame_decoders[user_id]
+        if user_id in self.last_seen:
+            del self.last_seen[user_id]
+        if not keep_state:
+            # 集約・即時判定の窓と登録キャッシュからも取り除く（再接続時はハンドシェイクで登録し直す）
+            self.aggregation_engine.remove_user(user_id)
+            self.known_users.pop(user_id, None)
         print(f"❌ クライアント切断: {user_id} (合計: {len(self.active_connections)})")
     
+    def subscribes(self, user_id: str, channel: str) -> bool:
+        """ユーザーがチャンネルを購読しているか（送信するメッセージを作る前の判定用）"""
+        return channel in self.subscriptions.get(user_id, DEFAULT_SUBSCRIPTIONS)
+
     async def send_personal_message(self, message: dict, user_id: str):
-        """特定のクライアントにメッセージを送信"""
+        """特定のクライアントにメッセージを送信（購読していないチャンネルのメッセージは送らない）"""
         if user_id in self.active_connections:
+            subscriptions = self.subscriptions.get(user_id, DEFAULT_SUBSCRIPTIONS)
+            encoded = EncodedMessage(message)
+            if not encoded.accepts(subscriptions):
+                metrics.increment("ws.channel.skipped")
+                return
             try:
-                await self.active_connections[user_id].send_json(message)
+                await self.active_connections[user_id].send_text(encoded.text(subscriptions))
             except Exception as e:
                 print(f"⚠️ 送信エラー ({user_id}): {e}")
                 self.disconnect(user_id)
@@ -415,10 +328,16 @@ class ConnectionManager:
     async def broadcast(self, message: dict):
         """全クライアントにメッセージをブロードキャスト"""
         disconnected_users = []
+        encoded = EncodedMessage(message)  # JSONは購読内容ごとに1回だけ作る
+        skipped_count = 0
 
         for user_id, connection in self.active_connections.items():
+            subscriptions = self.subscriptions.get(user_id, DEFAULT_SUBSCRIPTIONS)
+            if not encoded.accepts(subscriptions):
+                skipped_count += 1
+                continue
             try:
-                await connection.send_json(message)
+                await connection.send_text(encoded.text(subscriptions))
             except Exception as e:
                 print(f"⚠️ ブロードキャスト送信エラー ({user_id}): {e}")
                 disconnected_users.append(user_id)
@@ -426,6 +345,8 @@ class ConnectionManager:
         # 切断されたクライアントを削除
         for user_id in disconnected_users:
             self.disconnect(user_id)
+        if skipped_count:
+            metrics.increment("ws.channel.skipped", skipped_count)
 
         if message.get('type') == 'effect':
             print(f"📡 エフェクト指示を{len(self.active_connections)}クライアントに配信")
@@ -434,11 +355,17 @@ class ConnectionManager:
         """特定のグループにのみメッセージをブロードキャスト"""
         disconnected_users = []
         sent_count = 0
+        skipped_count = 0
+        encoded = EncodedMessage(message)  # JSONは購読内容ごとに1回だけ作る
 
         for user_id, connection in self.active_connections.items():
             if self.user_groups.get(user_id) == target_group:
+                subscriptions = self.subscriptions.get(user_id, DEFAULT_SUBSCRIPTIONS)
+                if not encoded.accepts(subscriptions):
+                    skipped_count += 1
+                    continue
                 try:
-                    await connection.send_json(message)
+                    await connection.send_text(encoded.text(subscriptions))
                     sent_count += 1
                 except Exception as e:
                     print(f"⚠️ グループ送信エラー ({user_id}): {e}")
@@ -447,10 +374,141 @@ class ConnectionManager:
         # 切断されたクライアントを削除
         for user_id in disconnected_users:
             self.disconnect(user_id)
+        if skipped_count:
+            metrics.increment("ws.channel.skipped", skipped_count)
 
         if message.get('type') == 'effect' and sent_count > 0:
             print(f"📡 エフェクト指示を{target_group}グループの{sent_count}クライアントに配信")
 
+    def touch(self, user_id: str):
+        """フレームを受信した時刻を記録（ハートビートの応答を兼ねる）"""
+        if user_id in self.last_seen:
+            self.last_seen[user_id] = time.monotonic()
+
+    async def reap(self, user_id: str):
+        """無応答の接続を閉じて削除"""
+        websocket = self.active_connections.get(user_id)
+        self.disconnect(user_id)
+        metrics.increment("ws.heartbeat.reaped")
+        if websocket is not None:
+            try:
+                await asyncio.wait_for(websocket.close(code=1001), timeout=1.0)
+            except Exception:
+                pass
+
+    async def run_heartbeat_loop(self):
+        """一定間隔で無応答の接続を回収し、しばらく受信のない接続にpingを送るループ"""
+        print("💓 ハートビートループ開始")
+        loop_watchdog.set_activity("heartbeat_loop")
+
+        while True:
+            try:
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+                now = time.monotonic()
+
+                # タイムアウトした接続をバッチごとに回収
+                stale_users = [uid for uid, seen in self.last_seen.items() if now - seen > HEARTBEAT_TIMEOUT]
+                for i in range(0, len(stale_users), REAPER_BATCH_SIZE):
+                    for user_id in stale_users[i:i + REAPER_BATCH_SIZE]:
+                        await self.reap(user_id)
+                    await asyncio.sleep(0)
+                if stale_users:
+                    print(f"💀 無応答の接続を回収: {len(stale_users)}件 (合計: {len(self.active_connections)})")
+
+                # リアクションを送っているクライアントには不要なので、受信が途絶えている接続にだけpingを送る
+                idle_users = [uid for uid, seen in self.last_seen.items() if now - seen >= HEARTBEAT_INTERVAL]
+                for user_id in idle_users:
+                    await self.send_personal_message({
+                        "type": "ping",
+                        "timestamp": int(time.time() * 1000)
+                    }, user_id)
+
+            except Exception as e:
+                print(f"❌ ハートビートループエラー: {e}")
+
+    def is_registered(self, user_id: str, experiment_group: str, is_host: bool = False) -> bool:
+        """同じグループ・同じホスト設定でDB登録済みか（スナップショットから復元した登録情報を含む）"""
+        return self.known_users.get(user_id) == (experiment_group, is_host)
+
+    async def save_snapshot(self):
+        """現在の状態をスナップショットとして保存（エンコードはループ内、書き込みは別スレッド）"""
+        data = encode_state(self)
+        await asyncio.to_thread(write_snapshot, data)
+
+    async def run_snapshot_loop(self):
+        """一定間隔で状態スナップショットを保存するループ"""
+        loop_watchdog.set_activity("snapshot_loop")
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            try:
+                await self.save_snapshot()
+            except Exception as e:
+                print(f"⚠️ スナップショット保存エラー: {e}")
+
+    async def run_retention_loop(self):
+        """保持期間を過ぎた生ログを定期的にアーカイブ（DB処理はスレッドで実行）"""
+        loop_watchdog.set_activity("retention_loop")
+        while True:
+            await asyncio.sleep(retention.RETENTION_INTERVAL)
+            try:
+                stats = await asyncio.to_thread(self._run_retention)
+                if stats['reactions'] or stats['effects'] or stats['leftover']:
+                    db_stats.invalidate()
+                    analytics_cache.invalidate()
+                if stats['sessions'] or stats['leftover']:
+                    print(f"🗄️ 生ログをアーカイブ: {stats['sessions']}セッション "
+                          f"(reactions {stats['reactions']}行 / effects {stats['effects']}行)")
+            except Exception as e:
+                print(f"⚠️ アーカイブエラー: {e}")
+
+    async def run_heatmap_loop(self):
+        """ヒートマップの差分を定期的にDBに加算（DB処理はスレッドで実行）"""
+        loop_watchdog.set_activity("heatmap_loop")
+        while True:
+            await asyncio.sleep(HEATMAP_FLUSH_INTERVAL)
+            await self.flush_heatmap()
+
+    async def flush_heatmap(self):
+        deltas = heatmap_index.take_pending()
+        if not deltas:
+            return
+        try:
+            await asyncio.to_thread(self._flush_heatmap, deltas)
+        except Exception as e:
+            heatmap_index.restore_pending(deltas)
+            print(f"⚠️ ヒートマップ書き込みエラー: {e}")
+
+    def _flush_heatmap(self, deltas: dict) -> int:
+        with get_db_connection() as conn:
+            return heatmap_index.flush(conn, DB_TYPE, deltas)
+
+    def _run_retention(self) -> dict:
+        with get_db_connection() as conn:
+            return retention.run_retention(conn, DB_TYPE)
+
+    def get_room_state(self, group: str) -> RoomState:
+        """グループのルーム状態を取得（なければ作成）"""
+        if group not in self.rooms:
+            self.rooms[group] = RoomState()
+        return self.rooms[group]
+
+    def room_snapshot(self, group: str, subscriptions: frozenset) -> dict:
+        """途中参加者向けのルーム状態（動画・再生位置は sync、再生中のエフェクトは effects の購読者のみ）"""
+        room = self.rooms.get(group) or RoomState()
+        playback_clock = self.playback_clocks.get(group) if 'sync' in subscriptions else None
+        running_effect = self.effect_coalescer.running.get(group) if 'effects' in subscriptions else None
+        snapshot = room.snapshot(playback_clock, running_effect)
+        if 'sync' not in subscriptions:
+            snapshot['videoId'] = None
+            snapshot['videoSelectedAt'] = None
+        return snapshot
+
+    def get_playback_clock(self, group: str) -> PlaybackClock:
+        """グループの再生位置モデルを取得（なければ作成）"""
+        if group not in self.playback_clocks:
+            self.playback_clocks[group] = PlaybackClock()
+        return self.playback_clocks[group]
+
     def get_host_user_id(self, group: str) -> Optional[str]:
         """指定されたグループのホストのユーザーIDを取得"""
         for user_id, user_group in self.user_groups.items():
@@ -475,13 +533,41 @@ class ConnectionManager:
             }
         }
     
+    def decode_reaction_frame(self, user_id: str, data: dict):
+        """差分フレーム・フルフレームをフルサンプルに復元する（返り値: (データ, 再同期が必要か)）"""
+        decoder = self.frame_decoders.get(user_id)
+        if decoder is None:
+            decoder = self.frame_decoders[user_id] = ReactionFrameDecoder()
+        return decoder.decode(data)
+
     def update_reaction_data(self, user_id: str, data: dict):
         """リアクションデータを集約エンジンに渡す"""
         self.aggregation_engine.update_user_data(user_id, data)
-    
+
+    async def publish_reaction_effect(self, effect: dict):
+        """リアクションベースのエフェクトを実験群・デバッグ群に配信（ティック・即時判定の共通処理）"""
+        # グループごとに再生中のエフェクトと比較し、変化がある場合のみ送信
+        messages = {
+            group: self.effect_coalescer.coalesce(group, effect)
+            for group in ['experiment', 'debug']
+        }
+
+        # DBに記録（延長のみの場合は記録しない）
+        if any(m and m['phase'] in LOGGED_PHASES for m in messages.values()):
+            try:
+                log_effect(effect)
+            except Exception as e:
+                print(f"⚠️ エフェクトDB記録エラー: {e}")
+
+        # 実験群・デバッグ群にブロードキャスト
+        for group, message in messages.items():
+            if message:
+                await self.broadcast_to_group(message, group)
+
     async def run_aggregation_loop(self):
         """1秒ごとに集約処理を実行するループ"""
         print("🔄 集約ループ開始")
+        loop_watchdog.set_activity("aggregation_loop")
 
         while True:
             try:
@@ -504,16 +590,7 @@ class ConnectionManager:
 
                     # エフェクト指示があれば実験群・デバッグ群クライアントに配信
                     if effect:
-                        # DBに記録
-                        try:
-                            log_effect(effect)
-                        except Exception as e:
-                            print(f"⚠️ エフェクトDB記録エラー: {e}")
-
-                        # 実験群にブロードキャスト
-                        await self.broadcast_to_group(effect, 'experiment')
-                        # デバッグ群にもブロードキャスト
-                        await self.broadcast_to_group(effect, 'debug')
+                        await self.publish_reaction_effect(effect)
 
                 # ========================
                 # 対照群1（control1）: ランダムエフェクト
@@ -532,6 +609,7 @@ class ConnectionManager:
 
                         # 対照群1のみにブロードキャスト
                         await self.broadcast_to_group(random_effect, 'control1')
+                        self.effect_coalescer.observe('control1', random_effect)
                         self.last_random_effect_time = current_time
                         print(f"🎲 ランダムエフェクト発動: {random_effect['effectType']}")
 
@@ -544,7 +622,7 @@ class ConnectionManager:
                 # ホストに接続人数を送信
                 # ========================
                 for user_id, is_host in self.user_is_host.items():
-                    if is_host:
+                    if is_host and self.subscribes(user_id, 'host_counts'):
                         # グループ別の接続人数を計算
                         group = self.user_groups.get(user_id, 'control2')
                         group_count = sum(1 for uid, grp in self.user_groups.items() if grp == group and not self.user_is_host.get(uid, False))
@@ -564,6 +642,42 @@ class ConnectionManager:
 # グローバルインスタンス
 manager = ConnectionManager()
 
+# ========================
+# 起動・終了処理
+# ========================
+
+@app.on_event("startup")
+async def restore_state():
+    """前回のスナップショットから状態を復元し、定期保存を開始"""
+    try:
+        restore_snapshot(manager)
+    except Exception as e:
+        print(f"⚠️ スナップショット復元エラー: {e}")
+    manager.snapshot_task = asyncio.create_task(manager.run_snapshot_loop())
+    manager.heatmap_task = asyncio.create_task(manager.run_heatmap_loop())
+    if LOOP_WATCHDOG_ENABLED:
+        loop_watchdog.start()
+    if retention.RETENTION_INTERVAL > 0:
+        manager.retention_task = asyncio.create_task(manager.run_retention_loop())
+
+@app.on_event("shutdown")
+async def save_state():
+    """終了時にスナップショットを保存"""
+    if manager.snapshot_task:
+        manager.snapshot_task.cancel()
+    if manager.retention_task:
+        manager.retention_task.cancel()
+    if manager.heatmap_task:
+        manager.heatmap_task.cancel()
+    await manager.flush_heatmap()
+    loop_watchdog.stop()
+    manager.video_fanout.close()
+    try:
+        write_snapshot(encode_state(manager))
+        print("💾 スナップショットを保存しました")
+    except Exception as e:
+        print(f"⚠️ スナップショット保存エラー: {e}")
+
 # ========================
 # APIエンドポイント
 # ========================
@@ -596,10 +710,18 @@ async def websocket_endpoint(websocket: WebSocket):
 
         # 最初のメッセージでuser_id、experimentGroup、isHostを取得
         first_message = await websocket.receive_text()
+        # 受信ループと同じく、サイズ上限を超えたフレームはJSONパースの前に拒否する
+        if is_oversize(first_message):
+            print("⚠️ 初回メッセージがサイズ上限を超えています。接続を閉じます。")
+            metrics.increment("ws.frames.rejected.oversize")
+            await websocket.close(code=1009)
+            return
         data = json.loads(first_message)
         user_id = data.get("userId")
         experiment_group = data.get("experimentGroup", "control2")
         is_host = data.get("isHost", False)
+        # 受け取るチャンネル（未指定なら全チャンネル）
+        subscriptions = parse_subscriptions(data.get("subscribe"))
 
         # グループ名の検証（debugは実験群と同じ動作）
         if experiment_group not in ['experiment', 'control1', 'control2', 'debug']:
@@ -609,29 +731,56 @@ async def websocket_endpoint(websocket: WebSocket):
             print("⚠️ user_idがありません。接続を閉じます。")
             await websocket.close()
             return
+        if not isinstance(user_id, str) or len(user_id) > MAX_USER_ID_LENGTH:
+            print(f"⚠️ user_idが不正です（文字列・{MAX_USER_ID_LENGTH}文字以下）。接続を閉じます。")
+            metrics.increment("ws.handshake.invalid_user_id")
+            user_id = None
+            await websocket.close(code=1008)
+            return
 
         # 接続を管理リストに追加
-        await manager.connect(websocket, user_id, experiment_group, is_host)
+        await manager.connect(websocket, user_id, experiment_group, is_host, subscriptions)
 
         # ユーザーをDBに登録（存在しない場合）
-        ensure_user_exists(user_id, experiment_group)
+        # 同じグループ・同じホスト設定で登録済み（再接続・ウォームリスタート後）の場合はDBアクセスを省略
+        if not manager.is_registered(user_id, experiment_group, is_host):
+            ensure_user_exists(user_id, experiment_group, is_host)
+        manager.known_users[user_id] = (experiment_group, is_host)
 
         # 接続確認メッセージを送信
         await websocket.send_json({
             "type": "connection_established",
             "userId": user_id,
             "experimentGroup": experiment_group,
+            "subscriptions": sorted(subscriptions),
+            # 途中参加者が時刻同期の往復なしに追いつくためのルーム状態
+            "room": manager.room_snapshot(experiment_group, subscriptions),
             "message": f"WebSocket接続が確立されました（グループ: {experiment_group}）",
             "timestamp": datetime.now().isoformat()
         })
         
+        # 接続ごとのアドミッション制御（レート制限・フレームサイズ上限）
+        admission = AdmissionController()
+
         # メッセージ受信ループ
         while True:
             # クライアントからメッセージを受信
             text_data = await websocket.receive_text()
+            manager.touch(user_id)
+
+            # サイズ上限を超えたフレームはJSONパースの前に、レート上限を超えたフレームはDB記録・配信の前に破棄
+            if not admission.admit_frame(text_data):
+                continue
             data = json.loads(text_data)
 
             message_type = data.get('type')
+            if not admission.admit(message_type):
+                continue
+            loop_watchdog.set_activity(f"ws:{message_type or 'reaction'}")
+
+            # ハートビート応答（受信時刻の記録は上で済んでいる）
+            if message_type == 'pong':
+                continue
 
             # ========================
             # セッション作成イベント
@@ -642,6 +791,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 if session_id:
                     try:
                         completion_code = create_session(session_id, user_id, video_id, experiment_group)
+                        heatmap_index.register_session(session_id, video_id, experiment_group)
                         await websocket.send_json({
                             "type": "session_created",
                             "sessionId": session_id,
@@ -660,6 +810,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 if session_id:
                     try:
                         complete_session(session_id)
+                        analytics_cache.invalidate()
                         await websocket.send_json({
                             "type": "session_completion_confirmed",
                             "sessionId": session_id,
@@ -677,6 +828,12 @@ async def websocket_endpoint(websocket: WebSocket):
                     effect_type = data.get('effectType')
                     intensity = data.get('intensity', 1.0)
                     duration_ms = data.get('durationMs', 2000)
+                    # 再生中エフェクトの終了時刻（timestamp + durationMs）の計算やDB記録の前に検証する
+                    if not isinstance(effect_type, str) or not is_finite_number(intensity) \
+                            or not is_finite_number(duration_ms) or duration_ms <= 0:
+                        print(f"⚠️ 不正な手動エフェクトのため無視します ({user_id}): "
+                              f"effectType={effect_type!r}, intensity={intensity!r}, durationMs={duration_ms!r}")
+                        continue
 
                     print(f"🎨 手動エフェクト発動 ({user_id}): {effect_type}")
 
@@ -695,6 +852,7 @@ async def websocket_endpoint(websocket: WebSocket):
 
                     # debug群にブロードキャスト
                     await manager.broadcast_to_group(effect_instruction, 'debug')
+                    manager.effect_coalescer.observe('debug', effect_instruction)
 
                     # エフェクトをDBに記録
                     try:
@@ -713,6 +871,9 @@ async def websocket_endpoint(websocket: WebSocket):
                 if experiment_group == 'experiment' and manager.user_is_host.get(user_id, False):
                     video_id = data.get('videoId', '')
                     print(f"📺 動画URL選択イベント受信 ({user_id}): {video_id}")
+                    manager.get_room_state(experiment_group).select_video(
+                        video_id, data.get('timestamp', int(time.time() * 1000))
+                    )
                     # experiment群の他のメンバーにブロードキャスト
                     await manager.broadcast_to_group({
                         "type": "video_url_selected",
@@ -728,19 +889,52 @@ async def websocket_endpoint(websocket: WebSocket):
                 # ホストからの動画操作をexperiment群全体にブロードキャスト
                 if experiment_group == 'experiment':
                     print(f"🎬 動画同期イベント受信 ({user_id}): {message_type}")
-                    # experiment群の他のメンバーにブロードキャスト
-                    await manager.broadcast_to_group({
+                    current_time = parse_playback_time(data.get('currentTime', 0))
+                    if current_time is None:
+                        print(f"⚠️ 不正なcurrentTimeのため無視します ({user_id}): {message_type}")
+                        continue
+                    if manager.user_is_host.get(user_id, False):
+                        manager.get_playback_clock(experiment_group).update(message_type, current_time)
+                    # experiment群の他のメンバーにブロードキャスト（短時間の連続操作はまとめて配信）
+                    await manager.video_fanout.publish('experiment', {
                         "type": message_type,
-                        "currentTime": data.get('currentTime', 0),
+                        "currentTime": current_time,
                         "timestamp": data.get('timestamp', int(time.time() * 1000))
-                    }, 'experiment')
+                    })
+                continue
+
+            # ========================
+            # 再生位置の定期報告（experiment群のホスト → サーバー）
+            # ========================
+            if message_type == 'video_position':
+                current_time = parse_playback_time(data.get('currentTime', 0))
+                if current_time is None:
+                    print(f"⚠️ 不正なcurrentTimeのため無視します ({user_id}): {message_type}")
+                    continue
+                if manager.user_is_host.get(user_id, False):
+                    manager.get_playback_clock(experiment_group).update(
+                        message_type, current_time, data.get('isPlaying')
+                    )
                 continue
 
             # ========================
-            # 時刻同期リクエスト（experiment群の参加者 → ホスト）
+            # 時刻同期リクエスト（experiment群の参加者 → サーバー / ホスト）
             # ========================
             if message_type == 'time_sync_request':
-                # 被験者からホストへの時刻問い合わせ
+                # サーバーの再生位置モデルが新しければ直接応答
+                playback_clock = manager.playback_clocks.get(experiment_group)
+                if playback_clock and playback_clock.is_fresh():
+                    metrics.increment("sync.answered.server")
+                    await manager.send_personal_message({
+                        "type": "time_sync_response",
+                        "currentTime": playback_clock.current_position(),
+                        "timestamp": int(time.time() * 1000),
+                        "source": "server"
+                    }, user_id)
+                    continue
+
+                # モデルが古い場合は被験者からホストへの時刻問い合わせを中継
+                metrics.increment("sync.relayed.host")
                 host_user_id = manager.get_host_user_id(experiment_group)
                 if host_user_id:
                     print(f"⏱️ 時刻同期リクエスト: {user_id} → {host_user_id}")
@@ -771,6 +965,15 @@ async def websocket_endpoint(websocket: WebSocket):
             # ========================
             # リアクションデータの処理
             # ========================
+            # 差分フレーム（reaction_delta）を接続ごとの最終既知stateからフルサンプルに復元
+            data, needs_resync = manager.decode_reaction_frame(user_id, data)
+            if needs_resync:
+                await manager.send_personal_message({
+                    "type": "reaction_resync",
+                    "message": "差分の基準となるフルフレームを送信してください",
+                    "timestamp": int(time.time() * 1000)
+                }, user_id)
+
             # 受信データをログ出力（簡略版）
             is_host_user = manager.user_is_host.get(user_id, False)
             host_label = " (HOST)" if is_host_user else ""
@@ -785,31 +988,36 @@ async def websocket_endpoint(websocket: WebSocket):
             # ホストのリアクションは集約エンジンに登録しない
             if not is_host_user:
                 manager.update_reaction_data(user_id, data)
+                # 優先度の高いエフェクトはティックを待たずに判定して配信
+                if EARLY_TRIGGER_ENABLED and experiment_group in ['experiment', 'debug']:
+                    early_effect = manager.aggregation_engine.early_effect()
+                    if early_effect:
+                        await manager.publish_reaction_effect(early_effect)
             else:
                 print(f"  ⏭️ ホストのリアクションは集約から除外")
 
-            # 受信確認（デバッグ用、本番では削除可）
-            await manager.send_personal_message({
-                "type": "data_received",
-                "message": "データを受信し、集約処理に追加しました",
-                "timestamp": datetime.now().isoformat()
-            }, user_id)
+            # 受信確認（acks を購読しているクライアントのみ）
+            if manager.subscribes(user_id, 'acks'):
+                await manager.send_personal_message({
+                    "type": "data_received",
+                    "message": "データを受信し、集約処理に追加しました",
+                    "timestamp": datetime.now().isoformat()
+                }, user_id)
             
-    except WebSocketDisconnect:
+    except WebSocketDisconnect as e:
         if user_id:
-            manager.disconnect(user_id)
+            manager.disconnect(user_id, websocket, keep_state=e.code == SERVICE_RESTART_CLOSE_CODE)
         print(f"🔌 WebSocket切断: {user_id if user_id else '不明'}")
         
     except Exception as e:
         if user_id:
-            manager.disconnect(user_id)
+            manager.disconnect(user_id, websocket)
         print(f"❌ エラー発生: {e}")
         import traceback
         traceback.print_exc()
 
-@app.get("/status")
-async def get_status():
-    """システムステータス取得（デバッグ用）"""
+def build_status_snapshot() -> dict:
+    """/status の内容を作る（STATUS_CACHE_TTL の間は使い回す）"""
     # グループ別のユーザー数を集計
     group_counts = {'experiment': 0, 'control1': 0, 'control2': 0}
     for user_id, group in manager.user_groups.items():
@@ -819,15 +1027,61 @@ async def get_status():
     return {
         "active_connections": len(manager.active_connections),
         "connected_users": list(manager.active_connections.keys()),
-        "user_groups": manager.user_groups,
+        "user_groups": dict(manager.user_groups),
         "group_counts": group_counts,
+        "playback": {group: clock.describe() for group, clock in manager.playback_clocks.items()},
+        "aggregation_user_ids": list(manager.aggregation_engine.user_data.keys()),
+        "timestamp": datetime.now().isoformat()
+    }
+
+status_cache = TTLCache(STATUS_CACHE_TTL)
+
+@app.get("/status")
+async def get_status(offset: int = 0, limit: int = STATUS_PAGE_SIZE):
+    """システムステータス取得（デバッグ用）
+
+    Args:
+        offset: ユーザー一覧の開始位置
+        limit: ユーザー一覧の件数
+    """
+    snapshot = status_cache.get(build_status_snapshot)
+    offset = max(0, offset)
+    limit = max(0, limit)
+    connected_users = snapshot["connected_users"][offset:offset + limit]
+    aggregation_user_ids = snapshot["aggregation_user_ids"][offset:offset + limit]
+
+    return {
+        "active_connections": snapshot["active_connections"],
+        "connected_users": connected_users,
+        "user_groups": {user_id: snapshot["user_groups"].get(user_id) for user_id in connected_users},
+        "group_counts": snapshot["group_counts"],
+        "playback": snapshot["playback"],
         "aggregation_data": {
-            "total_users": len(manager.aggregation_engine.user_data),
-            "user_ids": list(manager.aggregation_engine.user_data.keys())
+            "total_users": len(snapshot["aggregation_user_ids"]),
+            "user_ids": aggregation_user_ids
+        },
+        "pagination": {
+            "offset": offset,
+            "limit": limit,
+            "total_connected_users": len(snapshot["connected_users"]),
+            "total_aggregation_users": len(snapshot["aggregation_user_ids"])
         },
+        "timestamp": snapshot["timestamp"]
+    }
+
+@app.get("/debug/metrics")
+async def get_metrics():
+    """プロセス内メトリクス（受付・制限・破棄されたフレーム数など）"""
+    return {
+        "counters": metrics.get_counters(),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/debug/loop")
+async def get_loop_lag(include_stacks: bool = True):
+    """イベントループの遅延のパーセンタイルと、しきい値を超えた停止の記録（原因のスタック・処理名）"""
+    return loop_watchdog.summary(include_stacks)
+
 @app.get("/debug/aggregation")
 async def get_aggregation_debug():
     """集約データのデバッグ情報取得"""
@@ -842,50 +1096,88 @@ async def get_aggregation_debug():
 
     return {
         "user_data": debug_info,
+        "mode": "sampled" if manager.aggregation_engine.sampling else "exact",
+        "last_tick_ms": manager.aggregation_engine.last_tick_ms,
+        "windowed_metrics": manager.aggregation_engine.windowed_metrics(time.time() * 1000),
         "timestamp": datetime.now().isoformat()
     }
 
 @app.get("/debug/database")
 async def get_database_stats():
-    """データベース統計情報取得"""
+    """データベース統計情報取得（行数は概算。記録時に更新し、DBは DB_STATS_REFRESH_SECONDS ごとに参照）"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
+        if db_stats.is_stale():
+            def load():
+                with get_db_connection() as conn:
+                    db_stats.load(conn, DB_TYPE)
+            await asyncio.to_thread(load)
+
+        db_info = str(DB_PATH) if DB_PATH else f"{DB_TYPE} (DATABASE_URL)"
+        return {
+            "database_path": db_info,
+            **db_stats.snapshot(),
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        return {
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }
 
-            # 各テーブルのレコード数を取得
-            cursor.execute("SELECT COUNT(*) FROM users")
-            users_count = cursor.fetchone()[0]
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """管理操作の認証（X-Admin-Token ヘッダーが ADMIN_TOKEN と一致しなければ403）"""
+    if not ADMIN_TOKEN or x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        metrics.increment("admin.auth.rejected")
+        raise HTTPException(status_code=403, detail="管理者トークンが必要です")
 
-            cursor.execute("SELECT COUNT(*) FROM reactions_log")
-            reactions_count = cursor.fetchone()[0]
 
-            cursor.execute("SELECT COUNT(*) FROM effects_log")
-            effects_count = cursor.fetchone()[0]
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def run_profiler(seconds: float = 10, interval_ms: Optional[float] = None, top: int = 30,
+                       format: str = "json", include_idle: bool = False):
+    """稼働中のプロセスをサンプリングプロファイラで seconds 秒間計測する
 
-            # 最新のレコードを取得
-            cursor.execute("SELECT * FROM reactions_log ORDER BY timestamp DESC LIMIT 5")
-            recent_reactions = cursor.fetchall()
+    format: "json"（関数ごとのサンプル数 + collapsed stack）or "collapsed"（flamegraph.pl にそのまま渡せるテキスト）
+    """
+    if SamplingProfiler.is_running():
+        return {"error": "別のプロファイルを計測中です", "timestamp": datetime.now().isoformat()}
+    try:
+        # 計測はワーカースレッドで行い、イベントループは止めない
+        result = await asyncio.to_thread(profiler.profile, seconds, interval_ms, include_idle)
+    except RuntimeError as e:
+        return {"error": str(e), "timestamp": datetime.now().isoformat()}
+    metrics.increment("profiler.runs")
+    if format == "collapsed":
+        return PlainTextResponse(result.collapsed())
+    return {**result.summary(top), "timestamp": datetime.now().isoformat()}
 
-            cursor.execute("SELECT * FROM effects_log ORDER BY timestamp DESC LIMIT 5")
-            recent_effects = cursor.fetchall()
+# ========================
+# エフェクト判定ルールAPI
+# ========================
 
-            db_info = str(DB_PATH) if DB_PATH else f"{DB_TYPE} (DATABASE_URL)"
-            return {
-                "database_path": db_info,
-                "stats": {
-                    "users": users_count,
-                    "reactions_log": reactions_count,
-                    "effects_log": effects_count
-                },
-                "recent_reactions": recent_reactions,
-                "recent_effects": recent_effects,
-                "timestamp": datetime.now().isoformat()
-            }
+@app.get("/admin/effect-rules")
+async def get_effect_rules():
+    """現在適用中のエフェクト判定ルール表を取得"""
+    return manager.aggregation_engine.rules.describe()
+
+@app.post("/admin/effect-rules/reload", dependencies=[Depends(require_admin)])
+async def reload_effect_rules(payload: Optional[dict] = Body(None)):
+    """エフェクト判定ルール表を再読み込み（WebSocket接続は維持したまま差し替え）
+
+    Body:
+        {"rules": [...]} を指定した場合はその内容を適用
+        省略した場合は EFFECT_RULES_PATH（未設定なら組み込みのルール表）を再読み込み
+    """
+    try:
+        if payload and 'rules' in payload:
+            rule_set = compile_rules(payload['rules'], origin="api")
+        else:
+            rule_set = load_configured_rules()
     except Exception as e:
-        return {
-            "error": str(e),
-            "timestamp": datetime.now().isoformat()
-        }
+        # コンパイルに失敗した場合は現在のルールを維持する
+        return {"error": str(e), "current": manager.aggregation_engine.rules.describe()}
+
+    manager.aggregation_engine.set_rules(rule_set)
+    return rule_set.describe()
 
 # ========================
 # データエクスポートAPI
@@ -922,10 +1214,26 @@ async def export_session(session_id: str):
                 "duration_ms": session_row[5] - session_row[4] if session_row[5] else None
             }
 
+            # アーカイブ済みのセッションはアーカイブファイルから返す
+            archive_path = retention.find_archive_path(cursor, DB_TYPE, session_id)
+            if archive_path:
+                archived = retention.read_archive(archive_path)
+                return {
+                    "session": session_info,
+                    "reactions": archived["reactions"],
+                    "effects": archived["effects"],
+                    "stats": {
+                        "total_reactions": len(archived["reactions"]),
+                        "total_effects": len(archived["effects"])
+                    },
+                    "archived": True
+                }
+
             # リアクションデータを取得
             cursor.execute("""
                 SELECT timestamp, video_time, is_smiling, is_surprised, is_concentrating,
-                       is_hand_up, nod_count, sway_vertical_count, cheer_count, clap_count
+                       is_hand_up, nod_count, sway_vertical_count, cheer_count, clap_count,
+                       shake_head_count, sway_horizontal_count
                 FROM reactions_log
                 WHERE session_id = %s
                 ORDER BY timestamp
@@ -944,7 +1252,9 @@ async def export_session(session_id: str):
                     "nod_count": row[6],
                     "sway_vertical_count": row[7],
                     "cheer_count": row[8],
-                    "clap_count": row[9]
+                    "clap_count": row[9],
+                    "shake_head_count": row[10],
+                    "sway_horizontal_count": row[11]
                 })
 
             # エフェクトデータを取得
@@ -1082,6 +1392,56 @@ async def get_all_sessions():
     except Exception as e:
         return {"error": str(e)}
 
+# ========================
+# ヒートマップAPI
+# ========================
+
+def _load_heatmap(video_id: str, group: Optional[str], bucket_seconds: Optional[float]) -> dict:
+    with get_db_connection() as conn:
+        ensure_heatmap_schema(conn, DB_TYPE)
+        return load_heatmap(conn.cursor(), DB_TYPE, video_id, group, bucket_seconds)
+
+@app.get("/videos/{video_id}/heatmap")
+async def get_video_heatmap(video_id: str, group: Optional[str] = None, bucket_seconds: Optional[float] = None):
+    """
+    動画の再生位置ごとのリアクション数（全セッション横断、グループ別）
+    索引（video_heatmap）の動画1本分の行だけを読む。直近 HEATMAP_FLUSH_INTERVAL 秒の記録は未反映
+    """
+    try:
+        result = await asyncio.to_thread(_load_heatmap, video_id, group, bucket_seconds)
+        result["timestamp"] = datetime.now().isoformat()
+        return result
+    except Exception as e:
+        return {"error": str(e)}
+
+# ========================
+# 分析API
+# ========================
+
+def _compute_analytics(sections: List[str], filters: ReportFilter, group: Optional[str]) -> dict:
+    with get_db_connection() as conn:
+        return compute_analytics(conn, DB_TYPE, sections, filters, group)
+
+@app.get("/analytics")
+async def get_analytics(sections: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                        group: Optional[str] = None):
+    """
+    セッション横断の分析（実験群ごとのリアクション率・エフェクトタイプ別の回数・セッションの完了率と所要時間）
+
+    Args:
+        sections: reactions / effects / sessions のカンマ区切り（省略時は全部）
+        since, until: 期間（ms または YYYY-MM-DD[THH:MM:SS]）
+        group: 実験群で絞り込み
+    """
+    try:
+        section_list = parse_sections(sections)
+        filters = ReportFilter(parse_time_arg(since), parse_time_arg(until))
+        key = (tuple(section_list), filters.since_ms, filters.until_ms, group)
+        result, cached = await analytics_cache.get(key, lambda: _compute_analytics(section_list, filters, group))
+        return dict(result, cached=cached, cache=analytics_cache.describe(), timestamp=datetime.now().isoformat())
+    except Exception as e:
+        return {"error": str(e)}
+
 if __name__ == "__main__":
     import uvicorn
     print("=" * 60)
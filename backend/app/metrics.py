@@ -0,0 +1,18 @@
+"""
+プロセス内メトリクス
+カウンターを名前で集計し、/debug/metrics で参照できるようにする
+"""
+from collections import defaultdict
+from typing import Dict
+
+_counters: Dict[str, int] = defaultdict(int)
+
+
+def increment(name: str, value: int = 1):
+    """カウンターを加算"""
+    _counters[name] += value
+
+
+def get_counters() -> Dict[str, int]:
+    """全カウンターのコピーを名前順で返す"""
+    return dict(sorted(_counters.items()))
@@ -0,0 +1,129 @@
+"""
+マージ可能な部分集約
+時間窓の集約は数え上げ（stateがtrueのユーザー数、イベントの合計、アクティブユーザー数、
+マイクありユーザー数）だけなので、ユーザーを分割したサブ集約（接続のシャード、ワーカー、
+ルームの分割など）で部分集約を並列に計算し、コーディネータでマージしてから指標に変換しても
+一括集約と同じ結果になる
+
+注意: マージする部分集約のユーザー集合は互いに素であること（同じユーザーを二重に数えない）
+"""
+from typing import Dict, Iterable, Optional
+
+AUDIO_EVENTS = ('cheer', 'clap')  # マイクありユーザー数を分母にするイベント
+
+
+class PartialAggregate:
+    """時間窓内の数え上げ（マージ可能）"""
+    __slots__ = ("active_users", "microphone_users", "state_counts", "event_totals")
+
+    def __init__(self, active_users: int = 0, microphone_users: int = 0,
+                 state_counts: Optional[Dict[str, int]] = None, event_totals: Optional[Dict[str, int]] = None):
+        self.active_users = active_users
+        self.microphone_users = microphone_users
+        self.state_counts: Dict[str, int] = state_counts if state_counts is not None else {}  # trueのユーザー数（0は持たない）
+        self.event_totals: Dict[str, int] = event_totals if event_totals is not None else {}  # 窓内の合計（出現したイベントは0でも持つ）
+
+    def add_user(self, samples: list, has_microphone: bool, state_metrics=None, event_metrics=None):
+        """アクティブユーザー1人分の窓内サンプルを加える"""
+        self.active_users += 1
+        if has_microphone:
+            self.microphone_users += 1
+
+        # 最新サンプルのstateを使用
+        states = samples[-1].get('states', {})
+        if state_metrics is not None:
+            for state_name in state_metrics:
+                if states.get(state_name):
+                    self.state_counts[state_name] = self.state_counts.get(state_name, 0) + 1
+        else:
+            for state_name, is_active in states.items():
+                if is_active:
+                    self.state_counts[state_name] = self.state_counts.get(state_name, 0) + 1
+
+        for sample in samples:
+            events = sample.get('events', {})
+            if event_metrics is not None:
+                for event_name in event_metrics:
+                    if event_name in events:
+                        self.event_totals[event_name] = self.event_totals.get(event_name, 0) + events[event_name]
+            else:
+                for event_name, count in events.items():
+                    self.event_totals[event_name] = self.event_totals.get(event_name, 0) + count
+
+    def merge(self, other: "PartialAggregate") -> "PartialAggregate":
+        """他の部分集約を加える（selfを更新して返す）"""
+        self.active_users += other.active_users
+        self.microphone_users += other.microphone_users
+        for state_name, count in other.state_counts.items():
+            self.state_counts[state_name] = self.state_counts.get(state_name, 0) + count
+        for event_name, total in other.event_totals.items():
+            self.event_totals[event_name] = self.event_totals.get(event_name, 0) + total
+        return self
+
+    def to_metrics(self, window_ms: int = 3000) -> Optional[dict]:
+        """
+        集約指標（ratio_state, density_event）に変換する
+        返り値: AggregationEngine.compute_window_metrics と同じ形式 or None（アクティブユーザーなし）
+        """
+        if self.active_users == 0:
+            return None
+
+        ratio_state = {}
+        for state_name, count in self.state_counts.items():
+            ratio_state[state_name] = count / self.active_users
+
+        # 音声イベント（cheer, clap）: マイクありユーザー数を分母に
+        # その他のイベント: 全アクティブユーザー数を分母に
+        density_event = {}
+        window_seconds = window_ms / 1000
+        for event_name, total in self.event_totals.items():
+            if event_name in AUDIO_EVENTS:
+                if self.microphone_users > 0:
+                    density_event[event_name] = total / (self.microphone_users * window_seconds)
+                else:
+                    density_event[event_name] = 0.0
+            else:
+                density_event[event_name] = total / (self.active_users * window_seconds)
+
+        return {
+            "activeUsers": self.active_users,
+            "microphoneUsers": self.microphone_users,
+            "ratioState": ratio_state,
+            "densityEvent": density_event
+        }
+
+    def to_dict(self) -> dict:
+        """JSONで送れる形式にシリアライズ"""
+        return {
+            "activeUsers": self.active_users,
+            "microphoneUsers": self.microphone_users,
+            "stateCounts": dict(self.state_counts),
+            "eventTotals": dict(self.event_totals)
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PartialAggregate":
+        """to_dict の結果から復元"""
+        return cls(
+            active_users=int(data.get('activeUsers', 0)),
+            microphone_users=int(data.get('microphoneUsers', 0)),
+            state_counts={k: int(v) for k, v in (data.get('stateCounts') or {}).items()},
+            event_totals=dict(data.get('eventTotals') or {})
+        )
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, PartialAggregate):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return (f"PartialAggregate(active_users={self.active_users}, microphone_users={self.microphone_users}, "
+                f"state_counts={self.state_counts}, event_totals={self.event_totals})")
+
+
+def merge_partials(partials: Iterable[PartialAggregate]) -> PartialAggregate:
+    """部分集約をまとめて1つにする（入力は変更しない）"""
+    merged = PartialAggregate()
+    for partial in partials:
+        merged.merge(partial)
+    return merged
@@ -0,0 +1,77 @@
+"""
+サーバー側の再生位置モデル
+ホストから届く video_play / video_pause / video_seek と定期的な video_position を
+単調時計（time.monotonic()）に対して記録し、現在の再生位置を外挿する
+
+参加者の time_sync_request には、モデルが新しい間はサーバーが直接応答し、
+古い（ホストからの更新が途絶えた）場合のみ従来どおりホストに中継する
+"""
+import math
+import os
+import time
+from typing import Optional
+
+# ホストからの更新がこの時間（秒）ないモデルは古いとみなす
+PLAYBACK_MODEL_MAX_AGE = float(os.getenv("PLAYBACK_MODEL_MAX_AGE", "15"))
+
+PLAYBACK_EVENT_TYPES = ('video_play', 'video_pause', 'video_seek', 'video_position')
+
+
+def parse_playback_time(value) -> Optional[float]:
+    """クライアントが送った currentTime を検証する（有限の数値でなければNone）"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None
+    return float(value)
+
+
+class PlaybackClock:
+    """グループ（ルーム）ごとのホストの再生状態"""
+    def __init__(self, max_age: float = PLAYBACK_MODEL_MAX_AGE):
+        self.max_age = max_age
+        self.position: Optional[float] = None  # 最後に報告された再生位置（秒）
+        self.is_playing = False
+        self.updated_at: Optional[float] = None  # 報告を受けた時刻（time.monotonic()）
+
+    def update(self, event_type: str, current_time: float, is_playing: Optional[bool] = None,
+               now: Optional[float] = None):
+        """ホストからの再生イベントでモデルを更新"""
+        if now is None:
+            now = time.monotonic()
+        if event_type == 'video_play':
+            self.is_playing = True
+        elif event_type == 'video_pause':
+            self.is_playing = False
+        elif event_type == 'video_position' and is_playing is not None:
+            self.is_playing = bool(is_playing)
+        # video_seek は再生状態を変えない
+        self.position = float(current_time)
+        self.updated_at = now
+
+    def current_position(self, now: Optional[float] = None) -> Optional[float]:
+        """現在の再生位置を外挿（未報告ならNone）"""
+        if self.position is None:
+            return None
+        if not self.is_playing:
+            return self.position
+        if now is None:
+            now = time.monotonic()
+        return self.position + (now - self.updated_at)
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        """直接応答に使えるほど新しいか"""
+        if self.updated_at is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now - self.updated_at <= self.max_age
+
+    def describe(self, now: Optional[float] = None) -> dict:
+        """API返却用の状態"""
+        if now is None:
+            now = time.monotonic()
+        return {
+            "position": self.current_position(now),
+            "isPlaying": self.is_playing,
+            "ageSeconds": now - self.updated_at if self.updated_at is not None else None,
+            "fresh": self.is_fresh(now)
+        }
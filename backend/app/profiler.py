@@ -0,0 +1,163 @@
+"""
+稼働中のサーバー用のサンプリングプロファイラ
+別スレッドから一定間隔で全スレッドのスタック（sys._current_frames()）を取得して数え上げる。
+計測対象のコードには手を加えないため、再起動なしで必要なときだけ実行でき、
+計測中のオーバーヘッドもサンプリング間隔分のスタック取得だけで済む
+
+- イベントループのスレッド（受信ループ、集約ループ、ブロードキャスト、ループ内で同期的に行うDB記録）と
+  asyncio.to_thread のワーカースレッドをまとめて計測する
+- 結果は collapsed stack 形式（flamegraph.pl / speedscope で読める）と、関数ごとの self / total のサンプル数
+- 待機中のスタック（selectでのイベント待ち、ワーカーのキュー待ちなど）は既定で除外する
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))  # サンプリング間隔
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))  # 1回の計測の上限
+
+# この関数がスタックの末端にある場合は待機中とみなす（ファイル名, 関数名）
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+}
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_label_cache: Dict[object, str] = {}
+
+
+def frame_label(code) -> str:
+    """スタックの1段の表示名（app内はパッケージ相対のパス、それ以外はファイル名）"""
+    label = _label_cache.get(code)
+    if label is None:
+        filename = code.co_filename
+        if filename.startswith(_BACKEND_DIR):
+            path = os.path.relpath(filename, _BACKEND_DIR)
+        else:
+            path = os.path.basename(filename)
+        name = getattr(code, "co_qualname", code.co_name)
+        # collapsed stack 形式の区切り文字を含めない
+        label = f"{path}:{name}".replace(";", ",").replace(" ", "_")
+        _label_cache[code] = label
+    return label
+
+
+def is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+class SamplingProfiler:
+    """一定時間スタックをサンプリングする（同時に1つだけ実行できる）"""
+    _lock = threading.Lock()
+
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS, include_idle: bool = False):
+        self.interval = max(interval_ms, 1.0) / 1000
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.sampling_seconds = 0.0  # スタック取得にかかった時間（オーバーヘッドの目安）
+        self.duration = 0.0
+
+    @classmethod
+    def is_running(cls) -> bool:
+        return cls._lock.locked()
+
+    def _sample(self, own_ident: int):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            if not self.include_idle and is_idle(frame):
+                self.idle_samples += 1
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(thread_names.get(ident, f"thread-{ident}"))
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def run(self, seconds: float) -> "SamplingProfiler":
+        """seconds 秒間サンプリングする（ブロックするので別スレッドで呼ぶ）"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("別のプロファイルを計測中です")
+        try:
+            own_ident = threading.get_ident()
+            started = time.perf_counter()
+            deadline = started + min(seconds, PROFILER_MAX_SECONDS)
+            next_sample = started
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                if now < next_sample:
+                    time.sleep(next_sample - now)
+                    continue
+                self._sample(own_ident)
+                self.sampling_seconds += time.perf_counter() - now
+                next_sample += self.interval
+                if next_sample < now:
+                    # GILの取得待ちなどで遅れた分は取り戻さない
+                    next_sample = now + self.interval
+            self.duration = time.perf_counter() - started
+        finally:
+            self._lock.release()
+        return self
+
+    def collapsed(self) -> str:
+        """collapsed stack 形式（1行 = "スレッド;関数;...;末端の関数 サンプル数"）"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def top_functions(self, limit: int = 30) -> List[dict]:
+        """関数ごとのサンプル数（self: 末端にいた回数, total: スタックに含まれていた回数）"""
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]  # 先頭はスレッド名
+            if not frames:
+                continue
+            self_counts[frames[-1]] += count
+            for function in set(frames):
+                total_counts[function] += count
+        samples = max(self.samples, 1)
+        ranked: List[Tuple[str, int]] = sorted(total_counts.items(),
+                                               key=lambda item: (self_counts[item[0]], item[1]), reverse=True)
+        return [
+            {
+                "function": function,
+                "self": self_counts[function],
+                "total": total,
+                "selfPercent": round(self_counts[function] * 100 / samples, 2),
+                "totalPercent": round(total * 100 / samples, 2)
+            }
+            for function, total in ranked[:limit]
+        ]
+
+    def summary(self, limit: int = 30, include_stacks: bool = True) -> dict:
+        """API返却用"""
+        result = {
+            "durationSeconds": round(self.duration, 3),
+            "intervalMs": self.interval * 1000,
+            "samples": self.samples,
+            "idleSamples": self.idle_samples,
+            "overheadPercent": round(self.sampling_seconds * 100 / self.duration, 2) if self.duration else 0.0,
+            "top": self.top_functions(limit)
+        }
+        if include_stacks:
+            result["collapsed"] = self.collapsed()
+        return result
+
+
+def profile(seconds: float, interval_ms: Optional[float] = None, include_idle: bool = False) -> SamplingProfiler:
+    """seconds 秒間計測した結果を返す（ブロックする）"""
+    profiler = SamplingProfiler(interval_ms if interval_ms is not None else PROFILER_INTERVAL_MS, include_idle)
+    return profiler.run(seconds)
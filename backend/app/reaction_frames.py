@@ -0,0 +1,82 @@
+"""
+リアクションフレームの復元
+差分フレーム（変化したstateと0以外のeventのみ）を接続ごとの最終既知状態からフルサンプルに復元する
+
+フレーム形式:
+    フルフレーム（従来形式）:
+        {"states": {...全state}, "events": {...}, "seq": 12, ...}
+    差分フレーム:
+        {"type": "reaction_delta", "seq": 13, "states": {"isSmiling": true}, "events": {"nod": 1}, ...}
+
+seq（接続内で単調増加、省略可）:
+    stateはキーごとに最後に反映したseqを記録し、それより古いフレームの値では上書きしない。
+    そのため到着順が入れ替わっても最新の値が残る。eventはフレームごとのカウントなので常に反映する
+"""
+from typing import Dict, Tuple
+
+# フロントエンドの ReactionStates / ReactionEvents に対応
+STATE_KEYS = ('isSmiling', 'isSurprised', 'isConcentrating', 'isHandUp')
+EVENT_KEYS = ('nod', 'shakeHead', 'swayVertical', 'swayHorizontal', 'cheer', 'clap')
+
+DELTA_FRAME_TYPE = 'reaction_delta'
+
+
+class ReactionFrameDecoder:
+    """接続ごとの最終既知stateを保持し、フレームをフルサンプルに復元する"""
+    def __init__(self):
+        self.states: Dict[str, bool] = {key: False for key in STATE_KEYS}
+        self.state_seq: Dict[str, int] = {}
+        self.has_base = False  # フルフレームを一度でも受信したか
+        self.resync_requested = False  # 再同期を要求済みか（フルフレーム受信まで繰り返し要求しない）
+        self.next_seq = 0  # seqを省略したフレームに割り当てる番号
+
+    def _frame_seq(self, data: dict) -> int:
+        seq = data.get('seq')
+        if isinstance(seq, int):
+            self.next_seq = max(self.next_seq, seq + 1)
+            return seq
+        seq = self.next_seq
+        self.next_seq += 1
+        return seq
+
+    def _apply_state(self, key: str, value, seq: int):
+        if seq >= self.state_seq.get(key, -1):
+            self.states[key] = bool(value)
+            self.state_seq[key] = seq
+
+    def decode(self, data: dict) -> Tuple[dict, bool]:
+        """
+        フレームを復元する
+
+        返り値: (フルサンプルのデータ, 再同期が必要か)
+            差分フレームを基準となるフルフレームより先に受信した場合は、
+            未知のstateをFalseとして復元し、再同期（フルフレーム送信）を1回だけ要求する
+        """
+        seq = self._frame_seq(data)
+        is_delta = data.get('type') == DELTA_FRAME_TYPE
+        states = data.get('states') or {}
+
+        if is_delta:
+            needs_resync = not self.has_base and not self.resync_requested
+            self.resync_requested = self.resync_requested or needs_resync
+            for key, value in states.items():
+                self._apply_state(key, value, seq)
+        else:
+            needs_resync = False
+            # フルフレームに含まれないstateはFalseとして扱う（従来の挙動と同じ）
+            for key in set(self.states) | set(states):
+                self._apply_state(key, states.get(key, False), seq)
+            self.has_base = True
+
+        events = data.get('events') or {}
+        full = dict(data)
+        full.pop('type', None)
+        full.pop('seq', None)
+        full['states'] = dict(self.states)
+        full['events'] = {key: events.get(key, 0) for key in EVENT_KEYS}
+        # 未知のイベント種別もそのまま残す
+        for key, value in events.items():
+            if key not in full['events']:
+                full['events'][key] = value
+        return full, needs_resync
+
@@ -0,0 +1,434 @@
+"""
+リアクションログのコンパクトな格納形式
+reactions_log の1行ごとに session_id / user_id の文字列、4つの真偽値、4つの整数を持つ代わりに、
+reaction_samples テーブルに次の形式で格納する
+
+- session_id / user_id: 整数の代理キー（session_keys / user_keys テーブル）
+- state: ビットマスク（states カラム、1ビット = 1種類）
+- イベント数: 固定幅（EVENT_BITS ビット）のフィールドを詰めた整数（events カラム、上限で飽和。飽和した場合はログとメトリクスに記録）
+
+どのリアクションがどのビット位置を使うかは REACTION_TYPES（reaction_types テーブルにも登録）で決まる。
+新しいリアクションは REACTION_TYPES に未使用の slot で追加して python -m app.database を実行すれば、
+ALTER TABLE なしでビューに列が増える（slot は再利用しないこと）
+
+分析用のビュー
+- reactions_log: 従来のカラム構成（+ 登録済みの全リアクション）にデコードしたビュー（既存のクエリはそのまま動く）
+- reaction_values: 1行 = 1サンプル × 1リアクションの縦持ちビュー（reaction_types と結合するので列の追加も不要）
+
+従来の reactions_log テーブルがあるDBは、このCLIを明示的に実行したときだけ変換する
+（サーバーの起動時・python -m app.database では変換せず、警告だけを出す。
+  変換するまでサーバーは従来の reactions_log テーブルに記録し続けるので、既存の読み出し側から見える）
+イベント数が EVENT_MAX を超える行がある場合は変換を中止する（--saturate で EVENT_MAX に丸めて変換）
+
+使い方:
+    python -m app.reaction_store                      # DATABASE_URL / 既定のDBを変換
+    python -m app.reaction_store --sqlite backup.db
+    python -m app.reaction_store --sqlite backup.db --saturate
+"""
+import argparse
+import os
+import sys
+from typing import Dict, Optional, Set
+
+from app import metrics as service_metrics
+from app.database import adapt_query, open_db
+
+EVENT_BITS = 6  # イベント数1つあたりのビット数（1サンプル = 1秒分の回数なので63で十分）
+EVENT_MAX = (1 << EVENT_BITS) - 1
+MAX_EVENT_SLOTS = 10  # BIGINT（符号ビットを除く63ビット）に収まる数
+MAX_STATE_SLOTS = 31  # PostgreSQLの INTEGER（符号ビットを除く31ビット）に収まる数
+
+# リアクションの登録簿（slot = ビット位置 / フィールド番号。追加のみで変更・再利用しない）
+# name: フロントエンドが送るキー, column: デコードしたビューでのカラム名
+REACTION_TYPES = (
+    {"name": "isSmiling", "kind": "state", "slot": 0, "column": "is_smiling"},
+    {"name": "isSurprised", "kind": "state", "slot": 1, "column": "is_surprised"},
+    {"name": "isConcentrating", "kind": "state", "slot": 2, "column": "is_concentrating"},
+    {"name": "isHandUp", "kind": "state", "slot": 3, "column": "is_hand_up"},
+    {"name": "nod", "kind": "event", "slot": 0, "column": "nod_count"},
+    {"name": "swayVertical", "kind": "event", "slot": 1, "column": "sway_vertical_count"},
+    {"name": "cheer", "kind": "event", "slot": 2, "column": "cheer_count"},
+    {"name": "clap", "kind": "event", "slot": 3, "column": "clap_count"},
+    {"name": "shakeHead", "kind": "event", "slot": 4, "column": "shake_head_count"},
+    {"name": "swayHorizontal", "kind": "event", "slot": 5, "column": "sway_horizontal_count"},
+)
+STATE_TYPES = tuple(t for t in REACTION_TYPES if t["kind"] == "state")
+EVENT_TYPES = tuple(t for t in REACTION_TYPES if t["kind"] == "event")
+
+
+def validate_registry():
+    """slot の重複・範囲外を検出する"""
+    for kind, types, limit in (("state", STATE_TYPES, MAX_STATE_SLOTS), ("event", EVENT_TYPES, MAX_EVENT_SLOTS)):
+        slots = [t["slot"] for t in types]
+        if len(set(slots)) != len(slots):
+            raise ValueError(f"{kind} の slot が重複しています: {slots}")
+        if any(not 0 <= slot < limit for slot in slots):
+            raise ValueError(f"{kind} の slot は 0〜{limit - 1} で指定してください: {slots}")
+
+
+validate_registry()
+
+
+# ========================
+# パック・アンパック
+# ========================
+
+def pack_states(states: dict) -> int:
+    mask = 0
+    for reaction_type in STATE_TYPES:
+        if states.get(reaction_type["name"]):
+            mask |= 1 << reaction_type["slot"]
+    return mask
+
+
+def pack_events(events: dict) -> int:
+    """イベント数を詰める（EVENT_MAX を超える回数は飽和させ、ログとメトリクスに記録する）"""
+    packed = 0
+    for reaction_type in EVENT_TYPES:
+        count = max(int(events.get(reaction_type["name"]) or 0), 0)
+        if count > EVENT_MAX:
+            print(f"⚠️ {reaction_type['name']} のイベント数 {count} が上限 {EVENT_MAX} を超えたため飽和させて記録します")
+            service_metrics.increment("reactions.events.saturated")
+            count = EVENT_MAX
+        packed |= count << (reaction_type["slot"] * EVENT_BITS)
+    return packed
+
+
+def unpack_states(mask: int) -> Dict[str, bool]:
+    return {t["name"]: bool(mask >> t["slot"] & 1) for t in STATE_TYPES}
+
+
+def unpack_events(packed: int) -> Dict[str, int]:
+    return {t["name"]: packed >> (t["slot"] * EVENT_BITS) & EVENT_MAX for t in EVENT_TYPES}
+
+
+# ========================
+# スキーマ
+# ========================
+
+def create_packed_schema(cursor, db_type: str):
+    if db_type == "postgresql":
+        serial, bigint = "SERIAL PRIMARY KEY", "BIGINT"
+    else:
+        serial, bigint = "INTEGER PRIMARY KEY AUTOINCREMENT", "INTEGER"
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS user_keys (
+            id {serial},
+            user_id TEXT NOT NULL UNIQUE
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS session_keys (
+            id {serial},
+            session_id TEXT NOT NULL UNIQUE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reaction_types (
+            name TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            slot INTEGER NOT NULL,
+            column_name TEXT NOT NULL
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS reaction_samples (
+            id {serial},
+            session_key INTEGER REFERENCES session_keys(id),
+            user_key INTEGER NOT NULL REFERENCES user_keys(id),
+            timestamp {bigint} NOT NULL,
+            video_time REAL,
+            states INTEGER NOT NULL DEFAULT 0,
+            events {bigint} NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reaction_samples_session ON reaction_samples (session_key)")
+
+
+def sync_registry(cursor, db_type: str):
+    """REACTION_TYPES を reaction_types テーブルに登録する（登録済みの slot と食い違う場合はエラー）"""
+    cursor.execute("SELECT name, kind, slot FROM reaction_types")
+    registered = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    for reaction_type in REACTION_TYPES:
+        name = reaction_type["name"]
+        if name in registered:
+            if registered[name] != (reaction_type["kind"], reaction_type["slot"]):
+                raise ValueError(f"{name} の登録済みの slot と REACTION_TYPES が食い違っています: {registered[name]}")
+            continue
+        cursor.execute(adapt_query("INSERT INTO reaction_types (name, kind, slot, column_name) VALUES (%s, %s, %s, %s)",
+                                   db_type),
+                       (name, reaction_type["kind"], reaction_type["slot"], reaction_type["column"]))
+
+
+def _state_expr(slot: int, prefix: str = "s.") -> str:
+    return f"(({prefix}states >> {slot}) & 1) = 1"
+
+
+def _event_expr(slot: int, prefix: str = "s.") -> str:
+    return f"(({prefix}events >> {slot * EVENT_BITS}) & {EVENT_MAX})"
+
+
+def create_decoding_views(cursor, db_type: str):
+    """分析用のビューを作り直す（リアクションが増えたらビューの列も増える）"""
+    decoded = ",\n".join(
+        f"{_state_expr(t['slot']) if t['kind'] == 'state' else _event_expr(t['slot'])} AS {t['column']}"
+        for t in REACTION_TYPES
+    )
+    cursor.execute("DROP VIEW IF EXISTS reactions_log")
+    cursor.execute(f"""
+        CREATE VIEW reactions_log AS
+        SELECT s.id, sk.session_id, uk.user_id, s.timestamp, s.video_time,
+               {decoded}
+        FROM reaction_samples s
+        JOIN user_keys uk ON uk.id = s.user_key
+        LEFT JOIN session_keys sk ON sk.id = s.session_key
+    """)
+    cursor.execute("DROP VIEW IF EXISTS reaction_values")
+    cursor.execute(f"""
+        CREATE VIEW reaction_values AS
+        SELECT s.id AS sample_id, sk.session_id, uk.user_id, s.timestamp, s.video_time,
+               t.name AS reaction_type, t.kind,
+               CASE WHEN t.kind = 'state' THEN (s.states >> t.slot) & 1
+                    ELSE (s.events >> (t.slot * {EVENT_BITS})) & {EVENT_MAX} END AS value
+        FROM reaction_samples s
+        CROSS JOIN reaction_types t
+        JOIN user_keys uk ON uk.id = s.user_key
+        LEFT JOIN session_keys sk ON sk.id = s.session_key
+    """)
+
+
+def legacy_table_exists(cursor, db_type: str) -> bool:
+    """従来形式の reactions_log テーブル（ビューではない）があるか"""
+    if db_type == "postgresql":
+        cursor.execute("""
+            SELECT 1 FROM information_schema.tables
+            WHERE table_name = 'reactions_log' AND table_type = 'BASE TABLE'
+        """)
+    else:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reactions_log'")
+    return cursor.fetchone() is not None
+
+
+def _legacy_columns(cursor, db_type: str):
+    if db_type == "postgresql":
+        cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'reactions_log'")
+        return {row[0] for row in cursor.fetchall()}
+    cursor.execute("PRAGMA table_info(reactions_log)")
+    return {row[1] for row in cursor.fetchall()}
+
+
+def convert_legacy_reactions(cursor, db_type: str, saturate: bool = False) -> int:
+    """
+    従来形式の reactions_log テーブルを reaction_samples に変換して削除する
+    - NULLのstateはfalse、負のイベント数は0として格納する
+    - EVENT_MAX を超えるイベント数がある場合は ValueError（saturate=True なら EVENT_MAX として格納）
+    - idは引き継ぐ。reaction_samples に既に行がある場合（変換前にサーバーが記録した分）は衝突しないよう新しいidを振る
+    返り値: 変換した行数
+    """
+    columns = _legacy_columns(cursor, db_type)
+
+    def legacy(column: str) -> str:
+        return f"r.{column}" if column in columns else "NULL"
+
+    overflow_columns = [t["column"] for t in EVENT_TYPES if t["column"] in columns]
+    if overflow_columns:
+        cursor.execute(f"SELECT COUNT(*) FROM reactions_log WHERE "
+                       f"{' OR '.join(f'{column} > {EVENT_MAX}' for column in overflow_columns)}")
+        overflow = cursor.fetchone()[0]
+        if overflow and not saturate:
+            raise ValueError(f"イベント数が上限 {EVENT_MAX} を超える行が {overflow:,}行あります"
+                             f"（--saturate を指定すると {EVENT_MAX} に丸めて変換します）")
+        if overflow:
+            print(f"⚠️ イベント数が上限 {EVENT_MAX} を超える {overflow:,}行を {EVENT_MAX} に丸めて変換します")
+
+    cursor.execute("""
+        INSERT INTO user_keys (user_id)
+        SELECT DISTINCT user_id FROM reactions_log WHERE user_id IS NOT NULL
+        ON CONFLICT (user_id) DO NOTHING
+    """)
+    if "session_id" in columns:
+        cursor.execute("""
+            INSERT INTO session_keys (session_id)
+            SELECT DISTINCT session_id FROM reactions_log WHERE session_id IS NOT NULL
+            ON CONFLICT (session_id) DO NOTHING
+        """)
+        session_join = "LEFT JOIN session_keys sk ON sk.session_id = r.session_id"
+        session_key = "sk.id"
+    else:
+        session_join = ""
+        session_key = "NULL"
+
+    # SQLiteではビット演算子の優先順位が同じなので、項ごとに括弧で囲んで足し合わせる（ビットは重ならない）
+    states = " + ".join(
+        f"(CASE WHEN {legacy(t['column'])} THEN {1 << t['slot']} ELSE 0 END)" for t in STATE_TYPES
+        if t["column"] in columns
+    ) or "0"
+    events = " + ".join(
+        f"((CASE WHEN {legacy(t['column'])} IS NULL OR {legacy(t['column'])} < 0 THEN 0 "
+        f"WHEN {legacy(t['column'])} > {EVENT_MAX} THEN {EVENT_MAX} "
+        f"ELSE {legacy(t['column'])} END) * {1 << (t['slot'] * EVENT_BITS)})"
+        for t in EVENT_TYPES if t["column"] in columns
+    ) or "0"
+    cursor.execute("SELECT COUNT(*) FROM reaction_samples")
+    keep_ids = cursor.fetchone()[0] == 0
+    if not keep_ids:
+        print("⚠️ reaction_samples に記録済みの行があるため、変換した行には新しいidを振ります")
+    id_column, id_value = ("id, ", "r.id, ") if keep_ids else ("", "")
+    cursor.execute(f"""
+        INSERT INTO reaction_samples ({id_column}session_key, user_key, timestamp, video_time, states, events)
+        SELECT {id_value}{session_key}, uk.id, r.timestamp, {legacy('video_time')}, {states}, {events}
+        FROM reactions_log r
+        JOIN user_keys uk ON uk.user_id = r.user_id
+        {session_join}
+        ORDER BY r.id
+    """)
+    converted = cursor.rowcount
+
+    cursor.execute("SELECT COUNT(*) FROM reactions_log")
+    legacy_count = cursor.fetchone()[0]
+    if converted != legacy_count:
+        raise ValueError(f"変換した行数が一致しません: {converted} / {legacy_count}")
+    cursor.execute("DROP TABLE reactions_log")
+    if db_type == "postgresql":
+        cursor.execute("""
+            SELECT setval(pg_get_serial_sequence('reaction_samples', 'id'), (SELECT MAX(id) FROM reaction_samples))
+            WHERE EXISTS (SELECT 1 FROM reaction_samples)
+        """)
+    return converted
+
+
+def ensure_packed_schema(conn, db_type: str, convert_legacy: bool = False, saturate: bool = False) -> int:
+    """
+    格納用のテーブル・登録簿・ビューを用意する
+    convert_legacy=True の場合は従来形式の reactions_log テーブルを変換する（CLIからのみ指定する）
+    従来形式のテーブルが残っている間は、同名のデコード用ビューは作らない
+    返り値: 変換した行数
+    """
+    cursor = conn.cursor()
+    try:
+        create_packed_schema(cursor, db_type)
+        sync_registry(cursor, db_type)
+        converted = 0
+        legacy = legacy_table_exists(cursor, db_type)
+        if legacy and convert_legacy:
+            converted = convert_legacy_reactions(cursor, db_type, saturate)
+            legacy = False
+        if not legacy:
+            create_decoding_views(cursor, db_type)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return converted
+
+
+# ========================
+# 書き込み
+# ========================
+
+class KeyCache:
+    """
+    session_id / user_id → 代理キーのキャッシュ（キーは削除しないので無効化は不要）
+    従来形式の reactions_log テーブルが残っているかどうかもここに覚えておく
+    """
+    TABLES = {"user": ("user_keys", "user_id"), "session": ("session_keys", "session_id")}
+
+    def __init__(self):
+        self.keys: Dict[str, Dict[str, int]] = {kind: {} for kind in self.TABLES}
+        self.legacy_columns: Optional[Set[str]] = None  # 従来形式のテーブルのカラム（変換済みなら空）
+
+    def key(self, conn, db_type: str, kind: str, value: Optional[str]) -> Optional[int]:
+        if value is None:
+            return None
+        cached = self.keys[kind].get(value)
+        if cached is not None:
+            return cached
+        table, column = self.TABLES[kind]
+        cursor = conn.cursor()
+        cursor.execute(adapt_query(f"INSERT INTO {table} ({column}) VALUES (%s) ON CONFLICT ({column}) DO NOTHING",
+                                   db_type), (value,))
+        cursor.execute(adapt_query(f"SELECT id FROM {table} WHERE {column} = %s", db_type), (value,))
+        key = cursor.fetchone()[0]
+        # 後続の書き込みが失敗してもキャッシュしたキーが消えないよう、先にコミットする
+        conn.commit()
+        self.keys[kind][value] = key
+        return key
+
+
+def _insert_legacy_reaction(cursor, db_type: str, columns: Set[str], session_id: Optional[str], user_id: str,
+                            timestamp: int, video_time: Optional[float], states: dict, events: dict):
+    """従来形式の reactions_log テーブルに1件を記録する（テーブルにないカラムのリアクションは記録しない）"""
+    row = {"session_id": session_id, "user_id": user_id, "timestamp": timestamp, "video_time": video_time}
+    for reaction_type in REACTION_TYPES:
+        if reaction_type["kind"] == "state":
+            row[reaction_type["column"]] = bool(states.get(reaction_type["name"]))
+        else:
+            row[reaction_type["column"]] = max(int(events.get(reaction_type["name"]) or 0), 0)
+    row = {column: value for column, value in row.items() if column in columns}
+    cursor.execute(adapt_query(f"INSERT INTO reactions_log ({', '.join(row)}) "
+                               f"VALUES ({', '.join(['%s'] * len(row))})", db_type), tuple(row.values()))
+
+
+def insert_reaction(conn, db_type: str, keys: KeyCache, session_id: Optional[str], user_id: str,
+                    timestamp: int, video_time: Optional[float], states: dict, events: dict):
+    """
+    リアクション1件を格納する（コミットは呼び出し側）
+    従来形式の reactions_log テーブルが残っている間は、変換するまでそのテーブルに記録する
+    （サーバーの稼働中に変換した場合は、書き込みの失敗を検知して reaction_samples に切り替える）
+    """
+    if keys.legacy_columns is None:
+        cursor = conn.cursor()
+        keys.legacy_columns = _legacy_columns(cursor, db_type) if legacy_table_exists(cursor, db_type) else set()
+    if keys.legacy_columns:
+        try:
+            _insert_legacy_reaction(conn.cursor(), db_type, keys.legacy_columns, session_id, user_id,
+                                    timestamp, video_time, states, events)
+            return
+        except Exception:
+            conn.rollback()
+            if legacy_table_exists(conn.cursor(), db_type):
+                raise
+            print("ℹ️ reactions_log が変換されたため、reaction_samples への記録に切り替えます")
+            keys.legacy_columns = set()
+    session_key = keys.key(conn, db_type, "session", session_id)
+    user_key = keys.key(conn, db_type, "user", user_id)
+    cursor = conn.cursor()
+    cursor.execute(adapt_query("""
+        INSERT INTO reaction_samples (session_key, user_key, timestamp, video_time, states, events)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, db_type), (session_key, user_key, timestamp, video_time, pack_states(states), pack_events(events)))
+
+
+# ========================
+# CLI
+# ========================
+
+def _sqlite_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="reactions_log をコンパクトな格納形式に変換する")
+    parser.add_argument("--sqlite", help="変換するSQLiteファイル（省略時はDATABASE_URL/既定のDB）")
+    parser.add_argument("--no-vacuum", action="store_true", help="変換後にVACUUMしない（SQLite）")
+    parser.add_argument("--saturate", action="store_true",
+                        help=f"イベント数が上限 {EVENT_MAX} を超える行を {EVENT_MAX} に丸めて変換する（既定では変換を中止）")
+    args = parser.parse_args(argv)
+
+    with open_db(args.sqlite) as (conn, db_type):
+        size_before = _sqlite_size(args.sqlite) if args.sqlite else 0
+        try:
+            converted = ensure_packed_schema(conn, db_type, convert_legacy=True, saturate=args.saturate)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+        print(f"✅ reactions_log を変換しました: {converted:,}行")
+        if db_type == "sqlite" and args.sqlite and converted and not args.no_vacuum:
+            conn.execute("VACUUM")
+            size_after = _sqlite_size(args.sqlite)
+            print(f"💾 ファイルサイズ: {size_before:,} → {size_after:,} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,392 @@
+"""
+オフラインリプレイツール
+reactions_logを仮想時計でAggregationEngineに流し込み、
+本番で発動したはずのエフェクト列を再現してeffects_logと比較する
+
+本番と同じく、サンプルを受け取るたびに即時判定（early_effect）を行い、ティックと即時判定の
+エフェクトをEffectCoalescerに通してeffects_logに記録されるもの（start / switch / update）だけを返す
+（--no-early / --no-coalesce でそれぞれ無効にできる）
+
+実時間ではなくCPUの許す限りの速度で処理するため、数時間分の実験データも数秒で再生できる
+
+使い方:
+    python -m app.replay
+    python -m app.replay --sqlite data/live_reaction.db --since 2025-11-17 --output replay.jsonl
+
+注意:
+    - reactions_logにはhasMicrophoneが記録されていないため、--microphoneで推定方法を指定する
+    - 本番と同じくホストのリアクションは集約しない（users.is_host のホストと --hosts で指定したユーザーを除外する。
+      is_host カラムの追加前に記録したDBでは --hosts でホストを指定する）
+    - effects_logには対照群1のランダムエフェクトや手動エフェクトも含まれるため、
+      それらは「ログのみ」として差分に現れる
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.aggregation import WINDOW_MS, AggregationEngine
+from app.database import adapt_query, open_db
+from app.effect_coalescer import EffectCoalescer, LOGGED_PHASES
+from app.partial_aggregate import AUDIO_EVENTS
+from app.reaction_store import EVENT_TYPES, STATE_TYPES
+
+# reactions_logの列と集約エンジンのキーの対応（リアクションの登録簿から）
+STATE_COLUMNS = [(t['column'], t['name']) for t in STATE_TYPES]
+EVENT_COLUMNS = [(t['column'], t['name']) for t in EVENT_TYPES]
+
+TICK_MS = 1000  # run_aggregation_loop() の実行間隔
+
+
+class ReplayClock:
+    """手動で進める仮想時計（AggregationEngineに注入する）"""
+    def __init__(self, now_ms: float = 0.0):
+        self.now_ms = now_ms
+
+    def __call__(self) -> float:
+        return self.now_ms / 1000
+
+    def set_ms(self, now_ms: float):
+        self.now_ms = now_ms
+
+
+def row_to_sample(row: tuple) -> Tuple[str, dict]:
+    """reactions_logの1行を (user_id, update_user_dataに渡すデータ) に変換"""
+    user_id, timestamp = row[0], row[1]
+    state_end = 2 + len(STATE_COLUMNS)
+    states = {key: bool(value) for (_, key), value in zip(STATE_COLUMNS, row[2:state_end])}
+    events = {key: value or 0 for (_, key), value in zip(EVENT_COLUMNS, row[state_end:])}
+    return user_id, {'timestamp': timestamp, 'states': states, 'events': events}
+
+
+def users_have_host_column(cursor, db_type: str) -> bool:
+    """usersテーブルにis_hostカラムがあるか（追加前のDBでは --hosts でホストを指定する）"""
+    if db_type == "postgresql":
+        cursor.execute("SELECT 1 FROM information_schema.columns WHERE table_name = 'users' AND column_name = 'is_host'")
+        return cursor.fetchone() is not None
+    cursor.execute("PRAGMA table_info(users)")
+    return any(row[1] == 'is_host' for row in cursor.fetchall())
+
+
+def iter_reaction_rows(conn, db_type: str, since_ms: Optional[int] = None, until_ms: Optional[int] = None,
+                       session_id: Optional[str] = None, chunk_size: int = 5000,
+                       exclude_users: Sequence[str] = (), include_hosts: bool = False) -> Iterator[tuple]:
+    """
+    reactions_logをタイムスタンプ順にチャンク単位でストリーミング取得
+    本番と同じくホスト（users.is_host）のリアクションは除外する（include_hosts=True で含める）
+    exclude_users: 追加で除外するユーザー（is_host の記録がないDBのホストなど）
+    """
+    cursor = conn.cursor()
+    # 従来形式のテーブルにないリアクションの列はNULLとして読む
+    cursor.execute("SELECT * FROM reactions_log LIMIT 0")
+    existing = {description[0] for description in cursor.description}
+    columns = ", ".join(['user_id', 'timestamp'] + [
+        column if column in existing else f"NULL AS {column}"
+        for column, _ in STATE_COLUMNS + EVENT_COLUMNS
+    ])
+    query = f"SELECT {columns} FROM reactions_log WHERE 1=1"
+    params = []
+    if since_ms is not None:
+        query += " AND timestamp >= %s"
+        params.append(since_ms)
+    if until_ms is not None:
+        query += " AND timestamp < %s"
+        params.append(until_ms)
+    if session_id:
+        query += " AND session_id = %s"
+        params.append(session_id)
+    if not include_hosts and users_have_host_column(cursor, db_type):
+        query += " AND user_id NOT IN (SELECT id FROM users WHERE is_host = %s)"
+        params.append(True)
+    if exclude_users:
+        query += f" AND user_id NOT IN ({', '.join(['%s'] * len(exclude_users))})"
+        params.extend(exclude_users)
+    query += " ORDER BY timestamp, id"
+
+    cursor.execute(adapt_query(query, db_type), tuple(params))
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+
+def load_logged_effects(conn, db_type: str, since_ms: Optional[int] = None,
+                        until_ms: Optional[int] = None) -> List[dict]:
+    """比較対象のeffects_logを取得"""
+    query = "SELECT timestamp, effect_type, intensity FROM effects_log WHERE 1=1"
+    params = []
+    if since_ms is not None:
+        query += " AND timestamp >= %s"
+        params.append(since_ms)
+    if until_ms is not None:
+        query += " AND timestamp < %s"
+        params.append(until_ms)
+    query += " ORDER BY timestamp, id"
+
+    cursor = conn.cursor()
+    cursor.execute(adapt_query(query, db_type), tuple(params))
+    return [
+        {"timestamp": row[0], "effectType": row[1], "intensity": row[2]}
+        for row in cursor.fetchall()
+    ]
+
+
+def iter_ticks(rows: Iterable[tuple], engine: AggregationEngine, clock: ReplayClock,
+               tick_ms: int = TICK_MS, tick_offset_ms: int = 0,
+               microphone: str = 'inferred',
+               on_ingest: Optional[Callable[[float], None]] = None) -> Iterator[float]:
+    """
+    サンプルを仮想時刻順にエンジンへ投入し、集約ティックの時刻をyieldする
+
+    yieldされた時点でエンジンはそのティック時刻の状態になっているため、
+    呼び出し側で aggregate() などを実行できる
+
+    Args:
+        microphone: 'inferred'（音声イベントを送ったユーザーをマイクありとみなす）/ 'all' / 'none'
+        on_ingest: サンプルを投入するたびに（サンプルの時刻で）呼ぶ関数（受信時の即時判定の再現用）
+    """
+    next_tick = None
+    last_sample_ms = None
+
+    for row in rows:
+        user_id, data = row_to_sample(row)
+        sample_ms = data['timestamp']
+
+        if next_tick is None:
+            # 本番の集約ループは最初の接続から1秒後に初回ティックを迎える
+            next_tick = sample_ms + tick_ms + tick_offset_ms
+        elif last_sample_ms is not None and sample_ms - last_sample_ms > WINDOW_MS + tick_ms:
+            # データの空白期間はティックを飛ばす（窓が空になるまで進めてから位相を保ったまま早送り）
+            while next_tick <= last_sample_ms + WINDOW_MS + tick_ms:
+                clock.set_ms(next_tick)
+                yield next_tick
+                next_tick += tick_ms
+            if sample_ms > next_tick:
+                next_tick += ((sample_ms - next_tick) // tick_ms) * tick_ms
+
+        while next_tick <= sample_ms:
+            clock.set_ms(next_tick)
+            yield next_tick
+            next_tick += tick_ms
+
+        clock.set_ms(sample_ms)
+        if microphone == 'all':
+            data['hasMicrophone'] = True
+        elif microphone == 'inferred' and any(data['events'].get(name, 0) > 0 for name in AUDIO_EVENTS):
+            data['hasMicrophone'] = True
+        engine.update_user_data(user_id, data)
+        if on_ingest is not None:
+            on_ingest(sample_ms)
+        last_sample_ms = sample_ms
+
+    # 最後のサンプルが窓から外れるまでティックを続ける
+    if next_tick is not None:
+        while next_tick <= last_sample_ms + WINDOW_MS:
+            clock.set_ms(next_tick)
+            yield next_tick
+            next_tick += tick_ms
+
+
+def replay_effects(rows: Iterable[tuple], tick_ms: int = TICK_MS, tick_offset_ms: int = 0,
+                   microphone: str = 'inferred', coalesce: bool = True, early: bool = True) -> List[dict]:
+    """
+    reactions_logの行列を再生し、発動したエフェクト指示のリストを返す
+
+    early=Trueの場合は本番と同じくサンプルを投入するたびに即時判定を行う
+    coalesce=Trueの場合は本番と同じくEffectCoalescerを通し、effects_logに記録されるもの
+    （start / switch / update）だけを返す（Falseの場合は判定されたエフェクトをすべて返す）
+    """
+    clock = ReplayClock()
+    # リプレイは決定的にしたいので過負荷時のサンプリングは行わない
+    engine = AggregationEngine(clock=clock, verbose=False, load_shedding=False, early_triggering=early)
+    coalescer = EffectCoalescer(tick_ms) if coalesce else None
+    effects = []
+
+    def publish(effect: Optional[dict]):
+        if effect and coalescer:
+            message = coalescer.coalesce('experiment', effect)
+            effect = message if message and message['phase'] in LOGGED_PHASES else None
+        if effect:
+            effects.append(effect)
+
+    on_ingest = (lambda _: publish(engine.early_effect())) if early else None
+    for _ in iter_ticks(rows, engine, clock, tick_ms, tick_offset_ms, microphone, on_ingest):
+        publish(engine.aggregate())
+    return effects
+
+
+def diff_effects(replayed: List[dict], logged: List[dict], tolerance_ms: int = TICK_MS,
+                 max_examples: int = 20) -> dict:
+    """
+    再生結果とeffects_logをタイムスタンプの近さで突き合わせる
+
+    両方ともタイムスタンプ順である前提。許容誤差内の未対応ログのうち
+    同じeffectTypeのものを優先して対応付ける
+    """
+    matched = 0
+    type_mismatch = 0
+    extra = []
+    logged_used = [False] * len(logged)
+    examples = []
+    start = 0
+
+    for effect in replayed:
+        ts = effect['timestamp']
+        while start < len(logged) and logged[start]['timestamp'] < ts - tolerance_ms:
+            start += 1
+
+        candidate = None
+        same_type = None
+        i = start
+        while i < len(logged) and logged[i]['timestamp'] <= ts + tolerance_ms:
+            if not logged_used[i]:
+                if candidate is None:
+                    candidate = i
+                if logged[i]['effectType'] == effect['effectType']:
+                    same_type = i
+                    break
+            i += 1
+
+        if same_type is not None:
+            logged_used[same_type] = True
+            matched += 1
+        elif candidate is not None:
+            logged_used[candidate] = True
+            type_mismatch += 1
+            if len(examples) < max_examples:
+                examples.append({
+                    "kind": "type_mismatch",
+                    "timestamp": ts,
+                    "replayed": effect['effectType'],
+                    "logged": logged[candidate]['effectType']
+                })
+        else:
+            extra.append(effect)
+            if len(examples) < max_examples:
+                examples.append({"kind": "replay_only", "timestamp": ts, "replayed": effect['effectType']})
+
+    missing = [logged[i] for i, used in enumerate(logged_used) if not used]
+    for effect in missing:
+        if len(examples) >= max_examples:
+            break
+        examples.append({"kind": "log_only", "timestamp": effect['timestamp'], "logged": effect['effectType']})
+
+    total = max(len(replayed), len(logged))
+    return {
+        "replayed": len(replayed),
+        "logged": len(logged),
+        "matched": matched,
+        "type_mismatch": type_mismatch,
+        "replay_only": len(extra),
+        "log_only": len(missing),
+        "match_rate": matched / total if total else 1.0,
+        "examples": sorted(examples, key=lambda e: e['timestamp'])
+    }
+
+
+def parse_time_arg(value: Optional[str]) -> Optional[int]:
+    """ミリ秒のUNIX時刻、またはYYYY-MM-DD / ISO形式の日時をミリ秒に変換"""
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def parse_user_list(value: Optional[str]) -> List[str]:
+    """カンマ区切りのuser_idのリスト"""
+    return [user_id.strip() for user_id in (value or "").split(",") if user_id.strip()]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="reactions_logをAggregationEngineでオフライン再生する")
+    parser.add_argument("--sqlite", help="再生するSQLiteファイル（省略時はDATABASE_URL/既定のDB）")
+    parser.add_argument("--since", help="開始時刻（ms または YYYY-MM-DD[THH:MM:SS]）")
+    parser.add_argument("--until", help="終了時刻（ms または YYYY-MM-DD[THH:MM:SS]）")
+    parser.add_argument("--session", help="特定のsession_idのみ再生")
+    parser.add_argument("--hosts", help="除外するホストのuser_id（カンマ区切り。users.is_host の記録がないDB用）")
+    parser.add_argument("--include-hosts", action="store_true", help="ホストのリアクションも集約する（本番とは異なる）")
+    parser.add_argument("--tick-ms", type=int, default=TICK_MS, help="集約ティック間隔（ms）")
+    parser.add_argument("--tick-offset-ms", type=int, default=0, help="ティックの位相（ms）")
+    parser.add_argument("--microphone", choices=['inferred', 'all', 'none'], default='inferred',
+                        help="マイクありユーザーの推定方法")
+    parser.add_argument("--no-coalesce", action="store_true",
+                        help="エフェクトの合流（変化時のみ送信）を行わず、判定されたエフェクトをすべて比較する")
+    parser.add_argument("--no-early", action="store_true", help="受信時の即時判定を再現しない")
+    parser.add_argument("--tolerance-ms", type=int, default=TICK_MS, help="effects_logとの突き合わせ許容誤差（ms）")
+    parser.add_argument("--output", help="再生したエフェクト列をJSON Linesで書き出すパス")
+    parser.add_argument("--no-diff", action="store_true", help="effects_logとの比較を行わない")
+    args = parser.parse_args(argv)
+
+    since_ms = parse_time_arg(args.since)
+    until_ms = parse_time_arg(args.until)
+
+    print("=" * 60)
+    print("⏩ Live Reaction System - オフラインリプレイ")
+    print("=" * 60)
+
+    started = time.perf_counter()
+    row_count = 0
+    first_ms = None
+    last_ms = None
+
+    with open_db(args.sqlite) as (conn, db_type):
+        def counted_rows():
+            nonlocal row_count, first_ms, last_ms
+            for row in iter_reaction_rows(conn, db_type, since_ms, until_ms, args.session,
+                                          exclude_users=parse_user_list(args.hosts),
+                                          include_hosts=args.include_hosts):
+                row_count += 1
+                if first_ms is None:
+                    first_ms = row[1]
+                last_ms = row[1]
+                yield row
+
+        replayed = replay_effects(counted_rows(), args.tick_ms, args.tick_offset_ms, args.microphone,
+                                  coalesce=not args.no_coalesce, early=not args.no_early)
+        elapsed = time.perf_counter() - started
+
+        logged = None
+        if not args.no_diff:
+            # 比較範囲は再生したデータの範囲に合わせる
+            logged_since = since_ms if since_ms is not None else first_ms
+            logged_until = until_ms if until_ms is not None else (last_ms + WINDOW_MS + 1 if last_ms else None)
+            logged = load_logged_effects(conn, db_type, logged_since, logged_until) if row_count else []
+
+    span_s = (last_ms - first_ms) / 1000 if row_count else 0.0
+    print(f"📝 再生サンプル数: {row_count:,}")
+    print(f"✨ 再生エフェクト数: {len(replayed):,}")
+    print(f"⏱️ 処理時間: {elapsed:.2f}s（データ期間 {span_s:,.0f}s, {span_s / elapsed if elapsed > 0 else 0:,.0f}倍速）")
+
+    distribution: Dict[str, int] = {}
+    for effect in replayed:
+        distribution[effect['effectType']] = distribution.get(effect['effectType'], 0) + 1
+    for effect_type, count in sorted(distribution.items(), key=lambda item: -item[1]):
+        print(f"  {effect_type:15s}: {count:,}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            for effect in replayed:
+                f.write(json.dumps(effect, ensure_ascii=False) + "\n")
+        print(f"💾 エフェクト列を書き出しました: {args.output}")
+
+    if logged is not None:
+        diff = diff_effects(replayed, logged, args.tolerance_ms)
+        print("-" * 60)
+        print("🔍 effects_logとの比較")
+        print(f"  一致          : {diff['matched']:,}")
+        print(f"  種類の不一致  : {diff['type_mismatch']:,}")
+        print(f"  再生のみ      : {diff['replay_only']:,}")
+        print(f"  ログのみ      : {diff['log_only']:,}")
+        print(f"  一致率        : {diff['match_rate'] * 100:.1f}%")
+        for example in diff['examples']:
+            print(f"    {example}")
+
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+"""
+データベース分析レポート
+集計はすべてSQL（GROUP BY / 時間窓ごとの集計）で行い、結果だけをチャンク単位で受け取って出力する
+SQLite / PostgreSQL の両方に対応
+
+使い方:
+    python -m app.report                                  # 全セクションを表で表示
+    python -m app.report --sqlite data/live_reaction.db --format json > report.jsonl
+    python -m app.report --section reaction_rates --bucket-seconds 60 --format csv > rates.csv
+    python -m app.report --format csv --output report/    # セクションごとのCSVファイル
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.database import adapt_query, open_db
+from app.replay import parse_time_arg
+
+FETCH_SIZE = 1000
+
+# (カラム, 表示名) の組み合わせは SQL 側で別名を付ける
+STATE_RATE_COLUMNS = (
+    ("is_smiling", "smiling_rate"),
+    ("is_surprised", "surprised_rate"),
+    ("is_concentrating", "concentrating_rate"),
+    ("is_hand_up", "hand_up_rate"),
+)
+EVENT_TOTAL_COLUMNS = (
+    ("nod_count", "nod_total"),
+    ("sway_vertical_count", "sway_vertical_total"),
+    ("cheer_count", "cheer_total"),
+    ("clap_count", "clap_total"),
+)
+
+# ロールアップ（session_rollups）のstateの回数のカラム
+ROLLUP_STATE_COLUMNS = (
+    ("is_smiling", "smiling_count"),
+    ("is_surprised", "surprised_count"),
+    ("is_concentrating", "concentrating_count"),
+    ("is_hand_up", "hand_up_count"),
+)
+
+
+class ReportFilter:
+    """期間の絞り込み（timestampカラムに適用）"""
+    def __init__(self, since_ms: Optional[int] = None, until_ms: Optional[int] = None):
+        self.since_ms = since_ms
+        self.until_ms = until_ms
+
+    def conditions(self, column: str = "timestamp") -> Tuple[List[str], list]:
+        clauses = []
+        params = []
+        if self.since_ms is not None:
+            clauses.append(f"{column} >= %s")
+            params.append(self.since_ms)
+        if self.until_ms is not None:
+            clauses.append(f"{column} < %s")
+            params.append(self.until_ms)
+        return clauses, params
+
+    def where(self, column: str = "timestamp") -> Tuple[str, list]:
+        clauses, params = self.conditions(column)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def _state_rates(prefix: str = "") -> str:
+    return ",\n".join(f"AVG(CASE WHEN {prefix}{column} THEN 1.0 ELSE 0.0 END) AS {alias}"
+                      for column, alias in STATE_RATE_COLUMNS)
+
+
+def _state_counts(prefix: str = "") -> str:
+    """stateがtrueだったサンプル数（カラム名のまま別名を付ける）"""
+    return ",\n".join(f"SUM(CASE WHEN {prefix}{column} THEN 1 ELSE 0 END) AS {column}"
+                       for column, _ in STATE_RATE_COLUMNS)
+
+
+def _event_totals(prefix: str = "") -> str:
+    return ",\n".join(f"COALESCE(SUM({prefix}{column}), 0) AS {alias}" for column, alias in EVENT_TOTAL_COLUMNS)
+
+
+# ========================
+# セクション（SQLとパラメータを返す）
+# ========================
+
+COUNTED_TABLES = ('users', 'sessions', 'reactions_log', 'effects_log', 'session_rollups')
+
+
+def table_counts(filters: ReportFilter, options: dict):
+    tables = [table for table in COUNTED_TABLES if table in options["tables"]]
+    return "\nUNION ALL ".join(f"SELECT '{table}' AS table_name, COUNT(*) AS row_count FROM {table}"
+                              for table in tables), []
+
+
+def users_by_group(filters: ReportFilter, options: dict):
+    return """
+        SELECT experiment_group, COUNT(*) AS users, MIN(created_at) AS first_created_at,
+               MAX(created_at) AS last_created_at
+        FROM users GROUP BY experiment_group ORDER BY experiment_group
+    """, []
+
+
+def reactions_by_group(filters: ReportFilter, options: dict):
+    """実験群ごとのstate率・イベント合計（アーカイブ済みのセッションはロールアップの値を合算する）"""
+    where, params = filters.where("r.timestamp")
+    live = f"""
+            SELECT u.experiment_group, r.user_id, COUNT(*) AS samples,
+                   {_state_counts("r.")},
+                   {_event_totals("r.")}
+            FROM reactions_log r JOIN users u ON u.id = r.user_id
+            {where}
+            GROUP BY u.experiment_group, r.user_id"""
+    if "session_rollups" in options["tables"]:
+        # ロールアップにはサンプルごとの時刻がないため、期間内に開始・完了したセッションだけを合算する
+        started, started_params = filters.conditions("a.started_at")
+        completed, completed_params = filters.conditions("a.completed_at")
+        archived_where = " AND ".join(started + completed)
+        live += f"""
+            UNION ALL
+            SELECT u.experiment_group, a.user_id, a.reaction_count AS samples,
+                   {", ".join(f"a.{rollup} AS {column}" for column, rollup in ROLLUP_STATE_COLUMNS)},
+                   {", ".join(f"a.{alias} AS {alias}" for _, alias in EVENT_TOTAL_COLUMNS)}
+            FROM session_rollups a JOIN users u ON u.id = a.user_id
+            {"WHERE " + archived_where if archived_where else ""}"""
+        params = params + started_params + completed_params
+    state_rates = ",\n".join(f"SUM({column}) * 1.0 / NULLIF(SUM(samples), 0) AS {alias}"
+                             for column, alias in STATE_RATE_COLUMNS)
+    event_totals = ",\n".join(f"COALESCE(SUM({alias}), 0) AS {alias}" for _, alias in EVENT_TOTAL_COLUMNS)
+    return f"""
+        SELECT experiment_group, SUM(samples) AS samples, COUNT(DISTINCT user_id) AS users,
+               {state_rates},
+               {event_totals}
+        FROM ({live}
+        ) g
+        GROUP BY experiment_group ORDER BY experiment_group
+    """, params
+
+
+def sessions_summary(filters: ReportFilter, options: dict):
+    reaction_where, reaction_params = filters.where()
+    effect_where, effect_params = filters.where()
+    if "session_rollups" in options["tables"]:
+        # アーカイブ済みのセッションはロールアップの値を使う
+        archived_columns = """COALESCE(r.samples, a.reaction_count, 0) AS samples,
+               COALESCE(r.smiling_rate, a.smiling_count * 1.0 / NULLIF(a.reaction_count, 0)) AS smiling_rate,
+               COALESCE(r.nod_total, a.nod_total) AS nod_total,
+               COALESCE(e.effects, a.effect_count, 0) AS effects,
+               a.session_id IS NOT NULL AS archived"""
+        archived_join = "LEFT JOIN session_rollups a ON a.session_id = s.session_id"
+    else:
+        archived_columns = """COALESCE(r.samples, 0) AS samples,
+               r.smiling_rate, r.nod_total,
+               COALESCE(e.effects, 0) AS effects"""
+        archived_join = ""
+    return f"""
+        SELECT s.session_id, s.experiment_group, s.video_id, s.is_completed,
+               s.completed_at - s.started_at AS duration_ms,
+               {archived_columns}
+        FROM sessions s
+        LEFT JOIN (
+            SELECT session_id, COUNT(*) AS samples,
+                   AVG(CASE WHEN is_smiling THEN 1.0 ELSE 0.0 END) AS smiling_rate,
+                   COALESCE(SUM(nod_count), 0) AS nod_total
+            FROM reactions_log {reaction_where} GROUP BY session_id
+        ) r ON r.session_id = s.session_id
+        LEFT JOIN (
+            SELECT session_id, COUNT(*) AS effects FROM effects_log {effect_where} GROUP BY session_id
+        ) e ON e.session_id = s.session_id
+        {archived_join}
+        ORDER BY s.started_at
+    """, reaction_params + effect_params
+
+
+def sessions_by_group(filters: ReportFilter, options: dict):
+    """実験群ごとのセッション数・完了率・所要時間（開始時刻で絞り込み）"""
+    where, params = filters.where("started_at")
+    return f"""
+        SELECT experiment_group, COUNT(*) AS sessions,
+               SUM(CASE WHEN is_completed THEN 1 ELSE 0 END) AS completed,
+               AVG(CASE WHEN is_completed THEN 1.0 ELSE 0.0 END) AS completion_rate,
+               AVG(completed_at - started_at) AS avg_duration_ms,
+               MIN(completed_at - started_at) AS min_duration_ms,
+               MAX(completed_at - started_at) AS max_duration_ms
+        FROM sessions {where}
+        GROUP BY experiment_group ORDER BY experiment_group
+    """, params
+
+
+def effects_by_type(filters: ReportFilter, options: dict):
+    where, params = filters.where()
+    return f"""
+        SELECT effect_type, COUNT(*) AS count, AVG(intensity) AS avg_intensity,
+               MIN(intensity) AS min_intensity, MAX(intensity) AS max_intensity,
+               AVG(duration_ms) AS avg_duration_ms
+        FROM effects_log {where}
+        GROUP BY effect_type ORDER BY count DESC
+    """, params
+
+
+def effects_by_group(filters: ReportFilter, options: dict):
+    where, params = filters.where("e.timestamp")
+    return f"""
+        SELECT s.experiment_group, e.effect_type, COUNT(*) AS count, AVG(e.intensity) AS avg_intensity
+        FROM effects_log e JOIN sessions s ON s.session_id = e.session_id
+        {where}
+        GROUP BY s.experiment_group, e.effect_type ORDER BY s.experiment_group, count DESC
+    """, params
+
+
+def reaction_rates(filters: ReportFilter, options: dict):
+    """時間窓ごとのリアクション率（イベントはユーザー1人あたり毎秒）"""
+    bucket_ms = int(options["bucket_seconds"] * 1000)
+    seconds = options["bucket_seconds"]
+    where, params = filters.where()
+    event_rates = ",\n".join(
+        f"COALESCE(SUM({column}), 0) * 1.0 / COUNT(DISTINCT user_id) / {seconds} AS {alias.replace('_total', '_per_user_sec')}"
+        for column, alias in EVENT_TOTAL_COLUMNS)
+    return f"""
+        SELECT (timestamp / {bucket_ms}) * {bucket_ms} AS bucket_start, COUNT(*) AS samples,
+               COUNT(DISTINCT user_id) AS users,
+               {_state_rates()},
+               {event_rates}
+        FROM reactions_log {where}
+        GROUP BY timestamp / {bucket_ms} ORDER BY bucket_start
+    """, params
+
+
+def effect_rates(filters: ReportFilter, options: dict):
+    """時間窓ごとのエフェクト発動回数"""
+    bucket_ms = int(options["bucket_seconds"] * 1000)
+    where, params = filters.where()
+    return f"""
+        SELECT (timestamp / {bucket_ms}) * {bucket_ms} AS bucket_start, effect_type, COUNT(*) AS count,
+               AVG(intensity) AS avg_intensity
+        FROM effects_log {where}
+        GROUP BY timestamp / {bucket_ms}, effect_type ORDER BY bucket_start, count DESC
+    """, params
+
+
+# name -> (タイトル, クエリ関数, 必要なカラム {テーブル: (カラム, ...)})
+SECTIONS: Dict[str, Tuple[str, Callable, Dict[str, Tuple[str, ...]]]] = {
+    "table_counts": ("📈 テーブルごとのレコード数", table_counts, {}),
+    "users_by_group": ("👥 実験群ごとのユーザー数", users_by_group, {}),
+    "reactions_by_group": ("📝 実験群ごとのリアクション統計", reactions_by_group, {}),
+    "sessions": ("🎬 セッションごとの統計", sessions_summary,
+                 {"sessions": ("session_id",), "reactions_log": ("session_id",), "effects_log": ("session_id",)}),
+    "sessions_by_group": ("🎬 実験群ごとのセッション完了率・所要時間", sessions_by_group,
+                          {"sessions": ("experiment_group", "completed_at")}),
+    "effects_by_type": ("✨ エフェクトタイプ別の統計", effects_by_type, {}),
+    "effects_by_group": ("✨ 実験群・エフェクトタイプ別の統計", effects_by_group,
+                         {"sessions": ("session_id",), "effects_log": ("session_id",)}),
+    "reaction_rates": ("⏱️ 時間窓ごとのリアクション率", reaction_rates, {}),
+    "effect_rates": ("⏱️ 時間窓ごとのエフェクト発動回数", effect_rates, {}),
+}
+
+
+def existing_tables(cursor, db_type: str) -> List[str]:
+    if db_type == "postgresql":
+        cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()")
+    else:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def table_columns(cursor, db_type: str, table: str) -> List[str]:
+    if db_type == "postgresql":
+        cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+        return [row[0] for row in cursor.fetchall()]
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def missing_requirements(cursor, db_type: str, requirements: Dict[str, Tuple[str, ...]]) -> List[str]:
+    """セクションに必要なテーブル・カラムのうち、DBにないもの（古いスキーマ）"""
+    missing = []
+    for table, columns in requirements.items():
+        existing = table_columns(cursor, db_type, table)
+        missing.extend(f"{table}.{column}" for column in columns if column not in existing)
+    return missing
+
+
+def run_section(conn, db_type: str, name: str, filters: ReportFilter,
+                options: dict) -> Tuple[List[str], Iterator[tuple]]:
+    """セクションのクエリを実行し、(カラム名, 行のイテレータ) を返す"""
+    _, build_query, _ = SECTIONS[name]
+    query, params = build_query(filters, options)
+    cursor = conn.cursor()
+    cursor.execute(adapt_query(query, db_type), tuple(params))
+    columns = [description[0] for description in cursor.description]
+
+    def rows():
+        while True:
+            chunk = cursor.fetchmany(FETCH_SIZE)
+            if not chunk:
+                break
+            yield from chunk
+
+    return columns, rows()
+
+
+def json_value(value):
+    # PostgreSQLのAVGはDecimalを返す
+    if value is not None and not isinstance(value, (int, float, str, bool)):
+        return float(value)
+    return value
+
+
+def _text_value(value) -> str:
+    if value is None:
+        return "-"
+    value = json_value(value)
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+class TextWriter:
+    """列幅を固定して表形式で表示（結果を溜めずに出力する）"""
+    def __init__(self, stream):
+        self.stream = stream
+
+    def section(self, name: str, title: str, columns: Sequence[str], rows: Iterator[tuple]) -> int:
+        widths = [max(12, len(column)) for column in columns]
+        self.stream.write("\n" + "=" * 60 + f"\n{title} ({name})\n" + "=" * 60 + "\n")
+        self.stream.write("  ".join(column.ljust(width) for column, width in zip(columns, widths)) + "\n")
+        count = 0
+        for row in rows:
+            self.stream.write("  ".join(_text_value(value).ljust(width) for value, width in zip(row, widths)) + "\n")
+            count += 1
+        if count == 0:
+            self.stream.write("  （データなし）\n")
+        return count
+
+    def skipped(self, name: str, title: str, missing: List[str]):
+        self.stream.write(f"\n⏭️ {title} ({name}): スキップ（{', '.join(missing)} がありません）\n")
+
+
+class JsonLinesWriter:
+    """1行1レコードのJSON（各レコードに section を付ける）"""
+    def __init__(self, stream):
+        self.stream = stream
+
+    def section(self, name: str, title: str, columns: Sequence[str], rows: Iterator[tuple]) -> int:
+        count = 0
+        for row in rows:
+            record = {"section": name}
+            record.update((column, json_value(value)) for column, value in zip(columns, row))
+            self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+        return count
+
+    def skipped(self, name: str, title: str, missing: List[str]):
+        print(f"⏭️ {name}: スキップ（{', '.join(missing)} がありません）", file=sys.stderr)
+
+
+class CsvWriter:
+    """CSV（output_dir を指定した場合はセクションごとのファイル）"""
+    def __init__(self, stream, output_dir: Optional[Path] = None):
+        self.stream = stream
+        self.output_dir = output_dir
+
+    def section(self, name: str, title: str, columns: Sequence[str], rows: Iterator[tuple]) -> int:
+        if self.output_dir is None:
+            return self._write(self.stream, columns, rows)
+        with open(self.output_dir / f"{name}.csv", "w", newline="", encoding="utf-8") as f:
+            return self._write(f, columns, rows)
+
+    @staticmethod
+    def _write(stream, columns: Sequence[str], rows: Iterator[tuple]) -> int:
+        writer = csv.writer(stream)
+        writer.writerow(columns)
+        count = 0
+        for row in rows:
+            writer.writerow([json_value(value) for value in row])
+            count += 1
+        return count
+
+    def skipped(self, name: str, title: str, missing: List[str]):
+        print(f"⏭️ {name}: スキップ（{', '.join(missing)} がありません）", file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="データベースの分析レポート（集計はSQLで実行）")
+    parser.add_argument("--sqlite", help="対象のSQLiteファイル（省略時はDATABASE_URL/既定のDB）")
+    parser.add_argument("--section", action="append", choices=list(SECTIONS),
+                        help="出力するセクション（複数指定可、省略時は全セクション）")
+    parser.add_argument("--format", choices=["text", "json", "csv"], default="text", help="出力形式")
+    parser.add_argument("--output", help="出力先（csvでは複数セクションの場合ディレクトリ）")
+    parser.add_argument("--since", help="開始時刻（ms または YYYY-MM-DD[THH:MM:SS]）")
+    parser.add_argument("--until", help="終了時刻（ms または YYYY-MM-DD[THH:MM:SS]）")
+    parser.add_argument("--bucket-seconds", type=float, default=60, help="時間窓ごとの集計の窓幅（秒）")
+    args = parser.parse_args(argv)
+
+    sections = args.section or list(SECTIONS)
+    filters = ReportFilter(parse_time_arg(args.since), parse_time_arg(args.until))
+    options = {"bucket_seconds": args.bucket_seconds}
+
+    output_file = None
+    stream = sys.stdout
+    if args.format == "csv" and len(sections) > 1:
+        if not args.output:
+            parser.error("複数セクションをCSVで出力する場合は --output にディレクトリを指定してください")
+        output_dir = Path(args.output)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        writer = CsvWriter(stream, output_dir)
+    else:
+        if args.output:
+            output_file = open(args.output, "w", newline="", encoding="utf-8")
+            stream = output_file
+        if args.format == "csv":
+            writer = CsvWriter(stream)
+        elif args.format == "json":
+            writer = JsonLinesWriter(stream)
+        else:
+            writer = TextWriter(stream)
+
+    started = time.perf_counter()
+    try:
+        with open_db(args.sqlite) as (conn, db_type):
+            cursor = conn.cursor()
+            options["tables"] = set(existing_tables(cursor, db_type))
+            for name in sections:
+                title, _, requirements = SECTIONS[name]
+                missing = missing_requirements(cursor, db_type, requirements)
+                if missing:
+                    writer.skipped(name, title, missing)
+                    continue
+                columns, rows = run_section(conn, db_type, name, filters, options)
+                writer.section(name, title, columns, rows)
+
+        if args.format == "text":
+            stream.write("\n" + "=" * 60 + f"\n✅ 完了 ({time.perf_counter() - started:.2f}s, "
+                         f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')})\n" + "=" * 60 + "\n")
+    finally:
+        if output_file:
+            output_file.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,367 @@
+"""
+生ログの保持期間管理（アーカイブ・削除・コンパクション）
+完了から RETENTION_DAYS 日以上経過したセッションの reactions_log / effects_log を
+gzip圧縮したアーカイブファイルに移し、集計値（ロールアップ）を session_rollups に残して
+ホットテーブルから削除する
+
+- アーカイブは /admin/export/session/{session_id} と同じ形式（session / reactions / effects）のJSON
+  エクスポートAPIはホットテーブルに行がないアーカイブ済みセッションをアーカイブから返す
+- アーカイブを書き込んで読み戻し、行数を確認してから削除する
+- 削除は RETENTION_BATCH_SIZE 行ずつコミットし、長いロックを避ける
+- 削除後は ANALYZE で統計を更新し、削除行数が RETENTION_VACUUM_ROWS を超えたら VACUUM する
+- sessions の行は残す（完了セッション一覧はそのまま使える）
+
+使い方:
+    python -m app.retention --days 30 --dry-run
+    python -m app.retention --sqlite data/live_reaction.db --days 30
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.database import adapt_query, open_db
+from app.reaction_store import ensure_packed_schema, legacy_table_exists
+
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "30"))  # 完了からこの日数を過ぎたセッションをアーカイブ
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "0"))  # サーバー内で定期実行する間隔（秒、0で無効）
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))  # 1回の削除でコミットする行数
+RETENTION_VACUUM_ROWS = int(os.getenv("RETENTION_VACUUM_ROWS", "100000"))  # この行数以上削除したらVACUUM
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", str(Path(__file__).parent.parent / "data" / "archive")))
+
+REACTION_COLUMNS = ('timestamp', 'video_time', 'is_smiling', 'is_surprised', 'is_concentrating',
+                    'is_hand_up', 'nod_count', 'sway_vertical_count', 'cheer_count', 'clap_count',
+                    'shake_head_count', 'sway_horizontal_count')
+REACTION_BOOL_COLUMNS = ('is_smiling', 'is_surprised', 'is_concentrating', 'is_hand_up')
+EFFECT_COLUMNS = ('timestamp', 'video_time', 'effect_type', 'intensity', 'duration_ms')
+# ビュー名 → (格納先のテーブル, セッションで絞り込む条件)
+SESSION_ROW_FILTERS = {
+    "reactions_log": ("reaction_samples", "session_key = (SELECT id FROM session_keys WHERE session_id = %s)"),
+}
+SESSION_COLUMNS = ('session_id', 'user_id', 'video_id', 'experiment_group',
+                   'started_at', 'completed_at', 'is_completed')
+
+# ロールアップ（アーカイブ後も集計に使えるセッション単位の値）
+ROLLUP_COLUMNS = (
+    'session_id', 'user_id', 'video_id', 'experiment_group', 'started_at', 'completed_at',
+    'reaction_count', 'smiling_count', 'surprised_count', 'concentrating_count', 'hand_up_count',
+    'nod_total', 'sway_vertical_total', 'cheer_total', 'clap_total', 'shake_head_total', 'sway_horizontal_total',
+    'effect_count', 'archive_path', 'archived_at'
+)
+# 後から追加したロールアップのカラム（追加前にアーカイブしたセッションはNULL。値はアーカイブファイルに残っている）
+ADDED_ROLLUP_COLUMNS = ('shake_head_total', 'sway_horizontal_total')
+
+
+def ensure_retention_schema(conn, db_type: str):
+    """session_rollupsテーブルと、セッション単位の削除に使うインデックスを作成（なければ）"""
+    bigint = "BIGINT" if db_type == "postgresql" else "INTEGER"
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS session_rollups (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            video_id TEXT,
+            experiment_group TEXT,
+            started_at {bigint},
+            completed_at {bigint},
+            reaction_count INTEGER NOT NULL,
+            smiling_count INTEGER NOT NULL,
+            surprised_count INTEGER NOT NULL,
+            concentrating_count INTEGER NOT NULL,
+            hand_up_count INTEGER NOT NULL,
+            nod_total INTEGER NOT NULL,
+            sway_vertical_total INTEGER NOT NULL,
+            cheer_total INTEGER NOT NULL,
+            clap_total INTEGER NOT NULL,
+            shake_head_total INTEGER,
+            sway_horizontal_total INTEGER,
+            effect_count INTEGER NOT NULL,
+            archive_path TEXT NOT NULL,
+            archived_at {bigint} NOT NULL
+        )
+    """)
+    if db_type == "postgresql":
+        cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'session_rollups'")
+        existing = {row[0] for row in cursor.fetchall()}
+    else:
+        cursor.execute("PRAGMA table_info(session_rollups)")
+        existing = {row[1] for row in cursor.fetchall()}
+    for column in ADDED_ROLLUP_COLUMNS:
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE session_rollups ADD COLUMN {column} INTEGER")
+    # reactions_log はビュー（格納先 reaction_samples の session_key の索引は reaction_store で作成）
+    ensure_packed_schema(conn, db_type)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_effects_log_session_id ON effects_log (session_id)")
+    conn.commit()
+
+
+def rollup_table_exists(cursor, db_type: str) -> bool:
+    """session_rollupsテーブルがあるか（エクスポートAPIはテーブル作成前でも動く必要がある）"""
+    if db_type == "postgresql":
+        cursor.execute("SELECT 1 FROM information_schema.tables WHERE table_name = 'session_rollups'")
+    else:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'session_rollups'")
+    return cursor.fetchone() is not None
+
+
+def find_archive_path(cursor, db_type: str, session_id: str) -> Optional[str]:
+    """アーカイブ済みセッションのアーカイブファイルのパス（未アーカイブならNone）"""
+    if not rollup_table_exists(cursor, db_type):
+        return None
+    cursor.execute(adapt_query("SELECT archive_path FROM session_rollups WHERE session_id = %s", db_type),
+                   (session_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def read_archive(path: str) -> dict:
+    """アーカイブファイルを読み込む（session / reactions / effects）"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def select_expired_sessions(cursor, db_type: str, cutoff_ms: int, limit: Optional[int] = None) -> List[str]:
+    """完了からcutoffより前で、まだアーカイブしていないセッション（古い順）"""
+    query = """
+        SELECT session_id FROM sessions
+        WHERE is_completed = %s AND completed_at < %s
+          AND session_id NOT IN (SELECT session_id FROM session_rollups)
+        ORDER BY completed_at
+    """
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    cursor.execute(adapt_query(query, db_type), (True, cutoff_ms))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def select_leftover_sessions(cursor, db_type: str) -> List[str]:
+    """アーカイブ済みなのに行が残っているセッション（削除の途中で中断した場合）"""
+    cursor.execute("""
+        SELECT session_id FROM session_rollups r
+        WHERE EXISTS (SELECT 1 FROM reactions_log l WHERE l.session_id = r.session_id)
+           OR EXISTS (SELECT 1 FROM effects_log e WHERE e.session_id = r.session_id)
+    """)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def load_session_data(cursor, db_type: str, session_id: str) -> dict:
+    """セッションの全データをエクスポートAPIと同じ形式で読み込む"""
+    cursor.execute(adapt_query(f"SELECT {', '.join(SESSION_COLUMNS)} FROM sessions WHERE session_id = %s",
+                               db_type), (session_id,))
+    session = dict(zip(SESSION_COLUMNS, cursor.fetchone()))
+    session['is_completed'] = bool(session['is_completed'])
+    session['duration_ms'] = session['completed_at'] - session['started_at'] if session['completed_at'] else None
+
+    cursor.execute(adapt_query(f"""
+        SELECT {', '.join(REACTION_COLUMNS)} FROM reactions_log
+        WHERE session_id = %s ORDER BY timestamp
+    """, db_type), (session_id,))
+    reactions = []
+    for row in cursor.fetchall():
+        reaction = dict(zip(REACTION_COLUMNS, row))
+        for column in REACTION_BOOL_COLUMNS:
+            if reaction[column] is not None:
+                reaction[column] = bool(reaction[column])
+        reactions.append(reaction)
+
+    cursor.execute(adapt_query(f"""
+        SELECT {', '.join(EFFECT_COLUMNS)} FROM effects_log
+        WHERE session_id = %s ORDER BY timestamp
+    """, db_type), (session_id,))
+    effects = [dict(zip(EFFECT_COLUMNS, row)) for row in cursor.fetchall()]
+
+    return {"session": session, "reactions": reactions, "effects": effects}
+
+
+def build_rollup(data: dict, archive_path: str, archived_at: int) -> dict:
+    """アーカイブするデータからロールアップを作る"""
+    session = data['session']
+    reactions = data['reactions']
+    return {
+        "session_id": session['session_id'],
+        "user_id": session['user_id'],
+        "video_id": session['video_id'],
+        "experiment_group": session['experiment_group'],
+        "started_at": session['started_at'],
+        "completed_at": session['completed_at'],
+        "reaction_count": len(reactions),
+        "smiling_count": sum(1 for r in reactions if r['is_smiling']),
+        "surprised_count": sum(1 for r in reactions if r['is_surprised']),
+        "concentrating_count": sum(1 for r in reactions if r['is_concentrating']),
+        "hand_up_count": sum(1 for r in reactions if r['is_hand_up']),
+        "nod_total": sum(r['nod_count'] or 0 for r in reactions),
+        "sway_vertical_total": sum(r['sway_vertical_count'] or 0 for r in reactions),
+        "cheer_total": sum(r['cheer_count'] or 0 for r in reactions),
+        "clap_total": sum(r['clap_count'] or 0 for r in reactions),
+        "shake_head_total": sum(r['shake_head_count'] or 0 for r in reactions),
+        "sway_horizontal_total": sum(r['sway_horizontal_count'] or 0 for r in reactions),
+        "effect_count": len(data['effects']),
+        "archive_path": archive_path,
+        "archived_at": archived_at
+    }
+
+
+def write_archive(data: dict, archive_dir: Path = ARCHIVE_DIR) -> Path:
+    """アーカイブファイルを書き込む（一時ファイルに書いてから置き換える）"""
+    completed_at = data['session']['completed_at'] or data['session']['started_at']
+    month = time.strftime("%Y-%m", time.gmtime(completed_at / 1000))
+    path = Path(archive_dir) / month / f"{data['session']['session_id']}.json.gz"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return path
+
+
+def delete_in_batches(conn, db_type: str, table: str, session_id: str,
+                      batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """セッションの行をbatch_size行ずつ削除してコミットする"""
+    cursor = conn.cursor()
+    table, condition = SESSION_ROW_FILTERS.get(table, (table, "session_id = %s"))
+    query = adapt_query(f"""
+        DELETE FROM {table} WHERE id IN (
+            SELECT id FROM {table} WHERE {condition} LIMIT %s
+        )
+    """, db_type)
+    deleted = 0
+    while True:
+        cursor.execute(query, (session_id, batch_size))
+        conn.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
+
+
+def archive_session(conn, db_type: str, session_id: str, archive_dir: Path = ARCHIVE_DIR,
+                    batch_size: int = RETENTION_BATCH_SIZE) -> dict:
+    """
+    1セッションをアーカイブしてホットテーブルから削除する
+    返り値: ロールアップ
+    """
+    cursor = conn.cursor()
+    data = load_session_data(cursor, db_type, session_id)
+    path = write_archive(data, archive_dir)
+
+    # 読み戻して確認してから削除する
+    stored = read_archive(str(path))
+    if len(stored['reactions']) != len(data['reactions']) or len(stored['effects']) != len(data['effects']):
+        raise IOError(f"アーカイブの検証に失敗しました: {path}")
+
+    rollup = build_rollup(data, str(path), int(time.time() * 1000))
+    placeholders = ", ".join("%s" for _ in ROLLUP_COLUMNS)
+    cursor.execute(adapt_query(f"INSERT INTO session_rollups ({', '.join(ROLLUP_COLUMNS)}) VALUES ({placeholders})",
+                               db_type), tuple(rollup[column] for column in ROLLUP_COLUMNS))
+    conn.commit()
+
+    delete_in_batches(conn, db_type, "reactions_log", session_id, batch_size)
+    delete_in_batches(conn, db_type, "effects_log", session_id, batch_size)
+    return rollup
+
+
+def compact(conn, db_type: str, vacuum: bool):
+    """削除後の統計更新（とVACUUM）"""
+    conn.commit()
+    if db_type == "postgresql":
+        # VACUUMはトランザクション外で実行する必要がある
+        conn.autocommit = True
+        try:
+            command = "VACUUM (ANALYZE)" if vacuum else "ANALYZE"
+            cursor = conn.cursor()
+            for table in ("reaction_samples", "effects_log"):
+                cursor.execute(f"{command} {table}")
+        finally:
+            conn.autocommit = False
+    else:
+        cursor = conn.cursor()
+        cursor.execute("ANALYZE")
+        conn.commit()
+        if vacuum:
+            cursor.execute("VACUUM")
+
+
+def run_retention(conn, db_type: str, days: float = RETENTION_DAYS, archive_dir: Path = ARCHIVE_DIR,
+                  batch_size: int = RETENTION_BATCH_SIZE, vacuum_rows: int = RETENTION_VACUUM_ROWS,
+                  limit: Optional[int] = None, dry_run: bool = False) -> Dict[str, int]:
+    """
+    保持期間を過ぎたセッションをアーカイブする
+    従来形式の reactions_log テーブルが残っている場合は ValueError（削除先の reaction_samples と食い違うため）
+    返り値: 処理件数
+    """
+    ensure_retention_schema(conn, db_type)
+    if legacy_table_exists(conn.cursor(), db_type):
+        raise ValueError("reactions_logが従来形式です（python -m app.reaction_store で変換してください）")
+    cutoff_ms = int((time.time() - days * 86400) * 1000)
+    cursor = conn.cursor()
+    session_ids = select_expired_sessions(cursor, db_type, cutoff_ms, limit)
+    stats = {"sessions": 0, "reactions": 0, "effects": 0, "leftover": 0, "errors": 0}
+    if dry_run:
+        stats["sessions"] = len(session_ids)
+        return stats
+
+    # 前回中断したセッションの残りを削除（アーカイブとロールアップは作成済み）
+    for session_id in select_leftover_sessions(cursor, db_type):
+        stats["leftover"] += delete_in_batches(conn, db_type, "reactions_log", session_id, batch_size)
+        stats["leftover"] += delete_in_batches(conn, db_type, "effects_log", session_id, batch_size)
+
+    for session_id in session_ids:
+        try:
+            rollup = archive_session(conn, db_type, session_id, archive_dir, batch_size)
+        except Exception as e:
+            conn.rollback()
+            stats["errors"] += 1
+            print(f"⚠️ アーカイブエラー ({session_id}): {e}")
+            continue
+        stats["sessions"] += 1
+        stats["reactions"] += rollup['reaction_count']
+        stats["effects"] += rollup['effect_count']
+
+    deleted = stats["reactions"] + stats["effects"] + stats["leftover"]
+    if deleted:
+        compact(conn, db_type, vacuum=deleted >= vacuum_rows)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="保持期間を過ぎた生ログをアーカイブして削除する")
+    parser.add_argument("--sqlite", help="対象のSQLiteファイル（省略時はDATABASE_URL/既定のDB）")
+    parser.add_argument("--days", type=float, default=RETENTION_DAYS, help="保持日数（完了からの経過日数）")
+    parser.add_argument("--archive-dir", default=str(ARCHIVE_DIR), help="アーカイブの保存先")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE, help="1回の削除でコミットする行数")
+    parser.add_argument("--vacuum-rows", type=int, default=RETENTION_VACUUM_ROWS,
+                        help="この行数以上削除した場合にVACUUMする")
+    parser.add_argument("--limit", type=int, help="1回で処理するセッション数の上限")
+    parser.add_argument("--dry-run", action="store_true", help="対象のセッション数だけを表示する")
+    args = parser.parse_args(argv)
+
+    print("=" * 60)
+    print("🗄️ Live Reaction System - 生ログのアーカイブ")
+    print("=" * 60)
+
+    started = time.perf_counter()
+    with open_db(args.sqlite) as (conn, db_type):
+        try:
+            stats = run_retention(conn, db_type, args.days, Path(args.archive_dir), args.batch_size,
+                                  args.vacuum_rows, args.limit, args.dry_run)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+
+    if args.dry_run:
+        print(f"🔍 アーカイブ対象: {stats['sessions']:,}セッション（{args.days:g}日より前に完了）")
+    else:
+        print(f"✅ アーカイブ: {stats['sessions']:,}セッション "
+              f"(reactions {stats['reactions']:,}行 / effects {stats['effects']:,}行を削除)")
+        if stats['errors']:
+            print(f"⚠️ エラー: {stats['errors']}セッション")
+    print(f"⏱️ 処理時間: {time.perf_counter() - started:.2f}s")
+    print("=" * 60)
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+途中参加者向けのルーム状態
+ホストが動画を選択・再生した後に接続した参加者が、ホストとの時刻同期の往復を待たずに追いつけるよう、
+ルーム（グループ）ごとに選択中の動画を保持し、再生位置モデル（PlaybackClock）と
+再生中のエフェクト（EffectCoalescer）と合わせて connection_established に載せる状態を作る
+"""
+import time
+from typing import Optional
+
+from app.playback_clock import PlaybackClock
+
+
+class RoomState:
+    """ルームごとの選択中の動画"""
+    def __init__(self):
+        self.video_id: Optional[str] = None
+        self.video_selected_at: Optional[int] = None  # 選択された時刻（ms）
+
+    def select_video(self, video_id: str, timestamp_ms: int):
+        self.video_id = video_id or None
+        self.video_selected_at = timestamp_ms
+
+    def snapshot(self, playback_clock: Optional[PlaybackClock], running_effect: Optional[dict],
+                 now_ms: Optional[int] = None, now: Optional[float] = None) -> dict:
+        """
+        接続時に送るルームの状態
+        playback_clock: ルームの再生位置モデル（なければNone）
+        running_effect: EffectCoalescer の再生中エフェクト（送らない場合はNone）
+        """
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        if now is None:
+            now = time.monotonic()
+
+        playback = None
+        if playback_clock is not None and playback_clock.position is not None:
+            playback = {
+                "currentTime": playback_clock.current_position(now),  # 送信時点に外挿した位置（秒）
+                "isPlaying": playback_clock.is_playing,
+                "ageMs": int((now - playback_clock.updated_at) * 1000),  # ホストから最後に報告を受けてからの時間
+                "fresh": playback_clock.is_fresh(now)
+            }
+
+        effect = None
+        if running_effect is not None and running_effect['endsAt'] > now_ms:
+            # 残り時間だけ再生するエフェクト指示
+            effect = {
+                "type": "effect",
+                "effectType": running_effect['effectType'],
+                "intensity": running_effect['intensity'],
+                "durationMs": running_effect['endsAt'] - now_ms,
+                "timestamp": now_ms,
+                "phase": "start"
+            }
+
+        return {
+            "videoId": self.video_id,
+            "videoSelectedAt": self.video_selected_at,
+            "playback": playback,
+            "effect": effect,
+            "timestamp": now_ms
+        }
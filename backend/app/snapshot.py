@@ -0,0 +1,234 @@
+"""
+状態スナップショット
+ConnectionManager / AggregationEngine の状態をコンパクトなバイナリ形式で保存・復元する
+
+保存対象:
+    - ユーザーごとのスライディングウィンドウ（保存時点で3秒窓内のサンプルだけ）
+    - マイク許可状態（サンプルを保存したユーザーのみ）
+    - グループ・ホストの登録情報（DB登録済みユーザー）
+    - ランダムエフェクトのタイマー
+
+形式（ヘッダー以降はzlib圧縮）:
+    MAGIC(4) VERSION(B) | created_at(d) last_random_effect_time(d)
+    名前表: state名, event名
+    登録ユーザー: user_id, group, is_host
+    マイク: user_id, flag
+    サンプル: user_id, n, [timestamp(d) state_bitmask(I) n_events(B) [event_idx(B) count(i)]...]
+"""
+import os
+import struct
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from app.aggregation import WINDOW_MS
+
+MAGIC = b"LRSS"
+VERSION = 1
+
+# スナップショットファイルの設定
+SNAPSHOT_PATH = os.getenv(
+    "STATE_SNAPSHOT_PATH",
+    str(os.path.join(os.path.dirname(__file__), "..", "data", "state.snapshot"))
+)
+SNAPSHOT_INTERVAL = float(os.getenv("STATE_SNAPSHOT_INTERVAL", "10"))  # 定期保存の間隔（秒）
+SNAPSHOT_MAX_AGE = float(os.getenv("STATE_SNAPSHOT_MAX_AGE", "300"))  # これより古いスナップショットは復元しない（秒）
+
+MAX_STATE_NAMES = 32  # state_bitmask(I) のビット数
+MAX_EVENT_NAMES = 255  # event_idx(B) の範囲
+
+
+class _Writer:
+    def __init__(self):
+        self.parts: List[bytes] = []
+
+    def pack(self, fmt: str, *values):
+        self.parts.append(struct.pack("<" + fmt, *values))
+
+    def string(self, value: str):
+        data = value.encode("utf-8")
+        self.pack("H", len(data))
+        self.parts.append(data)
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.parts)
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt: str) -> tuple:
+        fmt = "<" + fmt
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def string(self) -> str:
+        (length,) = self.unpack("H")
+        value = self.data[self.offset:self.offset + length].decode("utf-8")
+        self.offset += length
+        return value
+
+
+def encode_state(manager) -> bytes:
+    """ConnectionManagerの状態をバイナリにエンコード"""
+    engine = manager.aggregation_engine
+    now_ms = engine.clock() * 1000
+
+    # 窓から外れたサンプルは復元しても集約に使われないため保存しない
+    windows = {}
+    for user_id, user_reaction in engine.user_data.items():
+        recent = user_reaction.get_recent_samples(WINDOW_MS, now_ms)
+        if recent:
+            windows[user_id] = recent
+
+    # サンプルに現れるstate名・event名の名前表を作る（形式に収まらない分の名前は保存しない）
+    state_names: Dict[str, int] = {}
+    event_names: Dict[str, int] = {}
+    dropped = set()
+    for recent in windows.values():
+        for sample in recent:
+            for name in sample['states']:
+                if name not in state_names and len(state_names) >= MAX_STATE_NAMES:
+                    dropped.add(name)
+                    continue
+                state_names.setdefault(name, len(state_names))
+            for name in sample['events']:
+                if name not in event_names and len(event_names) >= MAX_EVENT_NAMES:
+                    dropped.add(name)
+                    continue
+                event_names.setdefault(name, len(event_names))
+    if dropped:
+        print(f"⚠️ スナップショットに格納できない名前を除外しました: {len(dropped)}件")
+
+    w = _Writer()
+    w.pack("dd", time.time(), manager.last_random_effect_time)
+
+    w.pack("B", len(state_names))
+    for name in state_names:
+        w.string(name)
+    w.pack("B", len(event_names))
+    for name in event_names:
+        w.string(name)
+
+    w.pack("I", len(manager.known_users))
+    for user_id, (group, is_host) in manager.known_users.items():
+        w.string(user_id)
+        w.string(group)
+        w.pack("?", is_host)
+
+    microphone = {user_id: engine.user_has_microphone[user_id]
+                  for user_id in windows if user_id in engine.user_has_microphone}
+    w.pack("I", len(microphone))
+    for user_id, has_microphone in microphone.items():
+        w.string(user_id)
+        w.pack("?", bool(has_microphone))
+
+    w.pack("I", len(windows))
+    for user_id, recent in windows.items():
+        w.string(user_id)
+        w.pack("B", len(recent))
+        for sample in recent:
+            mask = 0
+            for name, is_active in sample['states'].items():
+                if is_active and name in state_names:
+                    mask |= 1 << state_names[name]
+            events = [(event_names[name], int(count)) for name, count in sample['events'].items()
+                      if name in event_names]
+            w.pack("dIB", float(sample['timestamp']), mask, len(events))
+            for index, count in events:
+                w.pack("Bi", index, count)
+
+    return MAGIC + struct.pack("<B", VERSION) + zlib.compress(w.getvalue())
+
+
+def decode_state(data: bytes) -> dict:
+    """バイナリをデコードして状態の辞書を返す"""
+    if data[:4] != MAGIC:
+        raise ValueError("スナップショットの形式が不正です")
+    (version,) = struct.unpack_from("<B", data, 4)
+    if version != VERSION:
+        raise ValueError(f"未対応のスナップショットバージョンです: {version}")
+
+    r = _Reader(zlib.decompress(data[5:]))
+    created_at, last_random_effect_time = r.unpack("dd")
+
+    (n,) = r.unpack("B")
+    state_names = [r.string() for _ in range(n)]
+    (n,) = r.unpack("B")
+    event_names = [r.string() for _ in range(n)]
+
+    known_users: Dict[str, Tuple[str, bool]] = {}
+    (n,) = r.unpack("I")
+    for _ in range(n):
+        user_id = r.string()
+        group = r.string()
+        (is_host,) = r.unpack("?")
+        known_users[user_id] = (group, is_host)
+
+    microphone: Dict[str, bool] = {}
+    (n,) = r.unpack("I")
+    for _ in range(n):
+        user_id = r.string()
+        (has_microphone,) = r.unpack("?")
+        microphone[user_id] = has_microphone
+
+    samples: Dict[str, List[dict]] = {}
+    (n,) = r.unpack("I")
+    for _ in range(n):
+        user_id = r.string()
+        (count,) = r.unpack("B")
+        user_samples = []
+        for _ in range(count):
+            timestamp, mask, n_events = r.unpack("dIB")
+            events = {}
+            for _ in range(n_events):
+                index, value = r.unpack("Bi")
+                events[event_names[index]] = value
+            states = {name: bool(mask & (1 << i)) for i, name in enumerate(state_names)}
+            user_samples.append({'timestamp': timestamp, 'states': states, 'events': events})
+        samples[user_id] = user_samples
+
+    return {
+        "created_at": created_at,
+        "last_random_effect_time": last_random_effect_time,
+        "known_users": known_users,
+        "microphone": microphone,
+        "samples": samples
+    }
+
+
+def apply_state(manager, state: dict):
+    """デコードした状態をConnectionManagerに復元する"""
+    engine = manager.aggregation_engine
+    manager.last_random_effect_time = state['last_random_effect_time']
+    manager.known_users.update(state['known_users'])
+    engine.user_has_microphone.update(state['microphone'])
+    for user_id, user_samples in state['samples'].items():
+        for sample in user_samples:
+            engine.update_user_data(user_id, sample)
+
+
+def write_snapshot(data: bytes, path: str = SNAPSHOT_PATH):
+    """一時ファイルに書いてから置き換える（書き込み途中のファイルを読まないため）"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def restore_snapshot(manager, path: str = SNAPSHOT_PATH, max_age: float = SNAPSHOT_MAX_AGE) -> Optional[dict]:
+    """スナップショットがあれば復元する。復元した場合は状態の辞書を返す"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        state = decode_state(f.read())
+    age = time.time() - state['created_at']
+    if age > max_age:
+        print(f"ℹ️ スナップショットが古いため復元しません ({age:.0f}秒前)")
+        return None
+    apply_state(manager, state)
+    print(f"♻️ スナップショットを復元しました ({age:.1f}秒前, ユーザー: {len(state['samples'])}, 登録: {len(state['known_users'])})")
+    return state
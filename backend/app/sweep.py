@@ -0,0 +1,328 @@
+"""
+閾値スイープ評価ツール
+エフェクト判定の閾値・優先順位の組み合わせ（グリッド）を記録済みデータで一括評価する
+
+reactions_logは一度だけ読み込み、ティックごとの集約指標（ratio_state, density_event）を
+事前計算して全ワーカーで共有する。各設定の評価はプロセスプールで並列に行う
+本番と同じく受信ごとの即時判定と EffectCoalescer による合流も再現する（--no-early / --no-coalesce で無効化）
+
+使い方:
+    python -m app.sweep --grid isHandUp=0.2,0.3,0.4 --grid clap=0.1,0.15,0.2
+    python -m app.sweep --config sweep.json --output result.csv
+    python -m app.sweep --grid nod=0.2,0.3,0.4 --sort switch_rate --ascending --top 10
+
+sweep.json の例:
+    {
+        "thresholds": {"isSmiling": [0.3, 0.35, 0.4], "nod": [0.2, 0.3]},
+        "priorities": [["isHandUp", "isSmiling"], []]
+    }
+    priorities の各要素は先頭に持ってくる指標の並び（空リストは既定の順序）
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from app.aggregation import AggregationEngine
+from app.early_trigger import EarlyTrigger
+from app.effect_coalescer import EffectCoalescer, LOGGED_PHASES
+from app.effect_rules import DEFAULT_EFFECT_RULES, DEFAULT_RULE_SET, compile_rules
+from app.database import open_db
+from app.replay import ReplayClock, TICK_MS, iter_reaction_rows, iter_ticks, parse_time_arg, parse_user_list
+
+# 結果の並べ替えに使える指標
+SORT_KEYS = ('effects_per_min', 'effects', 'effect_ratio', 'switch_rate')
+
+# ワーカープロセスで共有する事前計算済みの集約指標
+_shared_table: Optional[dict] = None
+
+
+def precompute_window_table(rows, tick_ms: int = TICK_MS, microphone: str = 'inferred',
+                            early: bool = True) -> dict:
+    """
+    全ティックの集約指標と、即時判定ルールの受信ごとの指標を列指向の配列にまとめる
+
+    返り値:
+        {
+            "columns": {metric: array('d')},  # ルールが参照する指標のみ
+            "gap_before": array('b'),         # 直前にアクティブユーザーのいない区間があったか
+            "tick_times": array('d'),         # ティックの時刻（ms）
+            "ticks": ティック数,
+            "coalesce": True,                 # EffectCoalescer を通した発動を数えるか（main で上書き）
+            "early": {                        # early=False の場合は None
+                "times": array('d'),          # サンプルの時刻（ms）
+                "columns": {metric: array('d')}  # 投入直後の即時判定ルールの指標
+            }
+        }
+    """
+    clock = ReplayClock()
+    engine = AggregationEngine(clock=clock, verbose=False, load_shedding=False, early_triggering=early)
+    sources = {rule['metric']: rule['source'] for rule in DEFAULT_EFFECT_RULES}
+    columns = {metric: array('d') for metric in sources}
+    gap_before = array('b')
+    tick_times = array('d')
+    in_gap = True
+
+    early_table = None
+    on_ingest = None
+    if early:
+        early_table = {"times": array('d'),
+                       "columns": {rule['metric']: array('d') for rule in DEFAULT_RULE_SET.early_rules}}
+
+        def on_ingest(sample_ms: float):
+            values = engine.early_values(sample_ms, DEFAULT_RULE_SET)
+            early_table["times"].append(sample_ms)
+            for metric, column in early_table["columns"].items():
+                # 窓内にアクティブユーザーがいない場合は NaN
+                column.append(values[metric] if values is not None else math.nan)
+
+    for tick_ms_value in iter_ticks(rows, engine, clock, tick_ms, microphone=microphone, on_ingest=on_ingest):
+        metrics = engine.compute_rule_metrics(tick_ms_value, DEFAULT_RULE_SET)
+        if metrics is None:
+            in_gap = True
+            continue
+        for metric, source in sources.items():
+            columns[metric].append(metrics[source].get(metric, 0.0))
+        gap_before.append(1 if in_gap else 0)
+        tick_times.append(tick_ms_value)
+        in_gap = False
+
+    return {"columns": columns, "gap_before": gap_before, "tick_times": tick_times, "ticks": len(gap_before),
+            "coalesce": True, "early": early_table}
+
+
+def build_rules(config: dict) -> List[dict]:
+    """スイープ設定（thresholds, priority）から判定ルールのリストを作る"""
+    thresholds = config.get('thresholds', {})
+    priority = config.get('priority') or []
+    rules = sorted(DEFAULT_EFFECT_RULES, key=lambda rule: rule['priority'])
+    if priority:
+        order = {metric: i for i, metric in enumerate(priority)}
+        # 指定された指標を先頭に、残りは既定の順序を保つ（sortedは安定ソート）
+        rules = sorted(rules, key=lambda rule: order.get(rule['metric'], len(order)))
+    return [
+        dict(rule, threshold=thresholds.get(rule['metric'], rule['threshold']), priority=i + 1)
+        for i, rule in enumerate(rules)
+    ]
+
+
+def evaluate_config(config: dict, table: Optional[dict] = None) -> dict:
+    """
+    1つの設定を事前計算済みの集約指標で評価する
+
+    本番と同じく、ティックの判定と受信ごとの即時判定（表に early がある場合）を時刻順に行い、
+    表の coalesce が True なら EffectCoalescer を通して effects_log に記録されるもの（start / switch / update）を数える
+    """
+    table = table if table is not None else _shared_table
+    rule_set = compile_rules(build_rules(config))
+    resolved = [(table['columns'][rule['metric']], rule['threshold'], rule) for rule in rule_set.rules]
+    gap_before = table['gap_before']
+    tick_times = table['tick_times']
+    early_table = table['early']
+    coalescer = EffectCoalescer(TICK_MS) if table['coalesce'] else None
+
+    distribution: Dict[str, int] = {}
+    effects = 0
+    switches = 0
+    previous = None
+
+    def emit(rule: dict, intensity: float, timestamp: float):
+        nonlocal effects, switches, previous
+        effect_type = rule['effectType']
+        if coalescer is not None:
+            message = coalescer.coalesce('experiment', {"effectType": effect_type, "intensity": intensity,
+                                                        "durationMs": 2000, "timestamp": int(timestamp)})
+            if message is None or message['phase'] not in LOGGED_PHASES:
+                return
+            if message['phase'] == 'switch':
+                switches += 1
+        else:
+            # 連続して発動したエフェクトの種類が変わった回数
+            if previous is not None and previous != effect_type:
+                switches += 1
+            previous = effect_type
+        effects += 1
+        distribution[effect_type] = distribution.get(effect_type, 0) + 1
+
+    trigger = None
+    if early_table is not None and rule_set.early_rules:
+        trigger = EarlyTrigger()
+        early_rules = rule_set.early_rules
+        early_times = early_table['times']
+        early_columns = [(metric, early_table['columns'][metric]) for metric in early_table['columns']]
+    sample_index = 0
+
+    def run_early(until_ms: float):
+        """until_ms より前に投入したサンプルの即時判定（同じ時刻ではティックが先）"""
+        nonlocal sample_index
+        while sample_index < len(early_times) and early_times[sample_index] < until_ms:
+            values = {metric: column[sample_index] for metric, column in early_columns}
+            if early_columns and math.isnan(early_columns[0][1][sample_index]):
+                values = None
+            decision = trigger.decide(early_rules, values, early_times[sample_index])
+            if decision is not None:
+                emit(decision[0], decision[1], early_times[sample_index])
+            sample_index += 1
+
+    for i in range(table['ticks']):
+        if trigger is not None:
+            run_early(tick_times[i])
+
+        if gap_before[i]:
+            previous = None
+        for column, threshold, rule in resolved:
+            if column[i] >= threshold:
+                emit(rule, min(column[i] / rule['scale'], 1.0), tick_times[i])
+                break
+        else:
+            previous = None
+    # 最後のティックより後に投入したサンプルも判定する（最後のサンプルの次のティックまで）
+    if trigger is not None and sample_index < len(early_times):
+        run_early(early_times[-1] + TICK_MS)
+
+    active_minutes = table['ticks'] * TICK_MS / 60000
+    return {
+        "config": config,
+        "active_ticks": table['ticks'],
+        "effects": effects,
+        "effects_per_min": effects / active_minutes if active_minutes else 0.0,
+        "effect_ratio": effects / table['ticks'] if table['ticks'] else 0.0,
+        "switch_rate": switches / effects if effects else 0.0,
+        "distribution": distribution
+    }
+
+
+def _init_worker(table: dict):
+    global _shared_table
+    _shared_table = table
+
+
+def expand_grid(thresholds: Dict[str, List[float]], priorities: Optional[List[List[str]]] = None) -> List[dict]:
+    """閾値候補と優先順位候補の直積から設定のリストを作る"""
+    known_metrics = {rule['metric'] for rule in DEFAULT_EFFECT_RULES}
+    for metric in list(thresholds) + [m for p in (priorities or []) for m in p]:
+        if metric not in known_metrics:
+            raise ValueError(f"未知の指標です: {metric}（指定可能: {sorted(known_metrics)}）")
+
+    metrics = list(thresholds)
+    configs = []
+    for priority in priorities or [[]]:
+        for values in itertools.product(*(thresholds[m] for m in metrics)):
+            configs.append({"thresholds": dict(zip(metrics, values)), "priority": list(priority)})
+    return configs
+
+
+def run_sweep(configs: List[dict], table: dict, workers: Optional[int] = None) -> List[dict]:
+    """プロセスプールで全設定を評価する（集約指標は各ワーカーに一度だけ渡す）"""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(configs) <= 1:
+        return [evaluate_config(config, table) for config in configs]
+    chunksize = max(1, len(configs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(table,)) as executor:
+        return list(executor.map(evaluate_config, configs, chunksize=chunksize))
+
+
+def write_results(results: List[dict], path: str):
+    """評価結果をJSONまたはCSV（拡張子で判定）で書き出す"""
+    if path.endswith(".csv"):
+        effect_types = sorted({t for r in results for t in r['distribution']})
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["thresholds", "priority", "effects", "effects_per_min", "effect_ratio", "switch_rate"] + effect_types)
+            for r in results:
+                writer.writerow([
+                    json.dumps(r['config']['thresholds']),
+                    ",".join(r['config']['priority']),
+                    r['effects'],
+                    f"{r['effects_per_min']:.4f}",
+                    f"{r['effect_ratio']:.4f}",
+                    f"{r['switch_rate']:.4f}"
+                ] + [r['distribution'].get(t, 0) for t in effect_types])
+    else:
+        with open(path, "w") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def parse_grid_arg(values: List[str]) -> Dict[str, List[float]]:
+    """--grid metric=v1,v2,... を辞書に変換"""
+    grid = {}
+    for value in values:
+        metric, _, candidates = value.partition("=")
+        grid[metric.strip()] = [float(v) for v in candidates.split(",") if v.strip()]
+    return grid
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="エフェクト判定の閾値・優先順位をスイープ評価する")
+    parser.add_argument("--sqlite", help="評価に使うSQLiteファイル（省略時はDATABASE_URL/既定のDB）")
+    parser.add_argument("--since", help="開始時刻（ms または YYYY-MM-DD[THH:MM:SS]）")
+    parser.add_argument("--until", help="終了時刻（ms または YYYY-MM-DD[THH:MM:SS]）")
+    parser.add_argument("--config", help="スイープ設定のJSONファイル")
+    parser.add_argument("--grid", action="append", default=[], help="閾値候補 metric=v1,v2,...（複数指定可）")
+    parser.add_argument("--priority", action="append", default=[], help="優先順位候補 metricA,metricB,...（複数指定可）")
+    parser.add_argument("--microphone", choices=['inferred', 'all', 'none'], default='inferred',
+                        help="マイクありユーザーの推定方法")
+    parser.add_argument("--hosts", help="除外するホストのuser_id（カンマ区切り。users.is_host の記録がないDB用）")
+    parser.add_argument("--no-early", action="store_true", help="受信ごとの即時判定を再現しない")
+    parser.add_argument("--no-coalesce", action="store_true",
+                        help="EffectCoalescerを通さず、判定されたエフェクトをすべて数える")
+    parser.add_argument("--workers", type=int, help="ワーカープロセス数（既定: CPU数）")
+    parser.add_argument("--sort", choices=SORT_KEYS, default='effects_per_min',
+                        help="表示・出力の並び順に使う指標（降順、既定: effects_per_min）")
+    parser.add_argument("--ascending", action="store_true", help="昇順に並べる")
+    parser.add_argument("--top", type=int, default=50, help="並べ替えた結果の上位から表示する設定数")
+    parser.add_argument("--output", help="評価結果の出力先（.csv または .json）")
+    args = parser.parse_args(argv)
+
+    thresholds: Dict[str, List[float]] = {}
+    priorities: List[List[str]] = []
+    if args.config:
+        with open(args.config) as f:
+            config_file = json.load(f)
+        thresholds.update(config_file.get('thresholds', {}))
+        priorities.extend(config_file.get('priorities', []))
+    thresholds.update(parse_grid_arg(args.grid))
+    priorities.extend([[m.strip() for m in p.split(",") if m.strip()] for p in args.priority])
+    configs = expand_grid(thresholds, priorities or None)
+
+    print("=" * 60)
+    print("🎛️ Live Reaction System - 閾値スイープ")
+    print("=" * 60)
+
+    started = time.perf_counter()
+    with open_db(args.sqlite) as (conn, db_type):
+        rows = iter_reaction_rows(conn, db_type, parse_time_arg(args.since), parse_time_arg(args.until),
+                                  exclude_users=parse_user_list(args.hosts))
+        table = precompute_window_table(rows, microphone=args.microphone, early=not args.no_early)
+    table['coalesce'] = not args.no_coalesce
+    print(f"📊 集約指標を事前計算: {table['ticks']:,} ティック ({time.perf_counter() - started:.2f}s)")
+
+    started = time.perf_counter()
+    results = run_sweep(configs, table, args.workers)
+    print(f"⚙️ {len(configs):,} 設定を評価 ({time.perf_counter() - started:.2f}s)")
+    results.sort(key=lambda r: r[args.sort], reverse=not args.ascending)
+    order = "昇順" if args.ascending else "降順"
+    print(f"📋 {args.sort} の{order}で上位 {min(args.top, len(results)):,} 件")
+    print("-" * 60)
+
+    for r in results[:args.top]:
+        priority = f" priority={','.join(r['config']['priority'])}" if r['config']['priority'] else ""
+        print(f"  {r['config']['thresholds']}{priority}")
+        print(f"    発動: {r['effects']:,} ({r['effects_per_min']:.1f}/分, {r['effect_ratio'] * 100:.1f}%)"
+              f" | 切替率: {r['switch_rate'] * 100:.1f}% | 分布: {r['distribution']}")
+
+    if args.output:
+        write_results(results, args.output)
+        print(f"💾 評価結果を書き出しました: {args.output}")
+
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
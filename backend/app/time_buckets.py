@@ -0,0 +1,115 @@
+"""
+多段解像度の時間バケット（観客全体の数え上げ）
+リアクションの種類ごとに異なる長さの時間窓（拍手は短く、集中は長く）で指標を読み出すため、
+サンプルを観客全体で 250ms / 1秒 / 10秒 の固定長のリングバッファに数え上げる
+バケットはサンプルのタイムスタンプ（ティックの集約と同じ時刻）で決まる
+
+- 追加は各段のバケット1つずつに加算するだけ（O(1)）
+- 読み出しは窓を覆える最も細かい段のバケットを最大で段の長さ分だけ合計する（ユーザー数に依存しない）
+- メモリはユーザー数に関係なくバケットの総数（既定 8 + 12 + 6 = 26個）で抑えられる
+
+バケットはユーザーを区別しないため、指標はサンプル数を分母にした時間平均になる
+- ratio_state: 窓内のサンプルのうちstateがtrueだったものの割合
+- density_event: 窓内のイベント合計 / (サンプル数 × 送信間隔)（音声イベントはマイクありのサンプル数）
+クライアントは1秒ごとに送信するため、定常状態では3秒窓の集約（ユーザーごとの数え上げ）と同じ尺度になる
+"""
+from typing import Dict, List, Optional, Tuple
+
+from app.partial_aggregate import AUDIO_EVENTS
+
+# (解像度ms, バケット数) を細かい順に
+BUCKET_LEVELS: Tuple[Tuple[int, int], ...] = ((250, 8), (1000, 12), (10000, 6))
+MAX_WINDOW_MS = max(resolution * size for resolution, size in BUCKET_LEVELS)
+SAMPLE_INTERVAL_MS = 1000  # クライアントのリアクション送信間隔
+
+
+class BucketCounts:
+    """1バケット分の数え上げ（加算可能）"""
+    __slots__ = ("samples", "microphone_samples", "state_counts", "event_totals")
+
+    def __init__(self):
+        self.samples = 0
+        self.microphone_samples = 0
+        self.state_counts: Dict[str, int] = {}
+        self.event_totals: Dict[str, int] = {}
+
+    def add(self, states: dict, events: dict, has_microphone: bool):
+        self.samples += 1
+        if has_microphone:
+            self.microphone_samples += 1
+        for state_name, is_active in states.items():
+            if is_active:
+                self.state_counts[state_name] = self.state_counts.get(state_name, 0) + 1
+        for event_name, count in events.items():
+            if count:
+                self.event_totals[event_name] = self.event_totals.get(event_name, 0) + count
+
+
+class _Level:
+    """1段分のリングバッファ（バケットの通し番号 = 時刻 // 解像度）"""
+    def __init__(self, resolution_ms: int, size: int):
+        self.resolution_ms = resolution_ms
+        self.size = size
+        self.buckets: List[BucketCounts] = [BucketCounts() for _ in range(size)]
+        self.indexes: List[int] = [-1] * size
+
+    def bucket_for(self, now_ms: float) -> Optional[BucketCounts]:
+        index = int(now_ms // self.resolution_ms)
+        slot = index % self.size
+        if self.indexes[slot] != index:
+            if self.indexes[slot] > index:
+                # リングを一周した後に届いた古いサンプル
+                return None
+            self.buckets[slot] = BucketCounts()
+            self.indexes[slot] = index
+        return self.buckets[slot]
+
+    def window_buckets(self, now_ms: float, window_ms: int) -> List[BucketCounts]:
+        """現在のバケットを含む直近 ceil(窓 / 解像度) 個のバケット"""
+        current = int(now_ms // self.resolution_ms)
+        count = min(self.size, -(-window_ms // self.resolution_ms))
+        buckets = []
+        for index in range(current - count + 1, current + 1):
+            slot = index % self.size
+            if self.indexes[slot] == index:
+                buckets.append(self.buckets[slot])
+        return buckets
+
+
+class TimeBuckets:
+    """観客全体のサンプルを多段解像度で数え上げる"""
+    def __init__(self, levels: Tuple[Tuple[int, int], ...] = BUCKET_LEVELS,
+                 sample_interval_ms: int = SAMPLE_INTERVAL_MS):
+        self.levels = [_Level(resolution, size) for resolution, size in levels]
+        self.sample_interval_ms = sample_interval_ms
+
+    def add(self, sample_ms: float, states: dict, events: dict, has_microphone: bool):
+        """サンプル1件をその時刻の各段のバケットに加算する"""
+        for level in self.levels:
+            bucket = level.bucket_for(sample_ms)
+            if bucket is not None:
+                bucket.add(states, events, has_microphone)
+
+    def _level_for(self, window_ms: int) -> _Level:
+        for level in self.levels:
+            if window_ms <= level.resolution_ms * level.size:
+                return level
+        raise ValueError(f"時間窓が長すぎます: {window_ms}ms（最大 {MAX_WINDOW_MS}ms）")
+
+    def metric_value(self, source: str, metric: str, window_ms: int, now_ms: float) -> Optional[float]:
+        """
+        指定した窓で指標を計算する
+        返り値: 指標値 or None（窓内にサンプルなし）
+        """
+        buckets = self._level_for(window_ms).window_buckets(now_ms, window_ms)
+        samples = sum(bucket.samples for bucket in buckets)
+        if samples == 0:
+            return None
+        if source == 'ratioState':
+            return sum(bucket.state_counts.get(metric, 0) for bucket in buckets) / samples
+        total = sum(bucket.event_totals.get(metric, 0) for bucket in buckets)
+        if metric in AUDIO_EVENTS:
+            samples = sum(bucket.microphone_samples for bucket in buckets)
+            if samples == 0:
+                return 0.0
+        return total / (samples * self.sample_interval_ms / 1000)
@@ -0,0 +1,85 @@
+"""
+動画操作イベントの合流配信
+ホストのシークバー操作などで短時間に大量に届く video_play / video_pause / video_seek を、
+ルームごとに VIDEO_FANOUT_WINDOW_MS の窓でまとめて配信する
+
+- 窓が開いていないルームの最初のイベントは即座に配信し、窓を開く（単発の操作は遅延しない）
+- 窓の間に届いたイベントは保留し、窓の終了時にまとめて配信する
+    - シークは直前の保留イベントの位置を上書きする（latest-wins）
+    - play / pause は直前の保留シークを置き換え（play / pause も位置を持つため）、
+      同じ種類が続く場合は上書きする。種類が変わる場合は順序を保って追加する
+- 窓の終了時に配信したイベントがあれば次の窓を開き、なければ窓を閉じる
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List
+
+from app import metrics
+
+VIDEO_FANOUT_WINDOW_MS = int(os.getenv("VIDEO_FANOUT_WINDOW_MS", "150"))  # 0で合流しない
+
+VIDEO_CONTROL_TYPES = ('video_play', 'video_pause', 'video_seek')
+
+Sender = Callable[[dict, str], Awaitable[None]]
+
+
+def merge_pending(pending: List[dict], message: dict):
+    """保留中のイベント列に新しいイベントを合流させる（pendingを直接更新）"""
+    if not pending:
+        pending.append(message)
+        return
+    last = pending[-1]
+    if message['type'] == 'video_seek':
+        # 種類はそのままで位置だけを最新にする
+        pending[-1] = dict(last, currentTime=message['currentTime'], timestamp=message['timestamp'],
+                           coalesced=last.get('coalesced', 1) + 1)
+    elif last['type'] in ('video_seek', message['type']):
+        pending[-1] = dict(message, coalesced=last.get('coalesced', 1) + 1)
+    else:
+        pending.append(message)
+
+
+class VideoControlFanout:
+    """ルームごとの動画操作イベントの合流配信"""
+    def __init__(self, send: Sender, window_ms: int = VIDEO_FANOUT_WINDOW_MS):
+        self.send = send
+        self.window_ms = window_ms
+        self.pending: Dict[str, List[dict]] = {}  # room -> 保留中のイベント
+        self.windows: Dict[str, asyncio.Task] = {}  # room -> 窓を閉じるタスク
+
+    async def publish(self, room: str, message: dict):
+        """動画操作イベントを配信（窓が開いていれば保留）"""
+        metrics.increment("video.fanout.received")
+        if self.window_ms <= 0:
+            await self._send(room, message)
+            return
+        if room in self.windows:
+            merge_pending(self.pending.setdefault(room, []), message)
+            return
+        await self._send(room, message)
+        self.windows[room] = asyncio.create_task(self._run_window(room))
+
+    async def _send(self, room: str, message: dict):
+        metrics.increment("video.fanout.sent")
+        await self.send(message, room)
+
+    async def _run_window(self, room: str):
+        try:
+            while True:
+                await asyncio.sleep(self.window_ms / 1000)
+                pending = self.pending.pop(room, None)
+                if not pending:
+                    break
+                for message in pending:
+                    await self._send(room, message)
+        except Exception as e:
+            print(f"⚠️ 動画操作の配信エラー ({room}): {e}")
+        finally:
+            self.windows.pop(room, None)
+
+    def close(self):
+        """保留中のイベントと窓をすべて破棄（終了時）"""
+        for task in self.windows.values():
+            task.cancel()
+        self.windows.clear()
+        self.pending.clear()
@@ -1,110 +1,18 @@
 #!/bin/bash
 # データベース確認用スクリプト
+# 集計はSQLで行い、SQLite / PostgreSQL（DATABASE_URL）の両方に対応
+# 追加の引数は app.report にそのまま渡す（例: ./check_db.sh --format json）
 
 DB_PATH="./data/live_reaction.db"
 
-echo "=========================================="
-echo "📊 Live Reaction System - DB確認"
-echo "=========================================="
-echo ""
-
-# データベースが存在するか確認
-if [ ! -f "$DB_PATH" ]; then
-    echo "⚠️ データベースファイルが見つかりません: $DB_PATH"
-    exit 1
+if [ -z "$DATABASE_URL" ]; then
+    # データベースが存在するか確認
+    if [ ! -f "$DB_PATH" ]; then
+        echo "⚠️ データベースファイルが見つかりません: $DB_PATH"
+        exit 1
+    fi
+    exec python -m app.report --sqlite "$DB_PATH" \
+        --section table_counts --section users_by_group --section effects_by_type "$@"
 fi
 
-echo "データベースパス: $DB_PATH"
-echo ""
-
-# 各テーブルのレコード数を表示
-echo "=========================================="
-echo "📈 テーブルごとのレコード数"
-echo "=========================================="
-sqlite3 "$DB_PATH" <<EOF
-.mode column
-.headers on
-SELECT 'users' as table_name, COUNT(*) as count FROM users
-UNION ALL
-SELECT 'reactions_log', COUNT(*) FROM reactions_log
-UNION ALL
-SELECT 'effects_log', COUNT(*) FROM effects_log;
-EOF
-echo ""
-
-# ユーザー一覧
-echo "=========================================="
-echo "👥 登録ユーザー一覧"
-echo "=========================================="
-sqlite3 "$DB_PATH" <<EOF
-.mode column
-.headers on
-SELECT
-    id,
-    experiment_group,
-    datetime(created_at / 1000, 'unixepoch', 'localtime') as created_at
-FROM users;
-EOF
-echo ""
-
-# 最新のリアクションログ（5件）
-echo "=========================================="
-echo "📝 最新のリアクションログ（5件）"
-echo "=========================================="
-sqlite3 "$DB_PATH" <<EOF
-.mode column
-.headers on
-SELECT
-    datetime(timestamp / 1000, 'unixepoch', 'localtime') as time,
-    user_id,
-    is_smiling,
-    is_surprised,
-    is_hand_up,
-    nod_count,
-    sway_vertical_count
-FROM reactions_log
-ORDER BY timestamp DESC
-LIMIT 5;
-EOF
-echo ""
-
-# 最新のエフェクトログ（5件）
-echo "=========================================="
-echo "✨ 最新のエフェクトログ（5件）"
-echo "=========================================="
-sqlite3 "$DB_PATH" <<EOF
-.mode column
-.headers on
-SELECT
-    datetime(timestamp / 1000, 'unixepoch', 'localtime') as time,
-    effect_type,
-    ROUND(intensity, 2) as intensity,
-    duration_ms
-FROM effects_log
-ORDER BY timestamp DESC
-LIMIT 5;
-EOF
-echo ""
-
-# エフェクトタイプ別の統計
-echo "=========================================="
-echo "📊 エフェクトタイプ別の統計"
-echo "=========================================="
-sqlite3 "$DB_PATH" <<EOF
-.mode column
-.headers on
-SELECT
-    effect_type,
-    COUNT(*) as count,
-    ROUND(AVG(intensity), 3) as avg_intensity,
-    ROUND(MIN(intensity), 3) as min_intensity,
-    ROUND(MAX(intensity), 3) as max_intensity
-FROM effects_log
-GROUP BY effect_type
-ORDER BY count DESC;
-EOF
-echo ""
-
-echo "=========================================="
-echo "✅ 確認完了"
-echo "=========================================="
+exec python -m app.report --section table_counts --section users_by_group --section effects_by_type "$@"
@@ -0,0 +1,41 @@
+"""
+テスト共通の設定
+app のモジュールを読み込む前に、スナップショットなどの出力先を一時ディレクトリに向ける
+（data/ のデータベース・スナップショットには書き込まない）
+"""
+import os
+import tempfile
+
+_tmp_dir = tempfile.mkdtemp(prefix="live_reaction_test_")
+os.environ["STATE_SNAPSHOT_PATH"] = os.path.join(_tmp_dir, "state.snapshot")
+os.environ.pop("DATABASE_URL", None)
+os.environ.pop("EFFECT_RULES_PATH", None)
+
+import pytest
+
+
+class FakeClock:
+    """手動で進める時計（UNIX秒を返す。AggregationEngine の clock に渡す）"""
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """一時ディレクトリのSQLiteにスキーマを作成し、サーバーの接続先をそこに向ける（パスを返す）"""
+    from app import database
+    path = tmp_path / "live_reaction.db"
+    monkeypatch.setattr(database, "DB_PATH", path)
+    database.init_database()
+    return path
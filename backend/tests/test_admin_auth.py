@@ -0,0 +1,32 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+
+# with を使わない（startup / shutdown のフックを実行しない）
+client = TestClient(main.app)
+
+
+@pytest.mark.parametrize("path", ["/admin/profile?seconds=0.01", "/admin/effect-rules/reload"])
+def test_admin_endpoints_reject_without_configured_token(monkeypatch, path):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    assert client.post(path, headers={"X-Admin-Token": ""}).status_code == 403
+    assert client.post(path).status_code == 403
+
+
+@pytest.mark.parametrize("path", ["/admin/profile?seconds=0.01", "/admin/effect-rules/reload"])
+def test_admin_endpoints_reject_wrong_token(monkeypatch, path):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    assert client.post(path).status_code == 403
+    assert client.post(path, headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+
+def test_reload_with_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    before = main.manager.aggregation_engine.rules
+    try:
+        response = client.post("/admin/effect-rules/reload", headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 200
+        assert response.json()["origin"] == "default"
+    finally:
+        main.manager.aggregation_engine.set_rules(before)
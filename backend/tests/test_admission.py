@@ -0,0 +1,69 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app import main
+from app.admission import MAX_FRAME_BYTES, AdmissionController, classify_message, is_oversize
+
+
+def test_oversize_counts_utf8_bytes():
+    assert not is_oversize("a" * 10, 10)
+    assert is_oversize("a" * 11, 10)
+    # 4文字だがUTF-8では12バイト
+    assert is_oversize("あいうえ", 10)
+
+
+def test_classify_parsed_type():
+    assert classify_message(None) == "reaction"
+    assert classify_message("reaction_delta") == "reaction"
+    assert classify_message("video_seek") == "video"
+    assert classify_message("manual_effect") == "control"
+    assert classify_message("unknown") == "control"
+    assert classify_message(["pong"]) == "control"
+
+
+def test_token_bucket_throttles_per_class():
+    admission = AdmissionController(limits={"reaction": (0, 2), "control": (0, 1)}, max_frame_bytes=100)
+    assert admission.admit(None)
+    assert admission.admit(None)
+    assert not admission.admit(None)
+    # 別の分類のバケットは消費しない
+    assert admission.admit("manual_effect")
+    assert admission.admit_frame("x" * 100)
+    assert not admission.admit_frame("x" * 101)
+
+
+def test_embedded_type_does_not_pick_another_bucket(monkeypatch):
+    monkeypatch.setattr(main, "ensure_user_exists", lambda *args: None)
+    # 集約ループ・ハートビートのタスクは起動しない
+    monkeypatch.setattr(main.manager, "aggregation_task", object())
+    monkeypatch.setattr(main.manager, "heartbeat_task", object())
+    monkeypatch.setattr(main, "AdmissionController",
+                        lambda: AdmissionController(limits={"reaction": (0, 1), "sync": (0, 100), "control": (0, 1)}))
+    logged = []
+    monkeypatch.setattr(main, "log_reaction", lambda user_id, data: logged.append(data))
+    client = TestClient(main.app)
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_text(json.dumps({"userId": "u0", "experimentGroup": "control2"}))
+        assert websocket.receive_json()["type"] == "connection_established"
+        # 入れ子の "type": "pong" を埋め込んでも、リアクションのバケットを消費する
+        for _ in range(3):
+            websocket.send_text(json.dumps({"meta": {"type": "pong"}, "states": {}, "events": {}}))
+    assert len(logged) == 1
+
+
+def test_oversized_handshake_is_rejected_before_parsing(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("サイズ上限を超えたフレームをパースした")
+
+    monkeypatch.setattr(main, "json", SimpleNamespace(loads=fail))
+    client = TestClient(main.app)
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_text(json.dumps({"userId": "u0", "padding": "x" * MAX_FRAME_BYTES}))
+        with pytest.raises(WebSocketDisconnect) as excinfo:
+            websocket.receive_json()
+    assert excinfo.value.code == 1009
+
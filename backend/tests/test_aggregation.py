@@ -0,0 +1,65 @@
+import random
+
+from app.aggregation import AggregationEngine
+
+
+def sample(now_ms, hand_up=False):
+    return {'timestamp': now_ms, 'states': {'isHandUp': hand_up}, 'events': {}}
+
+
+def make_engine(clock, **kwargs):
+    options = dict(verbose=False, sampling_user_threshold=500, sample_size=200, rng=random.Random(0))
+    options.update(kwargs)
+    return AggregationEngine(clock=clock, **options)
+
+
+def test_sampling_mode_counts_only_active_users(clock):
+    engine = make_engine(clock)
+    # 過去の視聴者600人（しきい値を超える）
+    for i in range(600):
+        engine.update_user_data(f"past{i}", sample(clock() * 1000))
+    engine.aggregate()
+    assert engine.sampling
+
+    # 1分後、ライブの視聴者は10人（4人が手を挙げている）
+    clock.advance(60)
+    for i in range(10):
+        engine.update_user_data(f"live{i}", sample(clock() * 1000, hand_up=i < 4))
+
+    effect = engine.aggregate()
+    assert not engine.sampling
+    assert effect is not None and effect['effectType'] == 'cheer'
+
+    effect = engine.aggregate()
+    assert effect['debug']['mode'] == 'exact'
+    assert effect['debug']['activeUsers'] == 10
+
+
+def test_sampling_estimate_uses_active_population(clock):
+    engine = make_engine(clock, sample_size=20)
+    for i in range(600):
+        engine.update_user_data(f"past{i}", sample(clock() * 1000))
+    clock.advance(10)
+    for i in range(100):
+        engine.update_user_data(f"live{i}", sample(clock() * 1000, hand_up=True))
+
+    metrics = engine.estimate_window_metrics(clock() * 1000)
+    assert metrics['activeUsers'] == 100
+    assert metrics['sampling']['populationUsers'] == 100
+    assert metrics['sampling']['sampledActiveUsers'] == 20
+    assert metrics['ratioState']['isHandUp'] == 1.0
+
+
+def test_stale_users_are_evicted(clock):
+    engine = make_engine(clock, stale_user_ms=30000)
+    engine.update_user_data("gone", dict(sample(clock() * 1000), hasMicrophone=True))
+    clock.advance(20)
+    engine.update_user_data("live", sample(clock() * 1000))
+    engine.aggregate()
+    assert set(engine.user_data) == {"gone", "live"}
+
+    clock.advance(15)
+    engine.update_user_data("live", sample(clock() * 1000))
+    engine.aggregate()
+    assert set(engine.user_data) == {"live"}
+    assert "gone" not in engine.user_has_microphone
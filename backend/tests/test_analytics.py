@@ -0,0 +1,112 @@
+import asyncio
+import sqlite3
+import threading
+
+from app.analytics import AnalyticsCache, compute_analytics, parse_sections
+from app.report import ReportFilter
+
+
+def counting(value):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"value": value}
+    return compute, calls
+
+
+def test_cache_hit_miss_and_invalidate():
+    async def run():
+        cache = AnalyticsCache(max_entries=4, ttl=60)
+        compute, calls = counting(1)
+        assert await cache.get("k", compute) == ({"value": 1}, False)
+        assert await cache.get("k", compute) == ({"value": 1}, True)
+        cache.invalidate()
+        assert await cache.get("k", compute) == ({"value": 1}, False)
+        return calls
+
+    assert len(asyncio.run(run())) == 2
+
+
+def test_expired_entries_are_recomputed():
+    async def run():
+        cache = AnalyticsCache(ttl=0)
+        compute, calls = counting(1)
+        await cache.get("k", compute)
+        await cache.get("k", compute)
+        return calls
+
+    assert len(asyncio.run(run())) == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    async def run():
+        cache = AnalyticsCache(max_entries=2, ttl=60)
+        for key in ("a", "b"):
+            await cache.get(key, counting(key)[0])
+        await cache.get("a", counting("a")[0])  # a を最近使ったものにする
+        await cache.get("c", counting("c")[0])
+        return list(cache.entries)
+
+    assert asyncio.run(run()) == ["a", "c"]
+
+
+def test_concurrent_requests_share_one_computation():
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return {"value": 1}
+
+    async def run():
+        cache = AnalyticsCache(ttl=60)
+        first = asyncio.create_task(cache.get("k", slow))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(cache.get("k", slow))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await first, await second
+
+    first, second = asyncio.run(run())
+    assert first == ({"value": 1}, False)
+    assert second == ({"value": 1}, True)
+    assert len(calls) == 1
+
+
+def test_result_computed_before_invalidation_is_not_stored():
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return {"value": "stale"}
+
+    async def run():
+        cache = AnalyticsCache(ttl=60)
+        task = asyncio.create_task(cache.get("k", slow))
+        await asyncio.sleep(0.05)
+        cache.invalidate()  # 計算中にセッションが完了した
+        release.set()
+        await task
+        return cache.entries
+
+    assert len(asyncio.run(run())) == 0
+
+
+def test_compute_analytics_groups_effects(sqlite_db):
+    conn = sqlite3.connect(sqlite_db)
+    conn.execute("INSERT INTO users (id, experiment_group, created_at) VALUES ('u1', 'experiment', 0)")
+    conn.execute("INSERT INTO sessions (session_id, user_id, video_id, experiment_group, started_at, completed_at, "
+                 "is_completed) VALUES ('s1', 'u1', 'v1', 'experiment', 0, 60000, 1)")
+    for effect_type in ("sparkle", "sparkle", "cheer"):
+        conn.execute("INSERT INTO effects_log (session_id, timestamp, effect_type, intensity, duration_ms) "
+                     "VALUES ('s1', 1000, ?, 0.5, 2000)", (effect_type,))
+    conn.commit()
+
+    result = compute_analytics(conn, "sqlite", parse_sections("effects"), ReportFilter(None, None))
+    counts = {(record['experiment_group'], record['effect_type']): record['count']
+              for record in result['sections']['effects']}
+    assert counts == {("experiment", "sparkle"): 2, ("experiment", "cheer"): 1}
+    assert compute_analytics(conn, "sqlite", ["effects"], ReportFilter(None, None), group="control1")['sections'] == {"effects": []}
+    conn.close()
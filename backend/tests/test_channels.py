@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+from app import main
+from app.channels import DEFAULT_SUBSCRIPTIONS, EncodedMessage, parse_subscriptions
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def make_manager(subscriptions):
+    """user_id -> 購読チャンネル（None は "subscribe" を送らないクライアント）の接続を登録する"""
+    manager = main.ConnectionManager()
+    sockets = {}
+    for user_id, channels in subscriptions.items():
+        sockets[user_id] = manager.active_connections[user_id] = FakeWebSocket()
+        manager.user_groups[user_id] = 'experiment'
+        if channels is not None:
+            manager.subscriptions[user_id] = parse_subscriptions(channels)
+    return manager, sockets
+
+
+def test_parse_subscriptions_ignores_unknown_names():
+    assert parse_subscriptions(["effects", "nope", "sync"]) == {"effects", "sync"}
+    assert parse_subscriptions([]) == frozenset()
+    assert parse_subscriptions(None) == DEFAULT_SUBSCRIPTIONS
+    assert parse_subscriptions("effects") == DEFAULT_SUBSCRIPTIONS
+
+
+def test_unsubscribed_channels_are_filtered_out():
+    manager, sockets = make_manager({"effects_only": ["effects"], "sync_only": ["sync"],
+                                     "with_debug": ["effects", "debug"], "legacy": None})
+    effect = {"type": "effect", "effectType": "cheer", "intensity": 0.5, "debug": {"isHandUp": 0.6}}
+    seek = {"type": "video_seek", "currentTime": 12.0}
+
+    async def run():
+        await manager.broadcast_to_group(effect, 'experiment')
+        await manager.broadcast_to_group(seek, 'experiment')
+        await manager.send_personal_message({"type": "data_received"}, "effects_only")
+
+    asyncio.run(run())
+
+    assert sockets["effects_only"].sent == [{"type": "effect", "effectType": "cheer", "intensity": 0.5}]
+    assert sockets["sync_only"].sent == [seek]
+    assert sockets["with_debug"].sent == [effect]
+    assert sockets["legacy"].sent == [effect, seek]
+
+
+def test_unmapped_message_types_are_always_delivered():
+    manager, sockets = make_manager({"nothing": [], "effects_only": ["effects"]})
+    messages = [{"type": "ping"}, {"type": "session_created", "sessionId": "s1"}, {"no_type": True}]
+
+    async def run():
+        for message in messages:
+            await manager.broadcast(message)
+        await manager.send_personal_message({"type": "pong"}, "nothing")
+
+    asyncio.run(run())
+
+    assert sockets["nothing"].sent == messages + [{"type": "pong"}]
+    assert sockets["effects_only"].sent == messages
+
+
+def test_encoded_message_serializes_once_per_debug_variant():
+    encoded = EncodedMessage({"type": "effect", "debug": {"x": 1}})
+
+    plain = encoded.text(frozenset({"effects"}))
+    assert encoded.text(frozenset({"effects", "sync"})) is plain
+    assert json.loads(encoded.text(DEFAULT_SUBSCRIPTIONS)) == {"type": "effect", "debug": {"x": 1}}
+    assert len(encoded._texts) == 2
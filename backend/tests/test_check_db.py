@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+from app.reaction_store import KeyCache, insert_reaction
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def add_rows(path):
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (id, experiment_group, created_at) VALUES ('u1', 'experiment', 0)")
+    conn.execute("INSERT INTO users (id, experiment_group, created_at) VALUES ('u2', 'control1', 0)")
+    conn.execute("INSERT INTO sessions (session_id, user_id, video_id, experiment_group, started_at, completed_at, "
+                 "is_completed) VALUES ('s1', 'u1', 'v1', 'experiment', 0, 60000, 1)")
+    keys = KeyCache()
+    for i in range(4):
+        insert_reaction(conn, "sqlite", keys, "s1", "u1", i * 1000, float(i), {'isSmiling': i < 3}, {'nod': 1})
+    insert_reaction(conn, "sqlite", keys, None, "u2", 5000, None, {}, {'clap': 2})
+    for effect_type in ('sparkle', 'sparkle', 'cheer'):
+        conn.execute("INSERT INTO effects_log (session_id, timestamp, effect_type, intensity, duration_ms) "
+                     "VALUES ('s1', 2000, ?, 0.5, 2000)", (effect_type,))
+    conn.commit()
+    conn.close()
+
+
+def create_legacy_db(path):
+    """session_id / sessions テーブルのない古いスキーマ"""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE users (id TEXT PRIMARY KEY, experiment_group TEXT NOT NULL, created_at INTEGER NOT NULL);
+        CREATE TABLE reactions_log (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL,
+            timestamp INTEGER NOT NULL, is_smiling BOOLEAN, is_surprised BOOLEAN, is_concentrating BOOLEAN,
+            is_hand_up BOOLEAN, nod_count INTEGER DEFAULT 0, sway_vertical_count INTEGER DEFAULT 0,
+            cheer_count INTEGER DEFAULT 0, clap_count INTEGER DEFAULT 0);
+        CREATE TABLE effects_log (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp INTEGER NOT NULL,
+            effect_type TEXT NOT NULL, intensity REAL, duration_ms INTEGER);
+        INSERT INTO users VALUES ('u1', 'experiment', 0);
+        INSERT INTO reactions_log (user_id, timestamp, is_smiling, clap_count) VALUES ('u1', 1000, 1, 3);
+        INSERT INTO effects_log (timestamp, effect_type, intensity, duration_ms) VALUES (1000, 'sparkle', 0.5, 2000);
+    """)
+    conn.close()
+
+
+def run(args, cwd=BACKEND_DIR):
+    env = dict(os.environ, PYTHONPATH=str(BACKEND_DIR))
+    env.pop("DATABASE_URL", None)
+    return subprocess.run(args, cwd=cwd, env=env, capture_output=True, text=True, timeout=60)
+
+
+def records(stdout):
+    by_section = {}
+    for line in stdout.splitlines():
+        record = json.loads(line)
+        by_section.setdefault(record.pop("section"), []).append(record)
+    return by_section
+
+
+def test_check_db_reports_every_section(sqlite_db):
+    add_rows(sqlite_db)
+
+    result = run([sys.executable, "app/check_db.py", "--sqlite", str(sqlite_db), "--format", "json"])
+
+    assert result.returncode == 0, result.stderr
+    sections = records(result.stdout)
+    counts = {r["table_name"]: r["row_count"] for r in sections["table_counts"]}
+    assert counts["users"] == 2 and counts["reactions_log"] == 5 and counts["effects_log"] == 3
+    groups = {r["experiment_group"]: r for r in sections["reactions_by_group"]}
+    assert groups["experiment"]["samples"] == 4 and groups["experiment"]["smiling_rate"] == 0.75
+    assert groups["experiment"]["nod_total"] == 4 and groups["control1"]["clap_total"] == 2
+    [session] = sections["sessions"]
+    assert (session["session_id"], session["samples"], session["effects"]) == ("s1", 4, 3)
+    assert [(r["effect_type"], r["count"]) for r in sections["effects_by_type"]] == [("sparkle", 2), ("cheer", 1)]
+    assert sections["sessions_by_group"][0]["completion_rate"] == 1.0
+    assert sum(r["samples"] for r in sections["reaction_rates"]) == 5
+
+
+def test_check_db_skips_sections_missing_from_legacy_schema(tmp_path):
+    path = tmp_path / "legacy.db"
+    create_legacy_db(path)
+
+    result = run([sys.executable, "app/check_db.py", "--sqlite", str(path), "--format", "json"])
+
+    assert result.returncode == 0, result.stderr
+    sections = records(result.stdout)
+    assert "sessions" not in sections and "effects_by_group" not in sections
+    assert "sessions: スキップ" in result.stderr and "effects_by_group: スキップ" in result.stderr
+    counts = {r["table_name"]: r["row_count"] for r in sections["table_counts"]}
+    assert counts == {"users": 1, "reactions_log": 1, "effects_log": 1}
+    assert sections["reactions_by_group"][0]["clap_total"] == 3
+
+
+def test_check_db_sh_runs_summary_sections(tmp_path, sqlite_db):
+    add_rows(sqlite_db)
+    (tmp_path / "data").mkdir()
+    shutil.copy(sqlite_db, tmp_path / "data" / "live_reaction.db")
+
+    result = run(["bash", str(BACKEND_DIR / "check_db.sh"), "--format", "json"], cwd=tmp_path)
+
+    assert result.returncode == 0, result.stderr
+    assert set(records(result.stdout)) == {"table_counts", "users_by_group", "effects_by_type"}
+
+
+def test_check_db_sh_requires_database_file(tmp_path):
+    result = run(["bash", str(BACKEND_DIR / "check_db.sh")], cwd=tmp_path)
+
+    assert result.returncode == 1
+    assert "データベースファイルが見つかりません" in result.stdout
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app import main
+from app.aggregation import AggregationEngine
+from app.reaction_frames import ReactionFrameDecoder
+
+
+def make_manager(clock):
+    manager = main.ConnectionManager()
+    manager.aggregation_engine = AggregationEngine(clock=clock, verbose=False)
+    return manager
+
+
+def join(manager, clock, user_id, hand_up=False, claps=0):
+    """connect() の登録と最初のフレームの受信を再現する（集約ループのタスクは起動しない）"""
+    manager.active_connections[user_id] = object()
+    manager.user_groups[user_id] = 'experiment'
+    manager.frame_decoders[user_id] = ReactionFrameDecoder()
+    manager.last_seen[user_id] = 0.0
+    manager.known_users[user_id] = ('experiment', False)
+    manager.update_reaction_data(user_id, {
+        'timestamp': clock() * 1000,
+        'states': {'isHandUp': hand_up},
+        'events': {'clap': claps},
+        'hasMicrophone': claps > 0
+    })
+
+
+def test_disconnect_purges_per_user_state(clock):
+    manager = make_manager(clock)
+    engine = manager.aggregation_engine
+    join(manager, clock, "gone", hand_up=True, claps=3)
+    join(manager, clock, "stay")
+
+    manager.disconnect("gone")
+
+    assert "gone" not in engine.user_data
+    assert "gone" not in engine.user_has_microphone
+    assert "gone" not in manager.known_users
+    assert "gone" not in manager.frame_decoders
+    trigger = engine.early_trigger
+    assert "gone" not in trigger.user_states and "gone" not in trigger.last_seen
+    assert trigger.state_counts.get('isHandUp', 0) == 0
+    assert trigger.event_totals.get('clap', 0) == 0
+    assert trigger.microphone_users == 0
+    # 残ったユーザーだけで集約する
+    assert engine.compute_rule_metrics(clock() * 1000)['activeUsers'] == 1
+    assert engine.early_values()['isHandUp'] == 0.0
+
+
+def test_reaped_user_no_longer_counts(clock):
+    manager = make_manager(clock)
+    for i in range(3):
+        join(manager, clock, f"u{i}", hand_up=True)
+    for i in range(3):
+        manager.disconnect(f"u{i}")
+
+    assert manager.aggregation_engine.aggregate() is None
+    assert manager.aggregation_engine.early_values() is None
+
+
+def test_restart_disconnect_keeps_state_for_snapshot(clock):
+    manager = make_manager(clock)
+    join(manager, clock, "u0", hand_up=True)
+
+    manager.disconnect("u0", keep_state=True)
+
+    assert "u0" not in manager.active_connections
+    assert "u0" in manager.aggregation_engine.user_data
+    assert "u0" in manager.known_users
+
+
+def test_handshake_rejects_oversized_user_id():
+    client = TestClient(main.app)
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_text(json.dumps({"userId": "x" * (main.MAX_USER_ID_LENGTH + 1)}))
+        with pytest.raises(WebSocketDisconnect) as excinfo:
+            websocket.receive_json()
+    assert excinfo.value.code == 1008
+    assert "x" * (main.MAX_USER_ID_LENGTH + 1) not in main.manager.active_connections
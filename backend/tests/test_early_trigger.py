@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+from app import metrics
+from app.aggregation import AggregationEngine
+from app.early_trigger import EarlyTrigger
+from app.snapshot import apply_state, decode_state, encode_state
+
+CHEER = {"metric": "isHandUp", "source": "ratioState", "threshold": 0.5, "scale": 1.0, "effectType": "cheer"}
+START_MS = 1_700_000_000_000
+
+
+def hands(trigger, now_ms, raised, users=4):
+    """users 人のうち raised 人が手を挙げているサンプルを受信して判定する"""
+    for i in range(users):
+        trigger.observe(f"u{i}", {'isHandUp': i < raised}, {}, False, now_ms)
+    return trigger.evaluate([CHEER], now_ms)
+
+
+def test_fires_when_threshold_is_crossed():
+    trigger = EarlyTrigger(debounce_ms=3000)
+
+    assert hands(trigger, START_MS, raised=1) is None
+    rule, intensity, values = hands(trigger, START_MS + 100, raised=3)
+
+    assert rule is CHEER
+    assert intensity == 0.75 and values == {"isHandUp": 0.75}
+
+
+def test_does_not_fire_again_while_above_threshold():
+    trigger = EarlyTrigger(debounce_ms=1000)
+    assert hands(trigger, START_MS, raised=2) is not None
+
+    # デバウンスを過ぎても、越えたままの間は発動しない（継続はティックの集約に任せる）
+    for step in range(1, 6):
+        assert hands(trigger, START_MS + step * 500, raised=4) is None
+
+
+def test_crossing_within_debounce_is_suppressed():
+    trigger = EarlyTrigger(debounce_ms=3000)
+    before = metrics.get_counters().get("effects.early.debounced", 0)
+    assert hands(trigger, START_MS, raised=2) is not None
+
+    assert hands(trigger, START_MS + 500, raised=0) is None
+    assert hands(trigger, START_MS + 1000, raised=2) is None
+
+    assert metrics.get_counters()["effects.early.debounced"] == before + 1
+
+
+def test_rearms_after_dropping_below_threshold():
+    trigger = EarlyTrigger(debounce_ms=3000)
+    assert hands(trigger, START_MS, raised=2) is not None
+    assert hands(trigger, START_MS + 1000, raised=1) is None
+
+    # デバウンスの後に再び越えれば発動する
+    assert hands(trigger, START_MS + 3500, raised=3)[0] is CHEER
+    assert hands(trigger, START_MS + 4000, raised=3) is None
+
+
+def make_manager(clock):
+    return SimpleNamespace(aggregation_engine=AggregationEngine(clock=clock, verbose=False),
+                           known_users={}, last_random_effect_time=0.0)
+
+
+def reaction(now_ms, hand_up=False):
+    return {'timestamp': now_ms, 'states': {'isHandUp': hand_up}, 'events': {'clap': 0}}
+
+
+def test_restored_old_samples_do_not_trigger_early_effect(clock):
+    before = make_manager(clock)
+    for i in range(10):
+        before.aggregation_engine.update_user_data(f"u{i}", reaction(clock() * 1000, hand_up=True))
+    data = encode_state(before)
+
+    # 200秒後に再起動して復元
+    clock.advance(200)
+    after = make_manager(clock)
+    apply_state(after, decode_state(data))
+    engine = after.aggregation_engine
+
+    # 手を挙げていないユーザーのライブのフレーム1件では cheer は発動しない
+    engine.update_user_data("live", reaction(clock() * 1000))
+    assert engine.early_effect() is None
+    assert engine.aggregate() is None
@@ -0,0 +1,64 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.effect_coalescer import EffectCoalescer
+
+
+def effect(effect_type, timestamp, intensity=0.5):
+    return {"type": "effect", "effectType": effect_type, "intensity": intensity, "durationMs": 2000,
+            "timestamp": timestamp}
+
+
+def phase(message):
+    return message['phase'] if message else None
+
+
+def test_phases_for_a_running_effect():
+    coalescer = EffectCoalescer(tick_ms=1000, intensity_epsilon=0.15, extend_ms=3000)
+
+    assert phase(coalescer.coalesce('experiment', effect('cheer', 0))) == 'start'
+    # 同じ種類・強度で、まだ1ティック以上再生が残っている
+    assert coalescer.coalesce('experiment', effect('cheer', 500)) is None
+    # 次のティックまでに終わってしまう
+    extend = coalescer.coalesce('experiment', effect('cheer', 1000))
+    assert phase(extend) == 'extend' and extend['durationMs'] == 3000
+    assert phase(coalescer.coalesce('experiment', effect('cheer', 1500, intensity=0.9))) == 'update'
+    assert phase(coalescer.coalesce('experiment', effect('sparkle', 2000))) == 'switch'
+    # 再生が終わった後は start からやり直す
+    assert phase(coalescer.coalesce('experiment', effect('sparkle', 10_000))) == 'start'
+    assert coalescer.stats == {"start": 2, "switch": 1, "update": 1, "extend": 1, "suppressed": 1}
+
+
+def test_rooms_are_tracked_independently():
+    coalescer = EffectCoalescer()
+    coalescer.coalesce('experiment', effect('cheer', 0))
+    assert phase(coalescer.coalesce('debug', effect('cheer', 0))) == 'start'
+
+    coalescer.observe('control1', effect('wave', 0))
+    assert coalescer.coalesce('control1', effect('wave', 100)) is None
+    coalescer.reset('control1')
+    assert phase(coalescer.coalesce('control1', effect('wave', 200))) == 'start'
+
+
+def test_invalid_manual_effect_is_ignored(monkeypatch):
+    monkeypatch.setattr(main, "ensure_user_exists", lambda *args: None)
+    # 集約ループ・ハートビートのタスクは起動しない
+    monkeypatch.setattr(main.manager, "aggregation_task", object())
+    monkeypatch.setattr(main.manager, "heartbeat_task", object())
+    monkeypatch.setattr(main.manager, "effect_coalescer", EffectCoalescer())
+    logged = []
+    monkeypatch.setattr(main, "log_effect", logged.append)
+    client = TestClient(main.app)
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_text(json.dumps({"userId": "debugger", "experimentGroup": "debug"}))
+        assert websocket.receive_json()["type"] == "connection_established"
+        for bad in ({"durationMs": "abc"}, {"durationMs": None}, {"intensity": "high"}, {"durationMs": -1}):
+            websocket.send_text(json.dumps(dict({"type": "manual_effect", "effectType": "sparkle"}, **bad)))
+        websocket.send_text(json.dumps({"type": "manual_effect", "effectType": "sparkle", "durationMs": 1500}))
+        received = websocket.receive_json()
+    assert received["effectType"] == "sparkle" and received["durationMs"] == 1500
+    assert len(logged) == 1
+    running = main.manager.effect_coalescer.running['debug']
+    assert running["endsAt"] == received["timestamp"] + 1500
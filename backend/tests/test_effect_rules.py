@@ -0,0 +1,40 @@
+import pytest
+
+from app.effect_rules import DEFAULT_RULE_SET, compile_rules
+
+
+def rule(metric, threshold, priority, **extra):
+    return dict({"metric": metric, "source": "ratioState", "threshold": threshold, "priority": priority,
+                 "effectType": metric}, **extra)
+
+
+def test_rules_are_evaluated_in_priority_order():
+    rule_set = compile_rules([rule("isSmiling", 0.3, 2), rule("isHandUp", 0.3, 1, scale=0.5)])
+    matched, intensity = rule_set.evaluate({"isSmiling": 0.9, "isHandUp": 0.4}, {})
+    assert matched['metric'] == "isHandUp"
+    assert intensity == pytest.approx(0.8)
+    assert rule_set.evaluate({"isSmiling": 0.1}, {}) is None
+
+
+def test_only_referenced_metrics_are_computed():
+    rule_set = compile_rules([rule("isHandUp", 0.3, 1),
+                              {"metric": "clap", "source": "densityEvent", "threshold": 0.1, "effectType": "clap"}])
+    assert rule_set.state_metrics == frozenset({"isHandUp"})
+    assert rule_set.event_metrics == frozenset({"clap"})
+
+
+@pytest.mark.parametrize("rules", [
+    [],
+    [{"metric": "isHandUp", "source": "ratioState", "threshold": 0.3}],
+    [rule("isHandUp", 0.3, 1, source="unknown")],
+    [rule("isHandUp", 0.3, 1, scale=0)],
+    [rule("isHandUp", 0.3, 1, windowMs=10 ** 9)],
+    [rule("isHandUp", 0.3, 1), rule("isHandUp", 0.5, 2)],
+])
+def test_invalid_rule_tables_are_rejected(rules):
+    with pytest.raises(ValueError):
+        compile_rules(rules)
+
+
+def test_default_rules_mark_early_rules():
+    assert [r['metric'] for r in DEFAULT_RULE_SET.early_rules] == ["isHandUp", "isSurprised", "clap"]
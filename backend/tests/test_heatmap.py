@@ -0,0 +1,98 @@
+import sqlite3
+
+from app.heatmap import SAMPLES_KEY, HeatmapIndex, load_heatmap, rebuild_heatmap
+from app.reaction_store import EVENT_MAX, KeyCache, insert_reaction
+
+SESSIONS = (
+    # (session_id, user_id, video_id, group)
+    ("s1", "u1", "v1", "experiment"),
+    ("s2", "u2", "v1", "control1"),
+    ("s3", "u3", "", "experiment"),  # 動画のないセッション
+)
+
+
+def setup_sessions(conn):
+    for session_id, user_id, video_id, group in SESSIONS:
+        conn.execute("INSERT INTO users (id, experiment_group, created_at) VALUES (?, ?, 0)", (user_id, group))
+        conn.execute("INSERT INTO sessions (session_id, user_id, video_id, experiment_group, started_at) "
+                     "VALUES (?, ?, ?, ?, 0)", (session_id, user_id, video_id, group))
+    conn.commit()
+
+
+def record(conn, keys, index, session_id, user_id, video_time, states, events):
+    """log_reaction と同じく、格納と同時に索引の差分に数える"""
+    insert_reaction(conn, "sqlite", keys, session_id, user_id, 1000, video_time, states, events)
+    index.observe(session_id, video_time, states, events)
+
+
+def record_samples(conn, index):
+    keys = KeyCache()
+    for i in range(30):
+        video_time = i * 0.4
+        record(conn, keys, index, "s1", "u1", video_time, {'isSmiling': i % 3 == 0, 'isHandUp': i > 20},
+               {'clap': i % 4, 'nod': 1})
+        record(conn, keys, index, "s2", "u2", video_time, {'isSmiling': True}, {'clap': 100})
+        record(conn, keys, index, "s3", "u3", video_time, {'isSmiling': True}, {})
+        record(conn, keys, index, "gone", "u1", video_time, {'isSmiling': True}, {})
+    # 再生位置のないサンプルは数えない
+    record(conn, keys, index, "s1", "u1", None, {'isSmiling': True}, {})
+    conn.commit()
+
+
+def test_incremental_flush_matches_rebuild(sqlite_db):
+    conn = sqlite3.connect(sqlite_db)
+    setup_sessions(conn)
+    index = HeatmapIndex(bucket_seconds=1)
+    index.register_session("s1", "v1", "experiment")
+
+    # 2回に分けて加算する
+    record_samples(conn, index)
+    assert index.flush(conn, "sqlite", index.take_pending()) > 0
+    record_samples(conn, index)
+    index.flush(conn, "sqlite", index.take_pending())
+    incremental = load_heatmap(conn.cursor(), "sqlite", "v1", index_bucket_seconds=1)
+
+    rebuild_heatmap(conn, "sqlite", bucket_seconds=1)
+    rebuilt = load_heatmap(conn.cursor(), "sqlite", "v1", index_bucket_seconds=1)
+
+    assert incremental == rebuilt
+    assert set(rebuilt["groups"]) == {"experiment", "control1"}
+    first = rebuilt["groups"]["control1"][0]
+    # 0〜1秒に3サンプル × 2回。イベントは格納時と同じく上限で飽和する
+    assert first["samples"] == 6 and first["states"] == {"isSmiling": 6}
+    assert first["events"] == {"clap": 6 * EVENT_MAX}
+    conn.close()
+
+
+def test_unknown_sessions_are_resolved_from_the_database(sqlite_db):
+    conn = sqlite3.connect(sqlite_db)
+    setup_sessions(conn)
+    index = HeatmapIndex(bucket_seconds=1)
+    for session_id in ("s2", "s3", "gone"):
+        index.observe(session_id, 2.5, {'isSmiling': True}, {})
+
+    assert index.flush(conn, "sqlite", index.take_pending()) == 2
+
+    # 登録していないセッションはDBから解決し、動画のない・存在しないセッションは数えない
+    assert index.sessions == {"s2": ("v1", "control1"), "s3": None, "gone": None}
+    rows = conn.execute("SELECT video_id, bucket, experiment_group, reaction_type, value FROM video_heatmap "
+                        "ORDER BY reaction_type").fetchall()
+    assert rows == [("v1", 2, "control1", SAMPLES_KEY, 1), ("v1", 2, "control1", "isSmiling", 1)]
+    conn.close()
+
+
+def test_load_heatmap_merges_buckets(sqlite_db):
+    conn = sqlite3.connect(sqlite_db)
+    setup_sessions(conn)
+    index = HeatmapIndex(bucket_seconds=1)
+    for video_time in (0.5, 1.5, 2.5, 3.5, 4.5):
+        index.observe("s1", video_time, {}, {'nod': 1})
+    index.flush(conn, "sqlite", index.take_pending())
+
+    heatmap = load_heatmap(conn.cursor(), "sqlite", "v1", group="experiment", bucket_seconds=2,
+                           index_bucket_seconds=1)
+
+    assert heatmap["bucketSeconds"] == 2
+    assert [(b["videoTime"], b["samples"], b["events"]) for b in heatmap["groups"]["experiment"]] == [
+        (0, 2, {"nod": 2}), (2, 2, {"nod": 2}), (4, 1, {"nod": 1})]
+    conn.close()
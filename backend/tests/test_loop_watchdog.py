@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from app.loop_watchdog import LoopWatchdog, percentile
+
+
+def blocking_export():
+    time.sleep(0.3)
+
+
+def test_blocking_callback_records_lag_and_active_task():
+    watchdog = LoopWatchdog(interval_ms=10, threshold_ms=50)
+
+    async def handler():
+        watchdog.set_activity("ws:session_create")
+        await asyncio.sleep(0.05)
+        blocking_export()
+
+    async def run():
+        watchdog.start()
+        try:
+            await asyncio.sleep(0.05)
+            await asyncio.create_task(handler())
+            # 停止後のハートビートで最終的な長さが記録されるまで待つ
+            await asyncio.sleep(0.1)
+        finally:
+            watchdog.stop()
+
+    asyncio.run(run())
+
+    summary = watchdog.summary()
+    assert summary["stallCount"] == 1
+    assert summary["lagMs"]["max"] >= 250
+    [stall] = summary["recentStalls"]
+    assert stall["activity"] == "ws:session_create"
+    assert stall["ongoing"] is False and stall["lagMs"] >= 250
+    assert any("blocking_export" in line for line in stall["stack"])
+    assert "stack" not in watchdog.summary(include_stacks=False)["recentStalls"][0]
+
+
+def test_short_pauses_are_not_recorded_as_stalls():
+    watchdog = LoopWatchdog(interval_ms=10, threshold_ms=200)
+
+    async def run():
+        watchdog.start()
+        try:
+            for _ in range(5):
+                await asyncio.sleep(0.02)
+                time.sleep(0.01)
+        finally:
+            watchdog.stop()
+
+    asyncio.run(run())
+
+    summary = watchdog.summary()
+    assert summary["samples"] > 0
+    assert summary["stallCount"] == 0 and summary["recentStalls"] == []
+
+
+def test_percentile_uses_nearest_rank():
+    values = sorted(float(v) for v in range(1, 101))
+
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 90) == 0.0
@@ -0,0 +1,88 @@
+import sqlite3
+
+import pytest
+
+from app import database, migrate
+from app.reaction_store import KeyCache, insert_reaction
+
+
+def make_db(path, monkeypatch, users=0):
+    """サーバーと同じスキーマのSQLiteを作り、users人分のリアクションを記録する"""
+    monkeypatch.setattr(database, "DB_PATH", path)
+    database.init_database()
+    conn = sqlite3.connect(path)
+    keys = KeyCache()
+    for i in range(users):
+        conn.execute("INSERT INTO users (id, experiment_group, created_at) VALUES (?, 'experiment', 0)", (f"u{i}",))
+        for t in range(3):
+            insert_reaction(conn, "sqlite", keys, None, f"u{i}", 1000 * t, None, {'isSmiling': True}, {'nod': t})
+    conn.commit()
+    return conn
+
+
+def sample_rows(conn):
+    return conn.execute("SELECT id, user_key, timestamp, states, events FROM reaction_samples ORDER BY id").fetchall()
+
+
+def run(source, target, tmp_path, chunk_size=2):
+    label = migrate.source_label(str(tmp_path / "source.db"))
+    return [migrate.migrate_table(source, "sqlite", target, "sqlite", table, chunk_size, label)[0]
+            for table in migrate.TABLE_SPECS]
+
+
+def test_interrupted_migration_resumes_from_source_watermark(tmp_path, monkeypatch, capsys):
+    source = make_db(tmp_path / "source.db", monkeypatch, users=4)
+    target = make_db(tmp_path / "target.db", monkeypatch)
+
+    # reaction_samples の2チャンク目で中断する
+    write_chunk = migrate.write_chunk
+    calls = []
+
+    def failing(conn, db_type, table, columns, rows, spec, source_name=None):
+        if table == "reaction_samples":
+            calls.append(len(rows))
+            if len(calls) == 2:
+                raise RuntimeError("connection lost")
+        return write_chunk(conn, db_type, table, columns, rows, spec, source_name)
+
+    monkeypatch.setattr(migrate, "write_chunk", failing)
+    with pytest.raises(RuntimeError):
+        run(source, target, tmp_path)
+    assert len(sample_rows(target)) == 2
+
+    monkeypatch.setattr(migrate, "write_chunk", write_chunk)
+    capsys.readouterr()
+    run(source, target, tmp_path)
+    assert sample_rows(target) == sample_rows(source)
+    assert "id > 2 から再開（転送済みとして 2行をスキップ）" in capsys.readouterr().out
+
+    # 転送済みなら何も転送しない
+    counts = dict(zip(migrate.TABLE_SPECS, run(source, target, tmp_path)))
+    assert counts["reaction_samples"] == 0 and counts["user_keys"] == 0
+    assert sample_rows(target) == sample_rows(source)
+
+
+def test_non_empty_target_is_refused(tmp_path, monkeypatch, capsys):
+    source = make_db(tmp_path / "source.db", monkeypatch, users=2)
+    target = make_db(tmp_path / "target.db", monkeypatch, users=1)
+    before = sample_rows(target)
+
+    with pytest.raises(ValueError):
+        run(source, target, tmp_path)
+    assert sample_rows(target) == before
+    # 同じidのusersは既存の行を残し、スキップした行数を表示する
+    assert "1行をスキップ" in capsys.readouterr().out
+
+    source.close()
+    target.close()
+    assert migrate.main(["--source", str(tmp_path / "source.db"), "--target", str(tmp_path / "target.db")]) == 1
+
+
+def test_legacy_source_explains_conversion(tmp_path, capsys):
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE reactions_log (id INTEGER PRIMARY KEY, user_id TEXT, timestamp INTEGER)")
+    conn.close()
+
+    assert migrate.main(["--source", str(path), "--target", str(tmp_path / "target.db")]) == 1
+    assert f"python -m app.reaction_store --sqlite {path}" in capsys.readouterr().out
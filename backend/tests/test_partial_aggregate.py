@@ -0,0 +1,35 @@
+from app.aggregation import AggregationEngine
+from app.partial_aggregate import PartialAggregate, merge_partials
+
+
+def fill(engine, clock, users=6):
+    now_ms = clock() * 1000
+    for u in range(users):
+        engine.update_user_data(f"u{u}", {
+            'timestamp': now_ms,
+            'states': {'isHandUp': u % 2 == 0, 'isSmiling': u < 2},
+            'events': {'clap': u, 'nod': 1},
+            'hasMicrophone': u < 4
+        })
+
+
+def test_shard_partials_merge_to_whole_population(clock):
+    engine = AggregationEngine(clock=clock, verbose=False)
+    fill(engine, clock)
+    whole = engine.compute_partial()
+    shards = [engine.compute_partial(user_ids=["u0", "u1", "u2"]),
+              engine.compute_partial(user_ids=["u3", "u4", "u5", "missing"])]
+
+    assert merge_partials(shards) == whole
+    assert merge_partials(shards).to_metrics() == whole.to_metrics()
+
+
+def test_partial_round_trips_through_dict(clock):
+    engine = AggregationEngine(clock=clock, verbose=False)
+    fill(engine, clock)
+    partial = engine.compute_partial()
+    assert PartialAggregate.from_dict(partial.to_dict()) == partial
+
+
+def test_empty_partials_have_no_metrics():
+    assert merge_partials([]).to_metrics() is None
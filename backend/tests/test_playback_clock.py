@@ -0,0 +1,64 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.playback_clock import PLAYBACK_MODEL_MAX_AGE, PlaybackClock, parse_playback_time
+
+
+def test_position_is_extrapolated_while_playing():
+    clock = PlaybackClock()
+    clock.update('video_play', 10.0, now=100.0)
+    assert clock.current_position(now=102.5) == pytest.approx(12.5)
+
+    # 定期報告で基準を取り直す
+    clock.update('video_position', 13.0, is_playing=True, now=103.0)
+    assert clock.current_position(now=104.0) == pytest.approx(14.0)
+
+
+def test_position_freezes_on_pause():
+    clock = PlaybackClock()
+    clock.update('video_play', 10.0, now=100.0)
+    clock.update('video_pause', 12.0, now=102.0)
+    assert clock.current_position(now=110.0) == 12.0
+
+    # シークは再生状態を変えない
+    clock.update('video_seek', 30.0, now=111.0)
+    assert clock.current_position(now=120.0) == 30.0
+    assert not clock.is_playing
+
+
+def test_stale_model_falls_back_to_host():
+    clock = PlaybackClock()
+    assert clock.max_age == PLAYBACK_MODEL_MAX_AGE
+    assert not clock.is_fresh(now=0.0)
+    clock.update('video_play', 0.0, now=100.0)
+    assert clock.is_fresh(now=100.0 + PLAYBACK_MODEL_MAX_AGE)
+    assert not clock.is_fresh(now=100.0 + PLAYBACK_MODEL_MAX_AGE + 0.1)
+    assert not clock.describe(now=100.0 + PLAYBACK_MODEL_MAX_AGE + 0.1)["fresh"]
+
+
+@pytest.mark.parametrize("value", [None, "abc", "12", True, float('nan'), float('inf'), [1]])
+def test_invalid_current_time_is_rejected(value):
+    assert parse_playback_time(value) is None
+
+
+def test_host_survives_invalid_current_time(monkeypatch):
+    monkeypatch.setattr(main, "ensure_user_exists", lambda *args: None)
+    monkeypatch.setattr(main.manager, "playback_clocks", {})
+    # 集約ループ・ハートビートのタスクは起動しない
+    monkeypatch.setattr(main.manager, "aggregation_task", object())
+    monkeypatch.setattr(main.manager, "heartbeat_task", object())
+    client = TestClient(main.app)
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_text(json.dumps({"userId": "host", "experimentGroup": "experiment", "isHost": True}))
+        assert websocket.receive_json()["type"] == "connection_established"
+        websocket.send_text(json.dumps({"type": "video_position", "currentTime": None, "isPlaying": False}))
+        websocket.send_text(json.dumps({"type": "video_seek", "currentTime": "abc"}))
+        websocket.send_text(json.dumps({"type": "video_position", "currentTime": 7.0, "isPlaying": False}))
+        websocket.send_text(json.dumps({"type": "time_sync_request"}))
+        response = websocket.receive_json()
+    assert response["type"] == "time_sync_response"
+    assert response["source"] == "server"
+    assert response["currentTime"] == 7.0
@@ -0,0 +1,54 @@
+from app.reaction_frames import EVENT_KEYS, ReactionFrameDecoder
+
+
+def full_frame(seq, **states):
+    return {"seq": seq, "timestamp": 1000 + seq, "states": states, "events": {}}
+
+
+def delta_frame(seq, states=None, events=None):
+    return {"type": "reaction_delta", "seq": seq, "states": states or {}, "events": events or {}}
+
+
+def test_delta_applies_on_top_of_full_frame():
+    decoder = ReactionFrameDecoder()
+    decoder.decode(full_frame(0, isSmiling=True))
+
+    sample, needs_resync = decoder.decode(delta_frame(1, {"isHandUp": True}, {"nod": 2}))
+
+    assert not needs_resync
+    assert sample['states'] == {'isSmiling': True, 'isSurprised': False, 'isConcentrating': False, 'isHandUp': True}
+    assert sample['events'] == dict({key: 0 for key in EVENT_KEYS}, nod=2)
+    assert 'type' not in sample and 'seq' not in sample
+
+
+def test_out_of_order_delta_does_not_overwrite_newer_state():
+    decoder = ReactionFrameDecoder()
+    decoder.decode(full_frame(0))
+    decoder.decode(delta_frame(2, {"isSmiling": False}, {"clap": 1}))
+
+    # 遅れて届いた seq=1 の state は捨て、イベントは数える
+    sample, _ = decoder.decode(delta_frame(1, {"isSmiling": True}, {"clap": 3}))
+    assert sample['states']['isSmiling'] is False
+    assert sample['events']['clap'] == 3
+
+
+def test_delta_before_full_frame_requests_resync_once():
+    decoder = ReactionFrameDecoder()
+    sample, needs_resync = decoder.decode(delta_frame(0, {"isHandUp": True}))
+    assert needs_resync
+    assert sample['states']['isHandUp'] is True and sample['states']['isSmiling'] is False
+
+    _, needs_resync = decoder.decode(delta_frame(1))
+    assert not needs_resync
+
+    decoder.decode(full_frame(2))
+    _, needs_resync = decoder.decode(delta_frame(3))
+    assert not needs_resync
+
+
+def test_full_frame_resets_missing_states():
+    decoder = ReactionFrameDecoder()
+    decoder.decode(full_frame(0, isSmiling=True, isHandUp=True))
+    sample, _ = decoder.decode(full_frame(1, isHandUp=True))
+    assert sample['states']['isSmiling'] is False
+    assert sample['states']['isHandUp'] is True
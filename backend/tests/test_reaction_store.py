@@ -0,0 +1,121 @@
+import sqlite3
+
+import pytest
+
+from app import metrics
+from app.reaction_store import (EVENT_MAX, KeyCache, ensure_packed_schema, insert_reaction, legacy_table_exists,
+                                pack_events, pack_states, unpack_events, unpack_states)
+from app.retention import run_retention
+
+LEGACY_SCHEMA = """
+    CREATE TABLE reactions_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT,
+        user_id TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        video_time REAL,
+        is_smiling BOOLEAN,
+        is_surprised BOOLEAN,
+        is_concentrating BOOLEAN,
+        is_hand_up BOOLEAN,
+        nod_count INTEGER DEFAULT 0,
+        sway_vertical_count INTEGER DEFAULT 0,
+        cheer_count INTEGER DEFAULT 0,
+        clap_count INTEGER DEFAULT 0
+    )
+"""
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    conn = sqlite3.connect(tmp_path / "legacy.db")
+    conn.execute(LEGACY_SCHEMA)
+    conn.executemany(
+        "INSERT INTO reactions_log (id, session_id, user_id, timestamp, video_time, is_smiling, is_hand_up, "
+        "nod_count, clap_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(10, "s1", "u1", 1000, 0.5, 1, 0, 2, 0), (11, "s1", "u2", 2000, 1.5, 0, 1, 0, 5), (12, None, "u1", 3000, None, 0, 0, 0, 0)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_pack_round_trip():
+    states = {'isSmiling': True, 'isSurprised': False, 'isConcentrating': False, 'isHandUp': True}
+    events = {'nod': 3, 'swayVertical': 0, 'cheer': 63, 'clap': 1, 'shakeHead': 0, 'swayHorizontal': 7}
+    assert unpack_states(pack_states(states)) == states
+    assert unpack_events(pack_events(events)) == events
+
+
+def test_pack_events_reports_saturation():
+    before = metrics.get_counters().get("reactions.events.saturated", 0)
+    assert unpack_events(pack_events({'clap': EVENT_MAX + 10}))['clap'] == EVENT_MAX
+    assert metrics.get_counters()["reactions.events.saturated"] == before + 1
+
+
+def test_schema_setup_does_not_convert_legacy_table(legacy_db):
+    assert ensure_packed_schema(legacy_db, "sqlite") == 0
+    assert legacy_table_exists(legacy_db.cursor(), "sqlite")
+    assert legacy_db.execute("SELECT COUNT(*) FROM reaction_samples").fetchone()[0] == 0
+
+
+def test_explicit_conversion_keeps_ids_and_values(legacy_db):
+    assert ensure_packed_schema(legacy_db, "sqlite", convert_legacy=True) == 3
+    assert not legacy_table_exists(legacy_db.cursor(), "sqlite")
+    rows = legacy_db.execute("SELECT id, session_id, user_id, is_smiling, is_hand_up, nod_count, clap_count "
+                             "FROM reactions_log ORDER BY id").fetchall()
+    assert rows == [(10, "s1", "u1", 1, 0, 2, 0), (11, "s1", "u2", 0, 1, 0, 5), (12, None, "u1", 0, 0, 0, 0)]
+
+
+def test_conversion_rejects_counts_above_event_max(legacy_db):
+    legacy_db.execute("UPDATE reactions_log SET clap_count = ? WHERE id = 11", (EVENT_MAX + 1,))
+    legacy_db.commit()
+    with pytest.raises(ValueError):
+        ensure_packed_schema(legacy_db, "sqlite", convert_legacy=True)
+    # 変換は巻き戻され、従来形式のテーブルが残る
+    assert legacy_table_exists(legacy_db.cursor(), "sqlite")
+    assert legacy_db.execute("SELECT COUNT(*) FROM reactions_log").fetchone()[0] == 3
+
+    assert ensure_packed_schema(legacy_db, "sqlite", convert_legacy=True, saturate=True) == 3
+    assert legacy_db.execute("SELECT clap_count FROM reactions_log WHERE id = 11").fetchone()[0] == EVENT_MAX
+
+
+def test_conversion_after_new_rows_assigns_new_ids(legacy_db):
+    # 以前のバージョンのサーバーが変換前に reaction_samples に記録した行
+    ensure_packed_schema(legacy_db, "sqlite")
+    keys = KeyCache()
+    keys.legacy_columns = set()
+    insert_reaction(legacy_db, "sqlite", keys, "s2", "u3", 9000, None, {'isHandUp': True}, {})
+    legacy_db.commit()
+
+    assert ensure_packed_schema(legacy_db, "sqlite", convert_legacy=True) == 3
+    rows = legacy_db.execute("SELECT user_id, timestamp FROM reactions_log ORDER BY id").fetchall()
+    assert rows == [("u3", 9000), ("u1", 1000), ("u2", 2000), ("u1", 3000)]
+
+
+def test_retention_refuses_unconverted_database(legacy_db, tmp_path):
+    legacy_db.execute("CREATE TABLE effects_log (id INTEGER PRIMARY KEY, session_id TEXT, timestamp INTEGER)")
+    with pytest.raises(ValueError):
+        run_retention(legacy_db, "sqlite", archive_dir=tmp_path)
+
+
+def test_server_keeps_writing_legacy_table_until_converted(tmp_path, monkeypatch):
+    from app import database, main
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(path)
+    conn.execute(LEGACY_SCHEMA)
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(database, "DB_PATH", path)
+    monkeypatch.setattr(main, "reaction_keys", KeyCache())
+    database.init_database()
+
+    main.log_reaction("u1", {'states': {'isHandUp': True}, 'events': {'clap': 2, 'shakeHead': 1}, 'sessionId': "s1"})
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT user_id, is_hand_up, clap_count FROM reactions_log").fetchall() == [("u1", 1, 2)]
+    assert conn.execute("SELECT COUNT(*) FROM reaction_samples").fetchone()[0] == 0
+
+    # 稼働中に変換すると、次の書き込みから reaction_samples に記録する
+    assert ensure_packed_schema(conn, "sqlite", convert_legacy=True) == 1
+    main.log_reaction("u2", {'states': {}, 'events': {'clap': 1}, 'sessionId': "s1"})
+    assert conn.execute("SELECT user_id, clap_count FROM reactions_log ORDER BY id").fetchall() == [("u1", 2), ("u2", 1)]
+    conn.close()
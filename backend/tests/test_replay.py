@@ -0,0 +1,100 @@
+import asyncio
+import sqlite3
+
+from app import main
+from app.aggregation import AggregationEngine
+from app.reaction_store import KeyCache, insert_reaction
+from app.replay import (EVENT_COLUMNS, STATE_COLUMNS, ReplayClock, diff_effects, iter_reaction_rows,
+                        replay_effects, row_to_sample)
+from app.sweep import evaluate_config, precompute_window_table
+
+START_MS = 1_700_000_000_000
+
+
+def make_rows(users=10, duration_ms=90_000, interval_ms=500):
+    """手挙げ・拍手・笑顔の山がある記録を作る（reactions_log の行の形式）"""
+    rows = []
+    for t in range(0, duration_ms, interval_ms):
+        for u in range(users):
+            states = {
+                'isHandUp': 10_000 <= t < 25_000 and u < (t - 10_000) // 1500,
+                'isSmiling': 60_000 <= t < 72_000 and u % 2 == 0,
+            }
+            events = {'clap': 1 if 40_000 <= t < 52_000 and u < 6 else 0}
+            rows.append((f"u{u}", START_MS + t + u * 37)
+                        + tuple(int(states.get(name, False)) for _, name in STATE_COLUMNS)
+                        + tuple(events.get(name, 0) for _, name in EVENT_COLUMNS))
+    rows.sort(key=lambda row: row[1])
+    return rows
+
+
+def run_production(rows, monkeypatch):
+    """本番の経路（集約ループのティックと受信時の即時判定を publish_reaction_effect に通す）で effects_log を作る"""
+    logged = []
+    monkeypatch.setattr(main, "log_effect", logged.append)
+    manager = main.ConnectionManager()
+    clock = ReplayClock()
+    engine = manager.aggregation_engine = AggregationEngine(clock=clock, verbose=False, load_shedding=False)
+
+    async def run():
+        next_tick = rows[0][1] + 1000
+        for row in rows:
+            user_id, data = row_to_sample(row)
+            while next_tick <= data['timestamp']:
+                clock.set_ms(next_tick)
+                effect = engine.aggregate()
+                if effect:
+                    await manager.publish_reaction_effect(effect)
+                next_tick += 1000
+            clock.set_ms(data['timestamp'])
+            data['hasMicrophone'] = True
+            manager.update_reaction_data(user_id, data)
+            effect = engine.early_effect()
+            if effect:
+                await manager.publish_reaction_effect(effect)
+        while next_tick <= rows[-1][1] + 3000:
+            clock.set_ms(next_tick)
+            effect = engine.aggregate()
+            if effect:
+                await manager.publish_reaction_effect(effect)
+            next_tick += 1000
+
+    asyncio.run(run())
+    return logged
+
+
+def test_replay_matches_production_effects_log(monkeypatch):
+    rows = make_rows()
+    logged = run_production(rows, monkeypatch)
+    replayed = replay_effects(rows, microphone='all')
+
+    assert any(effect['debug']['mode'] == 'early' for effect in logged)
+    result = diff_effects(replayed, logged)
+    assert result['match_rate'] == 1.0
+    assert len(replayed) == len(logged)
+
+
+def test_sweep_default_config_counts_production_effects(monkeypatch):
+    rows = make_rows()
+    logged = run_production(rows, monkeypatch)
+    table = precompute_window_table(rows, microphone='all')
+
+    result = evaluate_config({"thresholds": {}, "priority": []}, table)
+    assert result['effects'] == len(logged)
+
+
+def test_host_reactions_are_not_replayed(sqlite_db):
+    conn = sqlite3.connect(sqlite_db)
+    conn.executemany("INSERT INTO users (id, experiment_group, created_at, is_host) VALUES (?, 'experiment', 0, ?)",
+                     [("host", 1), ("u0", 0)])
+    keys = KeyCache()
+    for user_id in ("host", "u0", "legacy_host"):
+        insert_reaction(conn, "sqlite", keys, None, user_id, START_MS, None, {'isHandUp': True}, {})
+    conn.commit()
+
+    users = [row[0] for row in iter_reaction_rows(conn, "sqlite")]
+    assert users == ["u0", "legacy_host"]
+    users = [row[0] for row in iter_reaction_rows(conn, "sqlite", exclude_users=["legacy_host"])]
+    assert users == ["u0"]
+    assert len(list(iter_reaction_rows(conn, "sqlite", include_hosts=True))) == 3
+    conn.close()
@@ -0,0 +1,83 @@
+import sqlite3
+import time
+
+from app.analytics import compute_analytics
+from app.reaction_store import KeyCache, insert_reaction
+from app.report import ReportFilter
+from app.retention import read_archive, run_retention
+
+DAY_MS = 86_400_000
+
+
+def add_session(conn, session_id, completed_at, reactions=3, effects=2):
+    conn.execute("INSERT OR IGNORE INTO users (id, experiment_group, created_at) VALUES ('u1', 'experiment', 0)")
+    conn.execute("INSERT INTO sessions (session_id, user_id, video_id, experiment_group, started_at, completed_at, "
+                 "is_completed) VALUES (?, 'u1', 'v1', 'experiment', ?, ?, 1)",
+                 (session_id, completed_at - 60_000, completed_at))
+    keys = KeyCache()
+    for i in range(reactions):
+        insert_reaction(conn, "sqlite", keys, session_id, "u1", completed_at - 60_000 + i * 1000, float(i),
+                        {'isSmiling': i % 2 == 0}, {'clap': 1, 'shakeHead': 2, 'swayHorizontal': i})
+    for i in range(effects):
+        conn.execute("INSERT INTO effects_log (session_id, timestamp, effect_type, intensity, duration_ms) "
+                     "VALUES (?, ?, 'sparkle', 0.5, 2000)", (session_id, completed_at - 30_000 + i))
+    conn.commit()
+
+
+def count(conn, table, session_id):
+    return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+
+def test_expired_sessions_are_archived_and_deleted(sqlite_db, tmp_path):
+    now_ms = int(time.time() * 1000)
+    conn = sqlite3.connect(sqlite_db)
+    add_session(conn, "old", now_ms - 40 * DAY_MS)
+    add_session(conn, "recent", now_ms - 1 * DAY_MS)
+
+    stats = run_retention(conn, "sqlite", days=30, archive_dir=tmp_path / "archive")
+
+    assert stats == {"sessions": 1, "reactions": 3, "effects": 2, "leftover": 0, "errors": 0}
+    assert count(conn, "reactions_log", "old") == 0 and count(conn, "effects_log", "old") == 0
+    assert count(conn, "reactions_log", "recent") == 3 and count(conn, "effects_log", "recent") == 2
+    # セッションの行とロールアップは残る
+    assert count(conn, "sessions", "old") == 1
+    path, reaction_count, smiling_count, clap_total, shake_head_total, sway_horizontal_total = conn.execute(
+        "SELECT archive_path, reaction_count, smiling_count, clap_total, shake_head_total, sway_horizontal_total "
+        "FROM session_rollups WHERE session_id = 'old'").fetchone()
+    assert (reaction_count, smiling_count, clap_total) == (3, 2, 3)
+    assert (shake_head_total, sway_horizontal_total) == (6, 3)
+    archive = read_archive(path)
+    assert archive['session']['session_id'] == "old"
+    assert [r['is_smiling'] for r in archive['reactions']] == [True, False, True]
+    assert len(archive['effects']) == 2
+
+    # 2回目は何もしない
+    assert run_retention(conn, "sqlite", days=30, archive_dir=tmp_path / "archive")["sessions"] == 0
+    conn.close()
+
+
+def test_dry_run_only_counts(sqlite_db, tmp_path):
+    conn = sqlite3.connect(sqlite_db)
+    add_session(conn, "old", int(time.time() * 1000) - 40 * DAY_MS)
+
+    assert run_retention(conn, "sqlite", days=30, archive_dir=tmp_path, dry_run=True)["sessions"] == 1
+    assert count(conn, "reactions_log", "old") == 3
+    conn.close()
+
+
+def test_archived_sessions_stay_in_group_analytics(sqlite_db, tmp_path):
+    now_ms = int(time.time() * 1000)
+    conn = sqlite3.connect(sqlite_db)
+    add_session(conn, "old", now_ms - 40 * DAY_MS)
+    add_session(conn, "recent", now_ms - 1 * DAY_MS)
+    before = compute_analytics(conn, "sqlite", ["reactions"], ReportFilter())["sections"]["reactions"]
+
+    run_retention(conn, "sqlite", days=30, archive_dir=tmp_path / "archive")
+    after = compute_analytics(conn, "sqlite", ["reactions"], ReportFilter())["sections"]["reactions"]
+
+    assert before == after
+    assert after[0]["samples"] == 6 and after[0]["clap_total"] == 6
+    # 期間で絞り込んだ場合は、期間内に開始・完了したアーカイブ済みセッションだけを合算する
+    recent = compute_analytics(conn, "sqlite", ["reactions"], ReportFilter(since_ms=now_ms - 10 * DAY_MS))
+    assert recent["sections"]["reactions"][0]["samples"] == 3
+    conn.close()
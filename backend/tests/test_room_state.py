@@ -0,0 +1,83 @@
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.effect_coalescer import EffectCoalescer
+from app.playback_clock import PlaybackClock
+from app.room_state import RoomState
+
+
+def running_room(now=None, now_ms=None):
+    """動画を選択・再生し、エフェクトを再生中のルーム"""
+    now = time.monotonic() if now is None else now
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    room = RoomState()
+    room.select_video("abc123", now_ms - 60_000)
+    playback_clock = PlaybackClock()
+    playback_clock.update('video_play', 30.0, now=now - 2.0)
+    coalescer = EffectCoalescer()
+    coalescer.observe('experiment', {"effectType": "cheer", "intensity": 0.8, "durationMs": 3000,
+                                     "timestamp": now_ms - 1000})
+    return room, playback_clock, coalescer
+
+
+def test_snapshot_extrapolates_playback_and_trims_running_effect():
+    room, playback_clock, coalescer = running_room(now=500.0, now_ms=10_000)
+
+    snapshot = room.snapshot(playback_clock, coalescer.running['experiment'], now_ms=10_000, now=500.0)
+
+    assert snapshot["videoId"] == "abc123" and snapshot["videoSelectedAt"] == 10_000 - 60_000
+    assert snapshot["playback"] == {"currentTime": pytest.approx(32.0), "isPlaying": True, "ageMs": 2000,
+                                    "fresh": True}
+    # 残り時間だけ再生する
+    assert snapshot["effect"] == {"type": "effect", "effectType": "cheer", "intensity": 0.8, "durationMs": 2000,
+                                  "timestamp": 10_000, "phase": "start"}
+
+
+def test_snapshot_of_empty_room():
+    snapshot = RoomState().snapshot(PlaybackClock(), None, now_ms=10_000, now=500.0)
+
+    assert snapshot == {"videoId": None, "videoSelectedAt": None, "playback": None, "effect": None,
+                        "timestamp": 10_000}
+
+
+def test_finished_effect_is_not_sent():
+    room, _, coalescer = running_room(now=500.0, now_ms=10_000)
+
+    assert room.snapshot(None, coalescer.running['experiment'], now_ms=12_000, now=500.0)["effect"] is None
+
+
+@pytest.mark.parametrize("channels, has_video, has_effect", [
+    (["sync"], True, False),
+    (["effects"], False, True),
+    (["acks"], False, False),
+    (None, True, True),
+])
+def test_connection_established_room_follows_subscriptions(monkeypatch, channels, has_video, has_effect):
+    room, playback_clock, coalescer = running_room()
+    monkeypatch.setattr(main, "ensure_user_exists", lambda *args: None)
+    monkeypatch.setattr(main.manager, "rooms", {'experiment': room})
+    monkeypatch.setattr(main.manager, "playback_clocks", {'experiment': playback_clock})
+    monkeypatch.setattr(main.manager, "effect_coalescer", coalescer)
+    # 集約ループ・ハートビートのタスクは起動しない
+    monkeypatch.setattr(main.manager, "aggregation_task", object())
+    monkeypatch.setattr(main.manager, "heartbeat_task", object())
+    handshake = {"userId": "late", "experimentGroup": "experiment"}
+    if channels is not None:
+        handshake["subscribe"] = channels
+
+    with TestClient(main.app).websocket_connect("/ws") as websocket:
+        websocket.send_text(json.dumps(handshake))
+        established = websocket.receive_json()
+
+    snapshot = established["room"]
+    assert (snapshot["videoId"] == "abc123") is has_video
+    assert (snapshot["playback"] is not None) is has_video
+    if has_video:
+        assert snapshot["playback"]["isPlaying"] and snapshot["playback"]["currentTime"] >= 32.0
+    assert (snapshot["effect"] is not None) is has_effect
+    if has_effect:
+        assert snapshot["effect"]["effectType"] == "cheer" and 0 < snapshot["effect"]["durationMs"] <= 2000
@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+from app.aggregation import AggregationEngine
+from app.snapshot import apply_state, decode_state, encode_state
+
+
+def make_manager(clock):
+    return SimpleNamespace(aggregation_engine=AggregationEngine(clock=clock, verbose=False),
+                           known_users={}, last_random_effect_time=0.0)
+
+
+def reaction(now_ms, hand_up=False):
+    return {'timestamp': now_ms, 'states': {'isHandUp': hand_up}, 'events': {'clap': 0}}
+
+
+def test_round_trip_restores_window_metrics(clock):
+    before = make_manager(clock)
+    engine = before.aggregation_engine
+    before.known_users["u0"] = ("experiment", False)
+    for i in range(6):
+        engine.update_user_data(f"u{i}", {'timestamp': clock() * 1000, 'states': {'isHandUp': i < 2},
+                                          'events': {'clap': i}, 'hasMicrophone': i % 2 == 0})
+    expected = engine.compute_rule_metrics(clock() * 1000)
+
+    after = make_manager(clock)
+    apply_state(after, decode_state(encode_state(before)))
+
+    assert after.known_users == {"u0": ("experiment", False)}
+    assert after.aggregation_engine.compute_rule_metrics(clock() * 1000) == expected
+
+
+def test_only_samples_inside_the_window_are_encoded(clock):
+    before = make_manager(clock)
+    engine = before.aggregation_engine
+    engine.update_user_data("old", {'timestamp': clock() * 1000, 'states': {}, 'events': {}, 'hasMicrophone': True})
+    clock.advance(10)
+    engine.update_user_data("live", reaction(clock() * 1000))
+
+    state = decode_state(encode_state(before))
+    assert list(state['samples']) == ["live"]
+    assert state['microphone'] == {}
+
+
+def test_malformed_samples_do_not_break_encoding(clock):
+    before = make_manager(clock)
+    engine = before.aggregation_engine
+    engine.update_user_data("u0", {'timestamp': "abc", 'states': {'isHandUp': 1, 7: True},
+                                   'events': {'clap': 1e20, 'nod': "3", 'x' * 100: 1, 'cheer': -2}})
+    engine.update_user_data("u1", {'timestamp': float('nan'), 'states': [], 'events': None})
+    # 名前表の上限（state 32個）を超える名前
+    for i in range(40):
+        engine.update_user_data(f"many{i}", {'timestamp': clock() * 1000, 'states': {f"s{i}": True}, 'events': {}})
+
+    state = decode_state(encode_state(before))
+    sample = state['samples']["u0"][0]
+    assert sample['timestamp'] == clock() * 1000
+    assert sample['events'] == {'clap': 2 ** 31 - 1, 'cheer': 0}
+    assert sample['states']['isHandUp'] is True
+    assert state['samples']["u1"][0]['timestamp'] == clock() * 1000
@@ -0,0 +1,72 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import db_stats, main
+from app.db_stats import TTLCache
+
+
+class FakeMonotonic:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def monotonic(monkeypatch):
+    fake = FakeMonotonic()
+    monkeypatch.setattr(db_stats.time, "monotonic", fake)
+    return fake
+
+
+@pytest.fixture
+def status_manager(monkeypatch):
+    manager = main.ConnectionManager()
+    monkeypatch.setattr(main, "manager", manager)
+    monkeypatch.setattr(main, "status_cache", TTLCache(5))
+    return manager
+
+
+def connect(manager, user_id, group='experiment'):
+    manager.active_connections[user_id] = object()
+    manager.user_groups[user_id] = group
+
+
+def test_status_pages_user_lists(status_manager, monotonic):
+    for i in range(5):
+        connect(status_manager, f"u{i}", 'control1' if i % 2 else 'experiment')
+
+    body = TestClient(main.app).get("/status", params={"offset": 1, "limit": 2}).json()
+
+    assert body["connected_users"] == ["u1", "u2"]
+    assert body["user_groups"] == {"u1": "control1", "u2": "experiment"}
+    # 件数とグループ別の人数はページに関係なく全体
+    assert body["active_connections"] == 5
+    assert body["group_counts"] == {"experiment": 3, "control1": 2, "control2": 0}
+    assert body["pagination"] == {"offset": 1, "limit": 2, "total_connected_users": 5,
+                                  "total_aggregation_users": 0}
+
+
+def test_status_clamps_negative_offset_and_limit(status_manager, monotonic):
+    connect(status_manager, "u0")
+
+    body = TestClient(main.app).get("/status", params={"offset": -3, "limit": -1}).json()
+
+    assert body["connected_users"] == []
+    assert body["pagination"]["offset"] == 0 and body["pagination"]["limit"] == 0
+
+
+def test_status_snapshot_is_reused_within_ttl(status_manager, monotonic):
+    client = TestClient(main.app)
+    connect(status_manager, "u0")
+    first = client.get("/status").json()
+
+    connect(status_manager, "u1")
+    monotonic.now += 4
+    assert client.get("/status").json() == first
+
+    monotonic.now += 1
+    refreshed = client.get("/status").json()
+    assert refreshed["connected_users"] == ["u0", "u1"]
+    assert refreshed["active_connections"] == 2
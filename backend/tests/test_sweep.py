@@ -0,0 +1,35 @@
+import json
+from contextlib import contextmanager
+
+from app import sweep
+from tests.test_replay import START_MS, make_rows
+
+
+def test_top_lists_configs_sorted_by_metric(monkeypatch, tmp_path):
+    @contextmanager
+    def fake_db(path=None):
+        yield None, "sqlite"
+
+    monkeypatch.setattr(sweep, "open_db", fake_db)
+    monkeypatch.setattr(sweep, "iter_reaction_rows", lambda conn, db_type, since, until, **options: make_rows())
+    output = tmp_path / "result.json"
+
+    # グリッドの順（0.9 → 0.1）のままだと発動の少ない設定が先頭になる
+    sweep.main(["--grid", "isHandUp=0.9,0.5,0.1", "--workers", "1", "--top", "1", "--output", str(output)])
+
+    results = json.loads(output.read_text())
+    counts = [r['effects_per_min'] for r in results]
+    assert counts == sorted(counts, reverse=True)
+    assert results[0]['config']['thresholds'] == {"isHandUp": 0.1}
+
+
+def test_early_samples_after_last_tick_are_evaluated():
+    table = sweep.precompute_window_table(make_rows())
+    # 手挙げの山（10〜25秒）より前でティックが終わった表
+    cut = next(i for i, t in enumerate(table['tick_times']) if t - START_MS >= 8_000)
+    truncated = dict(table, columns={metric: column[:cut] for metric, column in table['columns'].items()},
+                     gap_before=table['gap_before'][:cut], tick_times=table['tick_times'][:cut], ticks=cut)
+
+    result = sweep.evaluate_config({"thresholds": {}}, truncated)
+
+    assert result['distribution'].get('cheer', 0) > 0
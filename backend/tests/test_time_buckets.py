@@ -0,0 +1,28 @@
+from app.aggregation import AggregationEngine
+from app.effect_rules import DEFAULT_RULE_SET, compile_rules
+from app.time_buckets import TimeBuckets
+
+
+def test_default_rules_use_per_user_window():
+    assert DEFAULT_RULE_SET.windows == {}
+
+
+def test_buckets_are_keyed_by_sample_time():
+    buckets = TimeBuckets()
+    now_ms = 1_700_000_000_000
+    buckets.add(now_ms - 5000, {'isConcentrating': True}, {}, False)
+    buckets.add(now_ms - 200, {'isConcentrating': False}, {}, False)
+    assert buckets.metric_value('ratioState', 'isConcentrating', 1000, now_ms) == 0.0
+    assert buckets.metric_value('ratioState', 'isConcentrating', 10000, now_ms) == 0.5
+
+
+def test_old_samples_do_not_enter_windowed_metrics(clock):
+    rules = compile_rules([
+        {"metric": "isConcentrating", "source": "ratioState", "threshold": 0.4, "effectType": "focus", "windowMs": 10000},
+        {"metric": "clap", "source": "densityEvent", "threshold": 0.15, "effectType": "clapping_icons", "windowMs": 1000},
+    ])
+    engine = AggregationEngine(clock=clock, verbose=False, rules=rules)
+    stale_ms = clock() * 1000 - 200_000
+    engine.update_user_data("restored", {'timestamp': stale_ms, 'states': {'isConcentrating': True},
+                                         'events': {'clap': 3}})
+    assert engine.windowed_metrics(clock() * 1000) == {"ratioState": {}, "densityEvent": {}}
@@ -0,0 +1,59 @@
+import asyncio
+
+from app.video_fanout import VideoControlFanout
+
+
+def control(message_type, current_time):
+    return {"type": message_type, "currentTime": current_time, "timestamp": int(current_time * 1000)}
+
+
+def run_fanout(messages, window_ms=20, room="room"):
+    """同じ窓の中で messages を publish し、窓が閉じるまでに配信されたものを返す"""
+    sent = []
+
+    async def send(message, target):
+        sent.append((target, message))
+
+    async def run():
+        fanout = VideoControlFanout(send, window_ms=window_ms)
+        for message in messages:
+            await fanout.publish(room, message)
+        while fanout.windows:
+            await asyncio.sleep(window_ms / 1000)
+        return fanout
+
+    fanout = asyncio.run(run())
+    assert not fanout.pending
+    return [message for _, message in sent]
+
+
+def test_play_pause_seek_order_is_preserved():
+    sent = run_fanout([
+        control("video_play", 0.0),
+        control("video_pause", 5.0),
+        control("video_play", 6.0),
+        control("video_seek", 9.0),
+    ])
+
+    # 最初のイベントは即座に配信し、窓の間のものは順序を保って配信する（シークは直前の play の位置になる）
+    assert [(m["type"], m["currentTime"]) for m in sent] == [
+        ("video_play", 0.0), ("video_pause", 5.0), ("video_play", 9.0)]
+
+
+def test_seek_burst_collapses_to_last_seek():
+    sent = run_fanout([control("video_seek", float(t)) for t in range(1, 21)])
+
+    assert [(m["type"], m["currentTime"]) for m in sent] == [("video_seek", 1.0), ("video_seek", 20.0)]
+    assert sent[-1]["coalesced"] == 19
+
+
+def test_seek_then_play_sends_play_at_seek_position_once():
+    sent = run_fanout([control("video_pause", 3.0), control("video_seek", 8.0), control("video_play", 8.0)])
+
+    assert [(m["type"], m["currentTime"]) for m in sent] == [("video_pause", 3.0), ("video_play", 8.0)]
+
+
+def test_zero_window_sends_every_event():
+    messages = [control("video_seek", float(t)) for t in range(5)]
+
+    assert run_fanout(messages, window_ms=0) == messages
@@ -93,6 +93,7 @@ const ViewingScreen: React.FC<ViewingScreenProps> = ({ videoId, userId, onComple
     error: wsError,
     sendReactionData,
     sendVideoEvent,
+    sendPlaybackPosition,
     sendTimeSyncRequest,
     sendTimeSyncResponse,
     sendSessionCreate,
@@ -328,6 +329,7 @@ const ViewingScreen: React.FC<ViewingScreenProps> = ({ videoId, userId, onComple
       return;
     }
 
+    let tickCount = 0;
     const checkSeek = setInterval(() => {
       if (playerRef.current) {
         const currentTime = playerRef.current.getCurrentTime();
@@ -340,11 +342,17 @@ const ViewingScreen: React.FC<ViewingScreenProps> = ({ videoId, userId, onComple
         } else {
           lastSeekTimeRef.current = currentTime;
         }
+
+        // 5秒ごとに再生位置をサーバーに送信（サーバーが時刻同期に直接応答するため）
+        tickCount += 1;
+        if (tickCount % 10 === 0) {
+          sendPlaybackPosition(currentTime, playerRef.current.getPlayerState() === 1);
+        }
       }
     }, 500); // 0.5秒ごとにチェック
 
     return () => clearInterval(checkSeek);
-  }, [experimentGroup, isHost, sendVideoEvent]);
+  }, [experimentGroup, isHost, sendVideoEvent, sendPlaybackPosition]);
 
   /**
    * 動画同期イベントを受信した時の処理（experiment群の参加者のみ）
@@ -1127,6 +1127,19 @@ export const useEffectRenderer = ({ canvasRef, currentEffect }: UseEffectRendere
    */
   useEffect(() => {
     if (currentEffect) {
+      // extend/update: 同じエフェクトを再生中ならアニメーションをやり直さず、終了時刻と強度だけ更新
+      const running = currentEffectRef.current;
+      if (
+        (currentEffect.phase === 'extend' || currentEffect.phase === 'update') &&
+        running && running.effectType === currentEffect.effectType
+      ) {
+        const elapsed = performance.now() - effectStartTimeRef.current;
+        if (elapsed < running.durationMs) {
+          currentEffectRef.current = { ...currentEffect, durationMs: elapsed + currentEffect.durationMs };
+          return;
+        }
+      }
+
       console.log('🎨 エフェクト描画開始:', currentEffect.effectType, 'intensity:', currentEffect.intensity);
       currentEffectRef.current = currentEffect;
       effectStartTimeRef.current = performance.now();
@@ -36,6 +36,7 @@ interface UseWebSocketReturn {
   error: string | null;
   sendReactionData: (data: Omit<ReactionData, 'userId' | 'timestamp'>) => void;
   sendVideoEvent: (type: 'video_play' | 'video_pause' | 'video_seek', currentTime: number) => void;
+  sendPlaybackPosition: (currentTime: number, isPlaying: boolean) => void;
   sendTimeSyncRequest: () => void;
   sendTimeSyncResponse: (requesterId: string, currentTime: number) => void;
   sendVideoUrlSelected: (videoId: string) => void;
@@ -101,8 +102,12 @@ export const useWebSocket = (userId: string, experimentGroup: ExperimentGroup =
         setError(null);
         reconnectAttempts.current = 0;
 
-        // 最初のメッセージでuserId、experimentGroup、isHostを送信
-        ws.send(JSON.stringify({ userId, experimentGroup, isHost }));
+        // 最初のメッセージでuserId、experimentGroup、isHost、購読するチャンネルを送信
+        // （受信確認 acks は使わないので購読しない。判定の内訳 debug はdebugモードのみ）
+        const subscribe = ['effects', 'sync'];
+        if (isHost) subscribe.push('host_counts');
+        if (experimentGroup === 'debug') subscribe.push('debug');
+        ws.send(JSON.stringify({ userId, experimentGroup, isHost, subscribe }));
         console.log(`📋 実験グループ: ${experimentGroup}${isHost ? ' (HOST)' : ''}`);
       };
 
@@ -114,12 +119,32 @@ export const useWebSocket = (userId: string, experimentGroup: ExperimentGroup =
 
           if (data.type === 'connection_established') {
             console.log('🎉 接続確立:', data.message);
+            // 途中参加: ルームの現在の状態（選択中の動画・再生位置・再生中のエフェクト）を適用
+            const room = data.room;
+            if (room) {
+              if (room.videoId) {
+                setVideoUrlSelectedEvent({ videoId: room.videoId, timestamp: room.videoSelectedAt ?? room.timestamp });
+              }
+              if (room.playback && room.playback.currentTime !== null) {
+                setVideoSyncEvent({
+                  type: room.playback.isPlaying ? 'video_play' : 'video_pause',
+                  currentTime: room.playback.currentTime,
+                  timestamp: room.timestamp
+                });
+              }
+              if (room.effect) {
+                setCurrentEffect(room.effect as EffectInstruction);
+              }
+            }
           } else if (data.type === 'echo') {
             console.log('🔄 Echoレスポンス受信:', data.original);
           } else if (data.type === 'effect') {
             // エフェクト指示を受信
             console.log('✨ エフェクト指示受信:', data.effectType, 'intensity:', data.intensity);
             setCurrentEffect(data as EffectInstruction);
+          } else if (data.type === 'ping') {
+            // ハートビート（サーバーからの生存確認）に応答
+            ws.send(JSON.stringify({ type: 'pong', timestamp: Date.now() }));
           } else if (data.type === 'data_received') {
             // データ受信確認（デバッグ用）
             // console.log('✅ データ受信確認:', data.message);
@@ -240,6 +265,26 @@ export const useWebSocket = (userId: string, experimentGroup: ExperimentGroup =
     }
   }, []);
 
+  /**
+   * 再生位置を定期送信（experiment群のホスト用、サーバーの再生位置モデルを更新）
+   */
+  const sendPlaybackPosition = useCallback((currentTime: number, isPlaying: boolean) => {
+    if (!wsRef.current || wsRef.current.readyState !== WebSocket.OPEN) {
+      return;
+    }
+
+    try {
+      wsRef.current.send(JSON.stringify({
+        type: 'video_position',
+        currentTime,
+        isPlaying,
+        timestamp: Date.now()
+      }));
+    } catch (err) {
+      console.error('❌ 再生位置送信エラー:', err);
+    }
+  }, []);
+
   /**
    * 時刻同期リクエストを送信（被験者 → ホスト）
    */
@@ -412,6 +457,7 @@ export const useWebSocket = (userId: string, experimentGroup: ExperimentGroup =
     error,
     sendReactionData,
     sendVideoEvent,
+    sendPlaybackPosition,
     sendTimeSyncRequest,
     sendTimeSyncResponse,
     sendVideoUrlSelected,
@@ -48,9 +48,23 @@ export interface EffectInstruction {
   intensity: number;
   durationMs: number;
   timestamp: number;
+  // サーバー側の合流結果（extend/updateは再生中の同じエフェクトを延長・強度更新する）
+  phase?: 'start' | 'switch' | 'update' | 'extend';
+  // 判定の内訳（debug チャンネルを購読している場合のみ）
   debug?: {
     activeUsers: number;
     ratioState: Record<string, number>;
     densityEvent: Record<string, number>;
+    // 過負荷時はサンプリングしたユーザーからの推定値（sampling に95%信頼区間）
+    // early は受信時の即時判定（ティックを待たずに発動。ratioState / densityEvent は判定に使った指標のみ）
+    mode?: 'exact' | 'sampled' | 'early';
+    sampling?: {
+      sampleSize: number;
+      sampledActiveUsers: number;
+      populationUsers: number;
+      confidenceLevel: number;
+      ratioStateInterval: Record<string, [number, number]>;
+      densityEventInterval: Record<string, [number, number] | null>;
+    };
   };
 }
\ No newline at end of file